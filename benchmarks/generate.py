@@ -0,0 +1,271 @@
+"""
+benchmarks.generate
+
+Generates synthetic operator bundles of a given size, so that benchmarks do
+not depend on the few small bundles of the tests. A bundle has a package,
+a CSV for each of its versions, each replacing the previous one, and CRDs
+owned by every CSV. Bundles are deterministic: the same parameters always
+produce the same files.
+
+Run it from the repository root with e.g.
+`python -m benchmarks.generate bundle --layout nested --versions 10`.
+"""
+import argparse
+import json
+import os
+
+import yaml
+
+LAYOUT_FLAT = 'flat'
+LAYOUT_NESTED = 'nested'
+LAYOUTS = (LAYOUT_FLAT, LAYOUT_NESTED)
+
+GROUP = 'benchmark.example.com'
+CRD_VERSION = 'v1alpha1'
+CHANNEL = 'alpha'
+
+# the types of the properties of the generated schemas, in turn
+_PROPERTY_TYPES = ('string', 'integer', 'boolean', 'object')
+
+
+def generate_bundle(dest_dir, layout=LAYOUT_FLAT, versions=1, crds=1,
+                    schema_properties=10, alm_examples=1,
+                    package_name='benchmark-operator'):
+    """
+    Write a synthetic bundle into dest_dir, which is created if it does not
+    exist.
+
+    :param dest_dir: the directory the bundle is written into
+    :param layout: "flat", with every file in dest_dir, or "nested", with
+                   the package in dest_dir and a directory of the CSV and
+                   CRDs of each version
+    :param versions: the number of versions, i.e. of CSVs
+    :param crds: the number of CRDs owned by every CSV
+    :param schema_properties: the number of properties of the
+                              openAPIV3Schema of each CRD, which sets the
+                              size of CRDs
+    :param alm_examples: the number of examples in the alm-examples
+                         annotation of each CSV, each setting every property
+                         of the schema of its CRD
+    :param package_name: the packageName of the bundle
+    :return: the list of paths of the written files, relative to dest_dir
+    """
+    if layout not in LAYOUTS:
+        raise ValueError('Unknown layout %r, expected one of: %s.'
+                         % (layout, ', '.join(LAYOUTS)))
+    if versions < 1 or crds < 1:
+        raise ValueError('A bundle needs at least one version and one CRD.')
+
+    crd_list = [_get_crd(index, schema_properties) for index in range(crds)]
+    csv_versions = ['%d.0.0' % (major + 1) for major in range(versions)]
+    files = {}  # { RELATIVE_PATH => YAML_DATA }
+    files['%s.package.yaml' % package_name] = {
+        'packageName': package_name,
+        'channels': [{
+            'name': CHANNEL,
+            'currentCSV': _get_csv_name(package_name, csv_versions[-1]),
+        }],
+    }
+    for index, version in enumerate(csv_versions):
+        previous_version = csv_versions[index - 1] if index else None
+        csv = _get_csv(package_name, version, previous_version, crd_list,
+                       schema_properties, alm_examples)
+        if layout == LAYOUT_FLAT:
+            version_dir = ''
+            csv_file_name = '%s.v%s.clusterserviceversion.yaml' % (
+                package_name, version)
+        else:
+            version_dir = version
+            csv_file_name = '%s.clusterserviceversion.yaml' % package_name
+        files[os.path.join(version_dir, csv_file_name)] = csv
+        # a flat bundle has one copy of the CRDs shared by every CSV
+        if layout == LAYOUT_NESTED or index == 0:
+            for crd in crd_list:
+                crd_file_name = '%s.crd.yaml' % crd['metadata']['name']
+                files[os.path.join(version_dir, crd_file_name)] = crd
+
+    for path, yaml_data in files.items():
+        file_path = os.path.join(dest_dir, path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            yaml.safe_dump(yaml_data, f, default_flow_style=False)
+    return sorted(files)
+
+
+def _get_csv_name(package_name, version):
+    return '%s.v%s' % (package_name, version)
+
+
+def _get_schema_properties(schema_properties):
+    properties = {}
+    for index in range(schema_properties):
+        property_type = _PROPERTY_TYPES[index % len(_PROPERTY_TYPES)]
+        schema = {
+            'type': property_type,
+            'description': 'Generated property %d of type %s.' % (index, property_type),
+        }
+        if property_type == 'object':
+            schema['properties'] = {
+                'name': {'type': 'string'},
+                'replicas': {'type': 'integer', 'minimum': 1},
+            }
+        properties['property%d' % index] = schema
+    return properties
+
+
+def _get_example_spec(schema_properties, example):
+    values = {
+        'string': lambda index: 'value-%d-%d' % (example, index),
+        'integer': lambda index: example * schema_properties + index,
+        'boolean': lambda index: (example + index) % 2 == 0,
+        'object': lambda index: {'name': 'object-%d' % index, 'replicas': 1},
+    }
+    return {'property%d' % index:
+            values[_PROPERTY_TYPES[index % len(_PROPERTY_TYPES)]](index)
+            for index in range(schema_properties)}
+
+
+def _get_crd(index, schema_properties):
+    kind = 'Benchmark%d' % index
+    plural = 'benchmark%ds' % index
+    return {
+        'apiVersion': 'apiextensions.k8s.io/v1beta1',
+        'kind': 'CustomResourceDefinition',
+        'metadata': {'name': '%s.%s' % (plural, GROUP)},
+        'spec': {
+            'group': GROUP,
+            'names': {
+                'kind': kind,
+                'listKind': '%sList' % kind,
+                'plural': plural,
+                'singular': plural[:-1],
+            },
+            'scope': 'Namespaced',
+            'version': CRD_VERSION,
+            'versions': [{'name': CRD_VERSION, 'served': True, 'storage': True}],
+            'validation': {
+                'openAPIV3Schema': {
+                    'type': 'object',
+                    'properties': {
+                        'spec': {
+                            'type': 'object',
+                            'properties': _get_schema_properties(schema_properties),
+                        },
+                    },
+                },
+            },
+        },
+    }
+
+
+def _get_csv(package_name, version, previous_version, crd_list,
+             schema_properties, alm_examples):
+    name = _get_csv_name(package_name, version)
+    examples = [{
+        'apiVersion': '%s/%s' % (GROUP, CRD_VERSION),
+        'kind': crd['spec']['names']['kind'],
+        'metadata': {'name': 'example-%d' % example},
+        'spec': _get_example_spec(schema_properties, example),
+    } for crd in crd_list for example in range(alm_examples)]
+    description = ('A generated operator for benchmarks.\n\n'
+                   'It owns %d custom resource definitions.' % len(crd_list))
+    install_modes = [{'type': install_mode, 'supported': True}
+                     for install_mode in ('OwnNamespace', 'SingleNamespace',
+                                          'MultiNamespace', 'AllNamespaces')]
+    owned_crds = [{
+        'name': crd['metadata']['name'],
+        'kind': crd['spec']['names']['kind'],
+        'version': CRD_VERSION,
+        'displayName': crd['spec']['names']['kind'],
+        'description': 'A generated custom resource.',
+    } for crd in crd_list]
+    csv = {
+        'apiVersion': 'operators.coreos.com/v1alpha1',
+        'kind': 'ClusterServiceVersion',
+        'metadata': {
+            'name': name,
+            'namespace': 'placeholder',
+            'annotations': {
+                'alm-examples': json.dumps(examples, indent=2, sort_keys=True),
+                'capabilities': 'Basic Install',
+                'categories': 'Developer Tools',
+                'certified': 'false',
+                'containerImage': 'quay.io/benchmark/%s:v%s' % (package_name,
+                                                                version),
+                'createdAt': '2019-01-01T00:00:00Z',
+                'description': 'A generated operator for benchmarks.',
+                'support': 'Benchmarks',
+            },
+        },
+        'spec': {
+            'displayName': 'Benchmark Operator',
+            'description': description,
+            'icon': [{'base64data': 'PHN2Zy8+', 'mediatype': 'image/svg+xml'}],
+            'version': version,
+            'maturity': CHANNEL,
+            'provider': {'name': 'Benchmarks'},
+            'installModes': install_modes,
+            'install': {
+                'strategy': 'deployment',
+                'spec': {
+                    'deployments': [{
+                        'name': package_name,
+                        'spec': {
+                            'replicas': 1,
+                            'selector': {'matchLabels': {'name': package_name}},
+                            'template': {
+                                'metadata': {'labels': {'name': package_name}},
+                                'spec': {
+                                    'serviceAccountName': package_name,
+                                    'containers': [{
+                                        'name': package_name,
+                                        'image': 'quay.io/benchmark/%s:v%s'
+                                                 % (package_name, version),
+                                    }],
+                                },
+                            },
+                        },
+                    }],
+                },
+            },
+            'customresourcedefinitions': {'owned': owned_crds},
+        },
+    }
+    if previous_version is not None:
+        csv['spec']['replaces'] = _get_csv_name(package_name, previous_version)
+    return csv
+
+
+def add_generator_arguments(parser):
+    """
+    Add the arguments of generate_bundle to an argparse parser.
+
+    :param parser: the argparse.ArgumentParser to add the arguments to
+    """
+    parser.add_argument('--versions', type=int, default=5,
+                        help='The number of versions of the bundle.')
+    parser.add_argument('--crds', type=int, default=3,
+                        help='The number of CRDs owned by every version.')
+    parser.add_argument('--schema-properties', dest='schema_properties',
+                        type=int, default=50,
+                        help='The number of properties of the schema of each CRD.')
+    parser.add_argument('--alm-examples', dest='alm_examples', type=int, default=2,
+                        help='The number of alm-examples of each CRD in every CSV.')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic operator bundle for benchmarks.')
+    parser.add_argument('dest_dir', help='The directory the bundle is written into.')
+    parser.add_argument('--layout', choices=LAYOUTS, default=LAYOUT_FLAT,
+                        help='The layout of the bundle.')
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    paths = generate_bundle(args.dest_dir, args.layout, args.versions, args.crds,
+                            args.schema_properties, args.alm_examples)
+    print('Wrote %d files to %s' % (len(paths), args.dest_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+benchmarks.startup
+
+Measures the wall time of short operator-courier invocations, which is
+dominated by interpreter startup and imports: `operator-courier --help`, and
+nesting a small flat bundle.
+
+Run it from the repository root with `python benchmarks/startup.py`.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  os.pardir, 'tests', 'test_files', 'bundles',
+                                  'api', 'valid_flat_bundle')
+
+
+def get_cli_command():
+    """
+    :return: the command of the installed operator-courier script, or of the
+             cli module run by the current interpreter
+    """
+    script = shutil.which('operator-courier')
+    if script:
+        return [script]
+    return [sys.executable, '-c',
+            'from operatorcourier.cli import main; main()']
+
+
+def time_command(command, runs):
+    """
+    :param command: the command line to run
+    :param runs: the number of times the command is run
+    :return: the list of wall times of the runs in seconds
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the startup time of operator-courier commands.')
+    parser.add_argument('--runs', type=int, default=20,
+                        help='The number of runs of each command.')
+    parser.add_argument('--source-dir', dest='source_dir',
+                        default=DEFAULT_SOURCE_DIR,
+                        help='The flat bundle directory that is nested.')
+    args = parser.parse_args()
+
+    cli = get_cli_command()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = os.path.join(tmp_dir, 'nested')
+        commands = [
+            ('--help', cli + ['--help']),
+            ('nest', cli + ['nest', args.source_dir, output_dir, '--sync']),
+        ]
+        print('%-8s %10s %10s %10s' % ('command', 'min ms', 'median ms', 'max ms'))
+        for name, command in commands:
+            durations = time_command(command, args.runs)
+            print('%-8s %10.1f %10.1f %10.1f' % (
+                name, min(durations) * 1000, statistics.median(durations) * 1000,
+                max(durations) * 1000))
+
+
+if __name__ == '__main__':
+    main()
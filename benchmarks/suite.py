@@ -0,0 +1,228 @@
+"""
+benchmarks.suite
+
+Measures the throughput and peak memory of the subsystems of
+operator-courier on a synthetic bundle, see benchmarks.generate: parsing and
+type checking manifests with identify, BuildCmd, ValidateCmd, format_bundle,
+and nest and flatten of a whole bundle directory.
+
+Each subsystem is measured with each yaml backend available: the pure python
+loader of PyYAML, and the libyaml loader when PyYAML is built with it. The
+backend is swapped for the loader identify parses manifests with. Dumping is
+not affected by the backend.
+
+Run it from the repository root with e.g.
+`python -m benchmarks.suite --versions 10 --crds 5`.
+"""
+import argparse
+import contextlib
+import copy
+import functools
+import gc
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from unittest import mock
+
+import yaml
+
+from benchmarks.generate import (LAYOUT_FLAT, LAYOUT_NESTED, add_generator_arguments,
+                                 generate_bundle)
+from operatorcourier import api, identify
+from operatorcourier.build import BuildCmd
+from operatorcourier.format import format_bundle
+from operatorcourier.validate import ValidateCmd
+
+SUBSYSTEMS = ('identify', 'build', 'validate', 'format', 'nest', 'flatten')
+
+Result = namedtuple('Result', ['backend', 'subsystem', 'duration', 'bundles_per_second',
+                               'megabytes_per_second', 'peak_megabytes'])
+
+
+def get_yaml_backends():
+    """
+    :return: a list of tuples of the name of each available yaml backend,
+             and of its safe loader class
+    """
+    backends = [('pyyaml', yaml.SafeLoader)]
+    if getattr(yaml, '__with_libyaml__', False):
+        backends.append(('libyaml', yaml.CSafeLoader))
+    return backends
+
+
+@contextlib.contextmanager
+def use_yaml_loader(loader):
+    """
+    Parse manifests with loader within the context.
+
+    :param loader: the yaml loader class, e.g. yaml.CSafeLoader
+    """
+    with mock.patch.object(identify, 'safe_load',
+                           functools.partial(yaml.load, Loader=loader)):
+        yield
+
+
+def measure(func, setup, repeat):
+    """
+    Measure the best duration of func out of repeat runs, and the peak memory
+    allocated by a separate run, since tracing allocations slows func down.
+
+    :param func: the function to measure, called with the result of setup
+    :param setup: a function called before each run, whose duration is not
+                  measured, returning the argument of func
+    :param repeat: the number of timed runs
+    :return: a tuple of the best duration in seconds, and of the peak memory
+             allocated in bytes
+    """
+    durations = []
+    for _ in range(repeat):
+        argument = setup()
+        gc.collect()
+        start = time.perf_counter()
+        func(argument)
+        durations.append(time.perf_counter() - start)
+
+    argument = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(argument)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(durations), peak
+
+
+def run_suite(work_dir, subsystems=SUBSYSTEMS, backends=None, repeat=5,
+              **generator_kwargs):
+    """
+    Generate a flat and a nested bundle in work_dir, and measure each
+    subsystem with each yaml backend.
+
+    :param work_dir: an empty directory for the bundles and the output of
+                     nest and flatten
+    :param subsystems: the names of the subsystems to measure, see SUBSYSTEMS
+    :param backends: the names of the yaml backends to measure with, defaults
+                     to every available backend, see get_yaml_backends
+    :param repeat: the number of timed runs of each measurement
+    :param generator_kwargs: the size of the bundles, see
+                             generate.generate_bundle
+    :return: a list of Results
+    """
+    flat_dir = os.path.join(work_dir, LAYOUT_FLAT)
+    nested_dir = os.path.join(work_dir, LAYOUT_NESTED)
+    output_dir = os.path.join(work_dir, 'output')
+    paths = generate_bundle(flat_dir, LAYOUT_FLAT, **generator_kwargs)
+    generate_bundle(nested_dir, LAYOUT_NESTED, **generator_kwargs)
+
+    bundle_data = []
+    for path in paths:
+        with open(os.path.join(flat_dir, path)) as f:
+            bundle_data.append((path, f.read()))
+    flat_size = sum(len(content.encode('utf-8')) for _, content in bundle_data)
+    nested_size = sum(os.path.getsize(os.path.join(root, file_name))
+                      for root, _, file_names in os.walk(nested_dir)
+                      for file_name in file_names)
+    bundle = BuildCmd().build_bundle(bundle_data)
+
+    def get_output_dir():
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return output_dir
+
+    # { SUBSYSTEM => (FUNCTION, SETUP, INPUT_SIZE) }
+    benchmarks = {
+        'identify': (
+            lambda data: [identify.load_operator_artifact(content)
+                          for _, content in data],
+            lambda: bundle_data, flat_size),
+        'build': (BuildCmd().build_bundle, lambda: bundle_data, flat_size),
+        'validate': (lambda bundle: ValidateCmd().validate(bundle),
+                     lambda: copy.deepcopy(bundle), flat_size),
+        'format': (format_bundle, lambda: copy.deepcopy(bundle), flat_size),
+        'nest': (lambda output: api.nest(flat_dir, output),
+                 get_output_dir, flat_size),
+        'flatten': (lambda output: api.flatten(nested_dir, output),
+                    get_output_dir, nested_size),
+    }
+
+    available_backends = get_yaml_backends()
+    if backends is not None:
+        unknown_backends = set(backends) - {name for name, _ in available_backends}
+        if unknown_backends:
+            raise ValueError('Unavailable yaml backends: %s.'
+                             % ', '.join(sorted(unknown_backends)))
+        available_backends = [(name, loader) for name, loader in available_backends
+                              if name in backends]
+
+    results = []
+    for backend, loader in available_backends:
+        with use_yaml_loader(loader):
+            for subsystem in subsystems:
+                func, setup, size = benchmarks[subsystem]
+                duration, peak = measure(func, setup, repeat)
+                results.append(Result(
+                    backend, subsystem, duration,
+                    1 / duration if duration else 0.0,
+                    size / duration / 1e6 if duration else 0.0,
+                    peak / 1e6))
+    shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+
+def format_results(results):
+    """
+    :param results: the list of Results returned by run_suite
+    :return: a table of the results
+    """
+    lines = ['%-8s %-9s %10s %10s %8s %9s' % ('backend', 'subsystem', 'best ms',
+                                              'bundles/s', 'MB/s', 'peak MB')]
+    for result in results:
+        lines.append('%-8s %-9s %10.2f %10.2f %8.2f %9.2f' % (
+            result.backend, result.subsystem, result.duration * 1000,
+            result.bundles_per_second, result.megabytes_per_second,
+            result.peak_megabytes))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the throughput and peak memory of the subsystems '
+                    'of operator-courier on a synthetic bundle.')
+    add_generator_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='The number of timed runs of each measurement.')
+    parser.add_argument('--subsystem', dest='subsystems', action='append',
+                        choices=SUBSYSTEMS,
+                        help='A subsystem to measure, can be given several '
+                             'times. Defaults to every subsystem.')
+    parser.add_argument('--backend', dest='backends', action='append',
+                        choices=[name for name, _ in get_yaml_backends()],
+                        help='A yaml backend to measure with, can be given '
+                             'several times. Defaults to every available backend.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the results as JSON lines, e.g. to compare '
+                             'them between revisions.')
+    args = parser.parse_args()
+
+    # the generated bundles are valid, but validation logs every csv at info
+    logging.getLogger('operatorcourier').setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run_suite(work_dir, args.subsystems or SUBSYSTEMS, args.backends,
+                            args.repeat, versions=args.versions, crds=args.crds,
+                            schema_properties=args.schema_properties,
+                            alm_examples=args.alm_examples)
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result._asdict(), sort_keys=True))
+    else:
+        print(format_results(results))
+
+
+if __name__ == '__main__':
+    main()
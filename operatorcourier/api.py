@@ -7,14 +7,16 @@ when using the operator-courier package
 
 import os
 import logging
-from tempfile import TemporaryDirectory
-from distutils.dir_util import copy_tree
+import time
 import yaml
-from operatorcourier.verified_manifest import VerifiedManifest
-from operatorcourier.push import PushCmd
-from operatorcourier.nest import nest_bundles
+# verified_manifest, push, pull and bulk import modules that are slow to import,
+# such as requests, so they are imported by the functions that use them
+from operatorcourier.nest import nest_bundles, get_nested_manifest_files
 from operatorcourier.flatten import flatten_bundles
-from operatorcourier.errors import OpCourierBadBundle
+from operatorcourier.catalog import process_catalog
+from operatorcourier.defaults import DEFAULT_CONCURRENCY, DEFAULT_RETRY_BACKOFF
+from operatorcourier.fileops import check_link_mode, OutputFile, LINK_MODE_COPY
+from operatorcourier.errors import OpCourierBadBundle, OpCourierQuayError
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +47,8 @@ def build_and_verify(source_dir=None, yamls=None, ui_validate_io=False,
         logger.error(msg)
         raise TypeError(msg)
 
+    from operatorcourier.verified_manifest import VerifiedManifest
+
     verified_manifest = VerifiedManifest(source_dir, yamls, ui_validate_io, repository)
 
     if validation_output:
@@ -60,11 +64,12 @@ def build_and_verify(source_dir=None, yamls=None, ui_validate_io=False,
 
 def build_verify_and_push(namespace, repository, revision, token,
                           source_dir=None, yamls=None,
-                          validation_output=None):
+                          validation_output=None, push_cmd=None):
     """Build verify and push constructs the operator bundle,
     verifies it, and pushes it to an external app registry.
-    Currently the only supported app registry is the one
-    located at Quay.io (https://quay.io/cnr/api/v1/packages/)
+    By default the bundle is pushed to the app registry located at
+    Quay.io (https://quay.io/cnr/api/v1/packages/), see push.PushCmd
+    to push to another registry.
 
     :param namespace: Quay namespace where the repository we are
                       pushing the bundle is located.
@@ -74,30 +79,138 @@ def build_verify_and_push(namespace, repository, revision, token,
     :param source_dir: Path to local directory of yaml files to be read
     :param yamls: List of yaml strings to create bundle with
     :param validation_output: Path to optional output file for validation logs
+    :param push_cmd: Optional configured PushCmd used to push the bundle,
+                     e.g. with a custom compression level. Defaults to PushCmd().
 
     :raises TypeError: When called with both source_dir and yamls specified
 
     :raises OpCourierBadYaml: When an invalid yaml file is encountered
     :raises OpCourierBadBundle: When the resulting bundle fails validation
 
+    :return: The push.PushResult with the sha256 digest of the pushed archive,
+             the attempts made to push it, and the durations and sizes of
+             every phase of the push, from validation to upload
+
     :raises OpCourierQuayCommunicationError: When communication with Quay fails
     :raises OpCourierQuayErrorResponse: When Quay responds with an error
     :raises OpCourierQuayError: When the request fails in an unexpected way
     """
+    from operatorcourier.push import PushCmd
+
+    validate_start = time.monotonic()
     verified_manifest = build_and_verify(source_dir, yamls, repository=repository,
                                          validation_output=validation_output)
+    validate_duration = time.monotonic() - validate_start
+    if push_cmd is None:
+        push_cmd = PushCmd()
+
+    # the bundle is archived straight from memory or source_dir
     if not verified_manifest.nested:
-        with TemporaryDirectory(prefix=repository+"-") as temp_dir:
-            with open(os.path.join(temp_dir, 'bundle.yaml'), 'w') as outfile:
-                yaml.dump(verified_manifest.bundle, outfile, default_flow_style=False)
-            PushCmd().push(temp_dir, namespace, repository, revision, token)
+        bundle_yaml = yaml.dump(verified_manifest.bundle, default_flow_style=False)
+        bundle_files = [OutputFile('bundle.yaml', content=bundle_yaml.encode('utf-8'))]
     else:
-        with TemporaryDirectory(prefix=repository+"-") as temp_dir:
-            copy_tree(source_dir, temp_dir)
-            PushCmd().push(temp_dir, namespace, repository, revision, token)
+        bundle_files = get_nested_manifest_files(source_dir)
+
+    try:
+        result = push_cmd.push_files(bundle_files, namespace, repository, revision,
+                                     token)
+    except OpCourierQuayError as e:
+        if e.push_result is not None:
+            _add_validate_phase(e.push_result, validate_duration)
+        raise
+    _add_validate_phase(result, validate_duration)
+    return result
+
+
+def _add_validate_phase(push_result, duration):
+    # validation is the first phase of the push
+    push_result.phase_durations = dict(validate=duration,
+                                       **push_result.phase_durations)
+
+
+def push_many(entries, token, concurrency=DEFAULT_CONCURRENCY, rate_limit=None,
+              retries=0, retry_backoff=DEFAULT_RETRY_BACKOFF,
+              skip_unchanged=False, registry_url=None, journal=None, resume=False):
+    """Push many builds, verifies and pushes several bundles concurrently.
+    The pushes share a pool of connections to the app registry.
+
+    :param entries: List of the bundles to push, where each entry is a dict
+                    with the "source_dir", "namespace", "repository" and
+                    "release" of the bundle.
+    :param token: Basic authentication token used to authorize every push
+    :param concurrency: The maximum number of bundles pushed concurrently
+    :param rate_limit: The maximum number of pushes started per second against
+                       the app registry, unlimited by default
+    :param retries: The number of times a push is retried after a transient
+                    failure, see push.PushCmd
+    :param retry_backoff: The delay in seconds before the first retry of a push
+    :param skip_unchanged: Look up each release in the app registry first, and
+                           skip its upload if the registry already has an
+                           archive with the same digest
+    :param registry_url: Base URL of the CNR app registry API, defaults to
+                         the OPERATOR_COURIER_REGISTRY_URL environment variable,
+                         or to https://quay.io/cnr
+    :param journal: Path of an append-only journal file, where each entry that
+                    was pushed, or is unchanged in the app registry, is recorded
+                    as a JSON line with its namespace, repository, release and
+                    archive digest
+    :param resume: Skip the entries that the journal records as done, so a
+                   restarted bulk push only pushes the remaining entries
+
+    :return: A list of per-entry reports in the order of entries, where each
+             report is a dict with the fields of the entry, the "status"
+             ("success", "unchanged", "skipped" or "error"), the "errors"
+             of the push, and the archive "digest", "attempts",
+             "attempt_durations" and "phase_durations" of the push if it
+             was attempted
+
+    :raises TypeError: When called with resume but without journal
+    :raises OpCourierValueError: When an entry is missing a field
+    """
+    from operatorcourier.bulk import load_push_entries, push_entries
+
+    if resume and journal is None:
+        msg = 'resume can only be specified together with journal.'
+        logger.error(msg)
+        raise TypeError(msg)
+    return push_entries(load_push_entries(entries), token, concurrency, rate_limit,
+                        retries, retry_backoff, skip_unchanged, registry_url,
+                        journal, resume)
+
+
+def pull(namespace, repository, release, token=None, registry_url=None,
+         cache_dir=None):
+    """Pull fetches a released bundle back from the app registry, and converts
+    it into a bundle object, the inverse of `build_verify_and_push`.
+
+    Archives are cached locally by their digest, and fetched with conditional
+    requests, so pulling an unchanged release again does not download it.
+
+    :param namespace: Quay namespace where the repository of the release is located.
+    :param repository: Application repository name of the release.
+    :param release: Release version of the bundle.
+    :param token: Optional authentication token, required for private repositories
+    :param registry_url: Base URL of the CNR app registry API, defaults to
+                         the OPERATOR_COURIER_REGISTRY_URL environment variable,
+                         or to https://quay.io/cnr
+    :param cache_dir: Directory of the local cache, defaults to the
+                      OPERATOR_COURIER_CACHE_DIR environment variable,
+                      or to ~/.cache/operator-courier
+
+    :return: The bundle, a dict with the lists of "customResourceDefinitions",
+             "clusterServiceVersions" and "packages" in its "data"
+
+    :raises OpCourierQuayCommunicationError: When communication with Quay fails
+    :raises OpCourierQuayErrorResponse: When Quay responds with an error
+    """
+    from operatorcourier.pull import PullCmd
 
+    pull_cmd = PullCmd(registry_url=registry_url, cache_dir=cache_dir)
+    return pull_cmd.pull(namespace, repository, release, token).bundle
 
-def nest(source_dir, output_dir):
+
+def nest(source_dir, output_dir, link_mode=LINK_MODE_COPY, sync=False, delete=False,
+         dry_run=False, passthrough=False, workers=None):
     """Nest takes a flat bundle directory and version nests it
     to eventually be consumed as part of an operator-registry image build.
 
@@ -107,18 +220,51 @@ def nest(source_dir, output_dir):
     If the input directory is already nested, this method will copy the files and
     folders as is, with non-manifest files and folders excluded.
 
+    Without sync, the output is written into a staging directory next to
+    output_dir, so nothing is published if writing fails. When output_dir is
+    missing or empty, the staging directory replaces it with a single atomic
+    rename. Otherwise the staged files are moved into output_dir one rename
+    at a time, so a crash while publishing can leave it partly updated.
+    In sync mode, files are written straight into output_dir one at a time,
+    and publishing is not atomic either.
 
     :param source_dir: Path to local directory of yaml files to be read
     :param output_dir: Path of your directory to be populated.
                        If directory does not exist, it will be created.
+    :param link_mode: How files of an already nested input directory are placed
+                      in output_dir, one of "copy", "hardlink", "reflink" or
+                      "symlink". Falls back to copying when the filesystem
+                      does not support the link mode.
+    :param sync: Incrementally sync output_dir, and only write the files that
+                 are missing or whose size or digest changed.
+    :param delete: In sync mode, also remove files in output_dir which are
+                   not part of the nested bundle.
+    :param dry_run: Only plan the operations, without touching output_dir.
+    :param passthrough: Write the original bytes of the files of a flat input
+                        directory into the nested layout, instead of re-serializing
+                        their parsed yaml. link_mode then applies to them as well.
+    :param workers: The maximum number of worker processes serializing the CSVs
+                    of a flat input directory, defaults to the number of
+                    processors.
+
+    :return: In dry run mode, the list of planned operations, where each
+             operation is a dict with the "operation", the "path" relative to
+             output_dir, the "source" file path if any, the size in "bytes", and
+             in sync mode the "state" of the file.
+             In sync mode, a dict with the lists of "added", "changed", "removed"
+             and "unchanged" file paths relative to output_dir, otherwise None
 
+    :raises TypeError: When called with delete but without sync
     :raises OpCourierBadYaml: When an invalid yaml file is encountered
     """
+    _check_sync_args(sync, delete)
     if source_dir and output_dir:
-        nest_bundles(source_dir, output_dir)
+        return nest_bundles(source_dir, output_dir, link_mode, sync, delete,
+                            workers=workers, dry_run=dry_run, passthrough=passthrough)
 
 
-def flatten(source_dir, dest_dir):
+def flatten(source_dir, dest_dir, link_mode=LINK_MODE_COPY, sync=False, delete=False,
+            dry_run=False):
     """
     Given a directory containing different versions of operator bundles
     (CRD, CSV, package) in separate version directories, this function
@@ -128,6 +274,78 @@ def flatten(source_dir, dest_dir):
     :param source_dir: the directory containing different versions
     of operator bundles (CRD, CSV, package) in separate version directories
     :param dest_dir: the flattened directory path where all necessary files are copied
+    :param link_mode: How files are placed in dest_dir, one of "copy", "hardlink",
+    "reflink" or "symlink". Falls back to copying when the filesystem does not
+    support the link mode.
+    :param sync: Incrementally sync dest_dir, and only write the files that
+    are missing or whose size or digest changed.
+    :param delete: In sync mode, also remove files in dest_dir which are
+    not part of the flattened bundle.
+    :param dry_run: Only plan the operations, without touching dest_dir.
+    :return: In dry run mode, the list of planned operations, see `nest`.
+    In sync mode, a dict with the lists of "added", "changed", "removed"
+    and "unchanged" file paths relative to dest_dir, otherwise None
+
+    :raises TypeError: When called with delete but without sync
+    """
+    _check_sync_args(sync, delete)
+    check_link_mode(link_mode)
+    if not dry_run:
+        os.makedirs(dest_dir, exist_ok=True)
+    return flatten_bundles(source_dir, dest_dir, link_mode, sync, delete, dry_run)
+
+
+def _check_sync_args(sync, delete):
+    if delete and not sync:
+        msg = 'delete can only be specified together with sync.'
+        logger.error(msg)
+        raise TypeError(msg)
+
+
+def nest_catalog(source_root, output_root, link_mode=LINK_MODE_COPY, sync=False,
+                 delete=False, dry_run=False, passthrough=False, workers=None):
+    """Nest catalog runs `nest` over every package directory of a catalog,
+    with a pool of worker processes. Each subdirectory of source_root is
+    nested into the subdirectory of the same name in output_root.
+
+    :param source_root: Path of the catalog directory, where each subdirectory
+                        contains the manifests of one package
+    :param output_root: Path of the directory the per-package directories are
+                        written into
+    :param workers: The maximum number of worker processes,
+                    defaults to the number of processors
+
+    See `nest` for the other parameters.
+
+    :return: A list of per-package reports, where each report is a dict with the
+             "package" directory name, its "source_dir" and "dest_dir", the "status"
+             ("success" or "error"), the "errors" of the package, and the "result"
+             returned by `nest`
+    """
+    _check_sync_args(sync, delete)
+    return process_catalog('nest', source_root, output_root, workers,
+                           link_mode=link_mode, sync=sync, delete=delete,
+                           dry_run=dry_run, passthrough=passthrough)
+
+
+def flatten_catalog(source_root, dest_root, link_mode=LINK_MODE_COPY, sync=False,
+                    delete=False, dry_run=False, workers=None):
+    """Flatten catalog runs `flatten` over every package directory of a catalog,
+    with a pool of worker processes. Each subdirectory of source_root is
+    flattened into the subdirectory of the same name in dest_root.
+
+    :param source_root: Path of the catalog directory, where each subdirectory
+                        contains the manifests of one package
+    :param dest_root: Path of the directory the per-package directories are
+                      written into
+    :param workers: The maximum number of worker processes,
+                    defaults to the number of processors
+
+    See `flatten` for the other parameters.
+
+    :return: A list of per-package reports, see `nest_catalog`
     """
-    os.makedirs(dest_dir, exist_ok=True)
-    flatten_bundles(source_dir, dest_dir)
+    _check_sync_args(sync, delete)
+    return process_catalog('flatten', source_root, dest_root, workers,
+                           link_mode=link_mode, sync=sync, delete=delete,
+                           dry_run=dry_run)
@@ -0,0 +1,111 @@
+"""
+operatorcourier.batch
+
+Runs a stream of verify, nest and flatten requests given as JSON lines with a
+pool of worker processes, and streams a JSON line report for each request as
+soon as it completes.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from operatorcourier import identify
+from operatorcourier.catalog import STATUS_ERROR
+from operatorcourier.commands import run_command
+from operatorcourier.defaults import DEFAULT_PARSE_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# the number of requests read ahead per worker, so that workers never wait
+# for input while a long input is not read into memory at once
+READ_AHEAD = 4
+
+
+def run_batch(lines, output, workers=None, parse_cache_size=DEFAULT_PARSE_CACHE_SIZE):
+    """
+    Run the requests of lines with a pool of worker processes, and write the
+    report of each request to output as it completes, which may be out of the
+    order of lines.
+
+    :param lines: an iterable of the requests as JSON lines, see
+                  commands.run_command. Blank lines are skipped.
+    :param output: the text file the reports are written to as JSON lines,
+                   each with the "line" number of its request
+    :param workers: the maximum number of worker processes, defaults to the
+                    number of processors
+    :param parse_cache_size: the maximum number of parsed yaml files kept by
+                             each worker in an identify.ParseCache,
+                             0 disables the cache
+    :return: a tuple of the number of requests, and of the failed requests
+    """
+    slots = threading.BoundedSemaphore(READ_AHEAD * (workers or os.cpu_count() or 1))
+    # reports, or futures of reports, in the order they complete
+    completed = queue.Queue()
+    count, failed = 0, 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # requests are read and submitted by a separate thread, so that
+        # reports are written as they complete, even while input is awaited
+        reader = threading.Thread(target=_submit_requests, daemon=True,
+                                  args=(lines, executor, slots, completed,
+                                        parse_cache_size))
+        reader.start()
+        total = None
+        while total is None or count < total:
+            item = completed.get()
+            if isinstance(item, _EndOfInput):
+                total = item.total
+                continue
+            if isinstance(item, BaseException):
+                raise item
+            report = item.result() if isinstance(item, Future) else item
+            output.write(json.dumps(report, sort_keys=True) + '\n')
+            output.flush()
+            count += 1
+            failed += report['status'] == STATUS_ERROR
+
+    if failed:
+        logger.error('%d of %d requests failed.', failed, count)
+    return count, failed
+
+
+class _EndOfInput():
+    def __init__(self, total):
+        self.total = total
+
+
+def _submit_requests(lines, executor, slots, completed, parse_cache_size):
+    def on_done(future):
+        slots.release()
+        completed.put(future)
+
+    total = 0
+    try:
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            total += 1
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                completed.put(dict(id=None, command=None, status=STATUS_ERROR,
+                                   errors=['Invalid JSON: %s' % e], result=None,
+                                   duration=0.0, line=line_number))
+                continue
+            slots.acquire()
+            executor.submit(_run_request, request, line_number,
+                            parse_cache_size).add_done_callback(on_done)
+    except BaseException as e:
+        completed.put(e)
+    completed.put(_EndOfInput(total))
+
+
+def _run_request(request, line_number, parse_cache_size):
+    # each worker process keeps its own cache for the lifetime of the pool
+    if parse_cache_size and identify.get_parse_cache() is None:
+        identify.set_parse_cache(identify.ParseCache(parse_cache_size))
+    report = run_command(request)
+    report['line'] = line_number
+    return report
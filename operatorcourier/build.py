@@ -30,9 +30,15 @@ class BuildCmd():
         else:
             return path
 
-    def _updateBundle(self, operatorBundle, file_name, yaml_string):
-        # Determine which operator file type the yaml is
-        operator_artifact = identify.get_operator_artifact_type(yaml_string)
+    def _updateBundle(self, operatorBundle, file_name, yaml_content):
+        # Determine which operator file type the yaml is. The content is either
+        # a yaml string, or an object already parsed and shared by the caller.
+        if isinstance(yaml_content, str):
+            operator_artifact, yaml_data = \
+                identify.load_operator_artifact(yaml_content)
+        else:
+            yaml_data = yaml_content
+            operator_artifact = identify.get_parsed_artifact_type(yaml_data)
 
         # If the file isn't one of our special types, we ignore it and return
         if operator_artifact == identify.UNKNOWN_FILE:
@@ -41,9 +47,6 @@ class BuildCmd():
         # Get the array name expected by the dictionary for the given file type
         op_artifact_plural = operator_artifact[0:1].lower() + operator_artifact[1:] + 's'
 
-        # Marshal the yaml into a dictionary
-        yaml_data = yaml.safe_load(yaml_string)
-
         # Add the data dictionary to the correct list
         operatorBundle["data"][op_artifact_plural].append(yaml_data)
 
@@ -62,7 +65,8 @@ class BuildCmd():
         with those yaml files generated in the bundle format.
 
         :param bundle_data: Array of tuples consisting of yaml blobs
-        and associated metadata for those blobs
+        and associated metadata for those blobs. A yaml blob may also be
+        an already parsed yaml object, which is used as is.
         """
         # Generate an empty bundle
         bundle = self._get_empty_bundle()
@@ -0,0 +1,240 @@
+"""
+operatorcourier.bulk
+
+Pushes many bundles concurrently over a shared pool of connections.
+"""
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from operatorcourier.catalog import STATUS_SUCCESS, STATUS_ERROR
+from operatorcourier.errors import OpCourierValueError
+from operatorcourier.defaults import DEFAULT_CONCURRENCY, DEFAULT_RETRY_BACKOFF
+from operatorcourier.push import PushCmd, create_session, PUSH_STATUS_UNCHANGED
+
+logger = logging.getLogger(__name__)
+
+STATUS_UNCHANGED = 'unchanged'
+STATUS_SKIPPED = 'skipped'
+
+PushEntry = namedtuple('PushEntry', ['source_dir', 'namespace', 'repository',
+                                     'release'])
+
+
+def load_push_entries(entries_data):
+    """
+    Convert parsed entries, e.g. from a JSON or YAML file, into PushEntries.
+
+    :param entries_data: a list of dicts with the source_dir, namespace,
+                         repository and release of each push
+    :return: the list of PushEntries
+    """
+    if not isinstance(entries_data, list):
+        raise OpCourierValueError('Push entries must be a list.')
+
+    entries = []
+    for index, entry_data in enumerate(entries_data):
+        try:
+            entry = PushEntry(**{field: entry_data[field]
+                                 for field in PushEntry._fields})
+        except (KeyError, TypeError):
+            raise OpCourierValueError('Push entry %d must define %s.'
+                                      % (index, ', '.join(PushEntry._fields)))
+        # e.g. a YAML release 1.10 is the float 1.1, so values are not converted
+        for field, value in entry._asdict().items():
+            if not isinstance(value, str):
+                raise OpCourierValueError(
+                    'The %s of push entry %d must be a string, quote %r in the '
+                    'entries file.' % (field, index, value))
+        entries.append(entry)
+    return entries
+
+
+def push_entries(entries, token, concurrency=DEFAULT_CONCURRENCY, rate_limit=None,
+                 retries=0, retry_backoff=DEFAULT_RETRY_BACKOFF, skip_unchanged=False,
+                 registry_url=None, journal=None, resume=False, push_cmd=None):
+    """
+    Build, verify and push every entry with a pool of threads, which share the
+    connection pool of a single PushCmd.
+
+    :param entries: the PushEntries to push
+    :param token: Authorization token used for every push
+    :param concurrency: the maximum number of concurrent pushes
+    :param rate_limit: the maximum number of pushes started per second
+                       against a single registry host, unlimited if None
+    :param retries: the number of times a push is retried after a transient failure
+    :param retry_backoff: the delay in seconds before the first retry of a push
+    :param skip_unchanged: skip uploading releases whose digest in the registry
+                           matches the digest of the bundle archive
+    :param registry_url: the base URL of the app registry API, see PushCmd
+    :param journal: Path of an append-only journal, where every entry that was
+                    pushed or found unchanged is recorded with its digest
+    :param resume: skip the entries that the journal records as done
+    :param push_cmd: the PushCmd to push with, defaults to a PushCmd with
+                     a pooled session sized for the concurrency. With rate_limit,
+                     a copy of it is used, so that its rate_limiter is unchanged.
+    :return: a list of reports in the order of entries, where each report is a
+             dict with the fields of the entry, the "status" ("success",
+             "unchanged", "skipped" or "error"), the "errors" of the push, and
+             the archive "digest", "attempts", "attempt_durations" and "phase_durations"
+             of the push if it was attempted
+    """
+    from operatorcourier import api
+
+    if push_cmd is None:
+        push_cmd = PushCmd(session=create_session(concurrency), retries=retries,
+                           backoff=retry_backoff, skip_unchanged=skip_unchanged,
+                           registry_url=registry_url)
+    if rate_limit is not None:
+        # the copy shares the session, and so the connection pool, of push_cmd
+        push_cmd = copy.copy(push_cmd)
+        push_cmd.rate_limiter = HostRateLimiter(rate_limit)
+
+    push_journal = PushJournal(journal) if journal is not None else None
+    done_digests = push_journal.load() if resume else {}
+
+    def push_entry(entry):
+        report = dict(entry._asdict(), status=STATUS_SUCCESS, errors=[])
+        journal_key = (entry.namespace, entry.repository, entry.release)
+        if journal_key in done_digests:
+            report['status'] = STATUS_SKIPPED
+            report['digest'] = done_digests[journal_key]
+            return report
+        try:
+            push_result = api.build_verify_and_push(entry.namespace,
+                                                    entry.repository,
+                                                    entry.release, token,
+                                                    source_dir=entry.source_dir,
+                                                    push_cmd=push_cmd)
+        except Exception as e:
+            report['status'] = STATUS_ERROR
+            report['errors'] = [str(e)]
+            push_result = getattr(e, 'push_result', None)
+        if push_result is not None:
+            if push_result.status == PUSH_STATUS_UNCHANGED:
+                report['status'] = STATUS_UNCHANGED
+            report['digest'] = push_result.digest
+            report['attempts'] = push_result.attempts
+            report['attempt_durations'] = push_result.attempt_durations
+            report['phase_durations'] = push_result.phase_durations
+        if push_journal is not None and report['status'] != STATUS_ERROR:
+            push_journal.record(entry, push_result.digest)
+        return report
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        reports = list(executor.map(push_entry, entries))
+
+    failed = [report for report in reports if report['status'] == STATUS_ERROR]
+    if failed:
+        logger.error('%d of %d pushes failed: %s', len(failed), len(reports),
+                     ', '.join('%s/%s@%s' % (report['namespace'],
+                                             report['repository'],
+                                             report['release'])
+                               for report in failed))
+    return reports
+
+
+class PushJournal():
+    """An append-only journal of completed pushes, with one JSON line per push.
+
+    Every line is flushed to disk once it is written, so a journal survives the
+    bulk push being killed, except for a possibly truncated last line.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the journal file, which is created if missing
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._needs_newline = None
+
+    def load(self):
+        """Read the completed pushes from the journal.
+
+        :return: a dict of the digests of the completed pushes, by their
+                 (namespace, repository, release) tuples
+        """
+        done_digests = {}
+        if not os.path.exists(self.path):
+            return done_digests
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                    key = (record['namespace'], record['repository'],
+                           record['release'])
+                except (ValueError, KeyError, TypeError):
+                    logger.warning('Ignoring invalid journal line: %s', line.strip())
+                    continue
+                done_digests[key] = record.get('digest')
+        return done_digests
+
+    def record(self, entry, digest):
+        """Append a completed push to the journal.
+
+        :param entry: the PushEntry that was pushed
+        :param digest: the digest of the pushed archive
+        """
+        line = json.dumps(dict(namespace=entry.namespace,
+                               repository=entry.repository,
+                               release=entry.release, digest=digest),
+                          sort_keys=True)
+        with self._lock:
+            if self._needs_newline is None:
+                self._needs_newline = _ends_without_newline(self.path)
+            if self._needs_newline:
+                # terminate a line truncated by an interrupted push
+                line = '\n' + line
+                self._needs_newline = False
+            with open(self.path, 'a') as journal_file:
+                journal_file.write(line + '\n')
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+
+def _ends_without_newline(path):
+    try:
+        with open(path, 'rb') as journal_file:
+            journal_file.seek(0, os.SEEK_END)
+            if journal_file.tell() == 0:
+                return False
+            journal_file.seek(-1, os.SEEK_END)
+            return journal_file.read(1) != b'\n'
+    except FileNotFoundError:
+        return False
+
+
+class HostRateLimiter():
+    """Spaces out requests to the same host, so that at most rate requests
+    per second are started against each host.
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: the maximum number of requests per second and host
+        """
+        if rate <= 0:
+            raise OpCourierValueError('The rate limit must be positive.')
+        self.interval = 1.0 / rate
+        self._next_times = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        """Block until a request to the host of url may be started.
+
+        :param url: the URL that is about to be requested
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start_time = max(now, self._next_times.get(host, now))
+            self._next_times[host] = start_time + self.interval
+        if start_time > now:
+            time.sleep(start_time - now)
@@ -0,0 +1,105 @@
+"""
+operatorcourier.catalog
+
+Runs nest or flatten over every package directory of a catalog.
+"""
+import contextlib
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+STATUS_SUCCESS = 'success'
+STATUS_ERROR = 'error'
+
+
+def process_catalog(operation, source_root, dest_root, workers=None, **kwargs):
+    """
+    Run an api operation over every package directory in source_root with a pool
+    of worker processes. Each package directory is written into the directory of
+    the same name in dest_root.
+
+    :param operation: the name of the api function to run, "nest" or "flatten"
+    :param source_root: Path of the catalog directory, where each subdirectory
+                        contains the manifests of one package
+    :param dest_root: Path of the directory the per-package directories are
+                      written into
+    :param workers: the maximum number of worker processes
+    :param kwargs: the keyword arguments passed to the api function
+    :return: a list of reports sorted by package, where each report is a dict with
+             the "package" directory name, its "source_dir" and "dest_dir", the
+             "status" ("success" or "error"), the "errors" logged while
+             processing the package, and the "result" of the api function
+    """
+    package_names = sorted(name for name in os.listdir(source_root)
+                           if not name.startswith('.') and
+                           os.path.isdir(os.path.join(source_root, name)))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_process_package, operation,
+                                   package_name,
+                                   os.path.join(source_root, package_name),
+                                   os.path.join(dest_root, package_name),
+                                   kwargs)
+                   for package_name in package_names]
+        reports = [future.result() for future in futures]
+
+    failed = [report['package'] for report in reports
+              if report['status'] == STATUS_ERROR]
+    if failed:
+        logger.error('%d of %d packages failed: %s',
+                     len(failed), len(reports), ', '.join(failed))
+    return reports
+
+
+class _ThreadErrorCollector(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.thread = threading.get_ident()
+        self.errors = []
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            self.errors.append(record.getMessage())
+
+
+@contextlib.contextmanager
+def collect_errors():
+    """
+    Collect the errors logged by operator-courier in the current thread within
+    the context, since errors of nest are logged rather than raised.
+
+    :return: the list of the messages of the logged errors, which may be
+             appended to
+    """
+    collector = _ThreadErrorCollector()
+    package_logger = logging.getLogger('operatorcourier')
+    package_logger.addHandler(collector)
+    try:
+        yield collector.errors
+    finally:
+        package_logger.removeHandler(collector)
+
+
+def _process_package(operation, package_name, source_dir, dest_dir, kwargs):
+    from operatorcourier import api
+
+    report = dict(package=package_name, source_dir=source_dir, dest_dir=dest_dir,
+                  status=STATUS_SUCCESS, errors=[], result=None)
+
+    if operation == 'nest':
+        # packages are already processed by a pool of worker processes
+        kwargs = dict(kwargs, workers=1)
+    with collect_errors() as errors:
+        try:
+            report['result'] = getattr(api, operation)(source_dir, dest_dir, **kwargs)
+        except Exception as e:
+            if str(e) not in errors:
+                errors.append(str(e))
+
+    if errors:
+        report['status'] = STATUS_ERROR
+        report['errors'] = errors
+    return report
@@ -1,10 +1,17 @@
 import argparse
-import pkg_resources
+import json
+import os
+import signal
 import sys
 import logging
 import traceback
 
-from operatorcourier import api
+# the modules implementing the subcommands are imported by the subcommands,
+# so that e.g. --help and nest do not import requests
+from operatorcourier.defaults import DEFAULT_CONCURRENCY, DEFAULT_RETRY_BACKOFF, \
+    DEFAULT_REGISTRY_URL, REGISTRY_URL_ENV, CACHE_DIR_ENV, SOCKET_ENV, \
+    DEFAULT_PARSE_CACHE_SIZE, DEFAULT_PROFILE_PATH
+from operatorcourier.fileops import LINK_MODES, LINK_MODE_COPY
 
 
 def main():
@@ -19,6 +26,33 @@ def main():
         sys.exit(str(e))    # it should just be captured by logs
 
 
+def _get_version():
+    try:
+        try:
+            from importlib import metadata
+        except ImportError:  # python < 3.8
+            import pkg_resources
+            return pkg_resources.get_distribution('operator-courier').version
+        return metadata.version('operator-courier')
+    except Exception:
+        return 'unknown'
+
+
+class _VersionAction(argparse.Action):
+    """Prints the version and exits, like the version action of argparse, but
+    only looks up the version when the option is given.
+    """
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS,
+                 default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings=option_strings, dest=dest,
+                         default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print(_get_version())
+        parser.exit()
+
+
 class _CliParser():
     """Class that generates the command line bits for the operator-courier cli tool
     """
@@ -33,19 +67,21 @@ class _CliParser():
             description='Build, verify and push operator bundles into '
                         'external app registry')
 
-        try:
-            __version__ = pkg_resources.get_distribution('operator-courier').version
-        except Exception:
-            __version__ = 'unknown'
-
         parser.add_argument(
             '-v', '--version',
             help='Show the current version of operator-courier',
-            action='version', version=__version__)
+            action=_VersionAction)
         parser.add_argument(
             '--verbose', dest='verbose',
             help="Provide detailed logs",
             action='store_true', default=False)
+        parser.add_argument(
+            '--profile', dest='profile', metavar='PATH',
+            nargs='?', const=DEFAULT_PROFILE_PATH,
+            help='Profile the subcommand with cProfile, write the stats to PATH, '
+            '%s by default, and print the time spent in each phase, like yaml '
+            'load and validate. Worker processes of the catalog and batch modes, '
+            'and servers, are not profiled.' % DEFAULT_PROFILE_PATH)
 
         subparsers = parser.add_subparsers(title='subcommands')
 
@@ -94,8 +130,100 @@ class _CliParser():
             '--validation-output',
             dest='validation_output',
             help='A file to write validation warnings and errors to in JSON format')
+        push_parser.add_argument(
+            '--compression-level',
+            dest='compression_level',
+            type=int,
+            choices=range(0, 10),
+            default=9,
+            metavar='{0-9}',
+            help='The gzip compression level of the bundle archive. '
+            'Lower levels are faster, e.g. for bundles of mostly compressed icons.')
+        push_parser.add_argument(
+            '--compress-threads',
+            dest='compress_threads',
+            type=int,
+            default=1,
+            help='The number of threads compressing the bundle archive. The '
+            'archive, and so its digest for --skip-unchanged, differs between '
+            '1 and more threads, and between compression levels.')
+        self._add_retry_arguments(push_parser)
+        self._add_skip_unchanged_argument(push_parser)
+        self._add_registry_url_argument(push_parser)
         push_parser.set_defaults(func=self.push)
 
+        push_many_parser = subparsers.add_parser(
+            'push-many',
+            help='Create, test and push many bundles concurrently.',
+            description='Build, verify and push several operator bundles '
+            'concurrently into external app registry, reusing connections. '
+            'One JSON report line is printed per bundle.')
+        push_many_parser.add_argument(
+            'entries_file',
+            help='A JSON or YAML file with a list of the bundles to push, where '
+            'each entry defines source_dir, namespace, repository and release.')
+        push_many_parser.add_argument(
+            'token',
+            help='Authorization token for Quay api.')
+        push_many_parser.add_argument(
+            '--concurrency',
+            dest='concurrency',
+            type=int,
+            default=DEFAULT_CONCURRENCY,
+            help='The maximum number of bundles pushed concurrently.')
+        push_many_parser.add_argument(
+            '--rate-limit',
+            dest='rate_limit',
+            type=float,
+            help='The maximum number of pushes started per second '
+            'against the app registry.')
+        self._add_retry_arguments(push_many_parser)
+        self._add_skip_unchanged_argument(push_many_parser)
+        self._add_registry_url_argument(push_many_parser)
+        push_many_parser.add_argument(
+            '--journal',
+            dest='journal',
+            help='An append-only file, where every bundle that was pushed, or is '
+            'unchanged in the app registry, is recorded with its digest.')
+        push_many_parser.add_argument(
+            '--resume',
+            dest='resume',
+            help='Together with --journal, skip the bundles that the journal '
+            'records as done, to resume an interrupted push-many.',
+            action='store_true')
+        push_many_parser.set_defaults(func=self.push_many)
+
+        pull_parser = subparsers.add_parser(
+            'pull',
+            help='Fetch a released bundle from an app registry.',
+            description='Fetch a released operator bundle from external app '
+            'registry through a local cache, and print it as yaml.')
+        pull_parser.add_argument(
+            'namespace',
+            help='Name of the Quay namespace to pull operator from.')
+        pull_parser.add_argument(
+            'repository',
+            help='Application repository name of the release.')
+        pull_parser.add_argument(
+            'release',
+            help='The release version of the bundle.')
+        pull_parser.add_argument(
+            '--token',
+            dest='token',
+            help='Authorization token for Quay api, for private repositories.')
+        self._add_registry_url_argument(pull_parser)
+        pull_parser.add_argument(
+            '--cache-dir',
+            dest='cache_dir',
+            help='The directory of the local cache of pulled releases. Defaults '
+            'to the %s environment variable, or to ~/.cache/operator-courier.'
+            % CACHE_DIR_ENV)
+        pull_parser.add_argument(
+            '--output',
+            dest='output',
+            help='A file to write the bundle to, instead of printing it.')
+        pull_parser.set_defaults(func=self.pull)
+
         nest_parser = subparsers.add_parser(
             'nest',
             help='Take a flat to-be-bundled directory and version nest it.',
@@ -108,6 +236,53 @@ class _CliParser():
             'registry_dir',
             help='Path of your directory to be populated. '
             'If directory does not exist, it will be created.')
+        nest_parser.add_argument(
+            '--link-mode',
+            dest='link_mode',
+            choices=LINK_MODES,
+            default=LINK_MODE_COPY,
+            help='How files of an already nested directory, or passed through '
+            'files of a flat directory, are placed in the registry directory. '
+            'Falls back to copy when the filesystem does not support the link mode.')
+        nest_parser.add_argument(
+            '--passthrough',
+            dest='passthrough',
+            help='Write the original bytes of the files of a flat directory into '
+            'the nested layout, instead of re-serializing the parsed yaml.',
+            action='store_true')
+        nest_parser.add_argument(
+            '--sync',
+            dest='sync',
+            help='Only write files that are missing or changed in the registry '
+            'directory, compared by size and digest, and print a summary.',
+            action='store_true')
+        nest_parser.add_argument(
+            '--delete',
+            dest='delete',
+            help='Together with --sync, remove files from the registry directory '
+            'that are not part of the nested bundle.',
+            action='store_true')
+        nest_parser.add_argument(
+            '--dry-run',
+            dest='dry_run',
+            help='Print the planned file operations with their byte counts as '
+            'JSON lines, without touching the registry directory.',
+            action='store_true')
+        nest_parser.add_argument(
+            '--catalog',
+            dest='catalog',
+            help='Treat source_dir as a catalog, where each subdirectory is a '
+            'package directory. Packages are processed by a pool of worker '
+            'processes into subdirectories of the same name, and one JSON report '
+            'line is printed per package.',
+            action='store_true')
+        nest_parser.add_argument(
+            '--workers',
+            dest='workers',
+            type=int,
+            help='The maximum number of worker processes serializing the CSVs of '
+            'a flat bundle, or with --catalog, processing packages. '
+            'Defaults to the number of processors.')
         nest_parser.set_defaults(func=self.nest)
 
         flatten_parser = subparsers.add_parser(
@@ -128,23 +303,164 @@ class _CliParser():
             'dest_dir',
             help='The new flat directory that contains '
             'extracted bundle files')
+        flatten_parser.add_argument(
+            '--link-mode',
+            dest='link_mode',
+            choices=LINK_MODES,
+            default=LINK_MODE_COPY,
+            help='How files are placed in the flat directory. Falls back to '
+            'copy when the filesystem does not support the link mode.')
+        flatten_parser.add_argument(
+            '--sync',
+            dest='sync',
+            help='Only write files that are missing or changed in the destination '
+            'directory, compared by size and digest, and print a summary.',
+            action='store_true')
+        flatten_parser.add_argument(
+            '--delete',
+            dest='delete',
+            help='Together with --sync, remove files from the destination directory '
+            'that are not part of the flattened bundle.',
+            action='store_true')
+        flatten_parser.add_argument(
+            '--dry-run',
+            dest='dry_run',
+            help='Print the planned file operations with their byte counts as '
+            'JSON lines, without touching the destination directory.',
+            action='store_true')
+        flatten_parser.add_argument(
+            '--catalog',
+            dest='catalog',
+            help='Treat source_dir as a catalog, where each subdirectory is a '
+            'package directory. Packages are processed by a pool of worker '
+            'processes into subdirectories of the same name, and one JSON report '
+            'line is printed per package.',
+            action='store_true')
+        flatten_parser.add_argument(
+            '--workers',
+            dest='workers',
+            type=int,
+            help='With --catalog, the maximum number of worker processes. '
+            'Defaults to the number of processors.')
         flatten_parser.set_defaults(func=self.flatten)
 
-        args = parser.parse_args()
+        batch_parser = subparsers.add_parser(
+            'batch',
+            help='Run verify, nest and flatten requests read as JSON lines.',
+            description='Read verify, nest and flatten requests as JSON lines from '
+            'stdin, e.g. {"command": "nest", "source_dir": "bundle", "output_dir": '
+            '"nested"}, and run them with a pool of worker processes. One JSON '
+            'report line is printed per request as soon as it completes, with its '
+            'line number, status, errors, result and duration.')
+        batch_parser.add_argument(
+            '--workers',
+            dest='workers',
+            type=int,
+            help='The maximum number of worker processes. '
+            'Defaults to the number of processors.')
+        self._add_parse_cache_size_argument(batch_parser)
+        batch_parser.set_defaults(func=self.batch)
+
+        serve_parser = subparsers.add_parser(
+            'serve',
+            help='Serve verify, nest and flatten requests from a long running process.',
+            description='Serve verify, nest and flatten requests as JSON over HTTP '
+            'on a Unix socket only the current user can connect to, keeping modules '
+            'loaded and parsed files cached between requests. The verify, nest and '
+            'flatten commands are forwarded to the server when the %s environment '
+            'variable is set to its socket, except with --delete.' % SOCKET_ENV)
+        serve_parser.add_argument(
+            '--socket',
+            dest='socket',
+            help='The path of the Unix socket to listen on. Defaults to the %s '
+            'environment variable.' % SOCKET_ENV)
+        self._add_parse_cache_size_argument(serve_parser)
+        serve_parser.set_defaults(func=self.serve)
+
+        # a bare --profile would take the subcommand that follows it as its path,
+        # while "--profile PATH subcommand" is left for argparse to parse
+        argv = sys.argv[1:]
+        args = parser.parse_args([
+            '--profile=' + DEFAULT_PROFILE_PATH
+            if arg == '--profile' and (index + 1 == len(argv) or
+                                       argv[index + 1] in subparsers.choices or
+                                       argv[index + 1].startswith('-'))
+            else arg
+            for index, arg in enumerate(argv)])
         logging.basicConfig(
             level=logging.DEBUG if args.verbose else logging.WARNING
         )
 
         func = getattr(args, 'func', None)
-        if callable(func):
+        if callable(func) and args.profile:
+            from operatorcourier.profiling import profile_call
+            profile_call(args.profile, sys.stderr, func, args)
+        elif callable(func):
             func(args)
         else:
             parser.print_help(sys.stderr)
             sys.exit(2)
 
+    def _add_retry_arguments(self, parser):
+        parser.add_argument(
+            '--retries',
+            dest='retries',
+            type=int,
+            default=0,
+            help='The number of times a push is retried after a connection error, '
+            'a timeout, or a 429 or 5xx response, with exponential backoff.')
+        parser.add_argument(
+            '--retry-backoff',
+            dest='retry_backoff',
+            type=float,
+            default=DEFAULT_RETRY_BACKOFF,
+            help='The delay in seconds before the first retry of a push, which '
+            'doubles with every further retry.')
+
+    def _add_skip_unchanged_argument(self, parser):
+        parser.add_argument(
+            '--skip-unchanged',
+            dest='skip_unchanged',
+            help='Look up the release in the app registry first, and skip '
+            'the upload if it already has the same content digest. The digest '
+            'is that of the compressed archive, so the release must have been '
+            'pushed with the same --compression-level and --compress-threads.',
+            action='store_true')
+
+    def _add_registry_url_argument(self, parser):
+        parser.add_argument(
+            '--registry-url',
+            dest='registry_url',
+            help='The base URL of the CNR app registry API. Defaults to the %s '
+            'environment variable, or to %s.' % (REGISTRY_URL_ENV,
+                                                 DEFAULT_REGISTRY_URL))
+
+    def _add_parse_cache_size_argument(self, parser):
+        parser.add_argument(
+            '--parse-cache-size',
+            dest='parse_cache_size',
+            type=int,
+            default=DEFAULT_PARSE_CACHE_SIZE,
+            help='The maximum number of parsed yaml files kept in memory, '
+            '0 disables the cache.')
+
     def verify(self, args):
         """Run the verify command
         """
+        report = self._forward(dict(command='verify', source_dir=args.source_dir,
+                                    ui_validate_io=args.ui_validate_io,
+                                    validation_output=args.validation_output))
+        if report is not None:
+            # validation is logged by the server, so print it like ValidateCmd
+            validation = (report['result'] or {}).get('validation', {})
+            for level in ['warnings', 'errors']:
+                for message in validation.get(level, []):
+                    print('%s: %s' % (level[:-1].upper(), message), file=sys.stderr)
+            self._exit_on_error(report)
+            return
+
+        from operatorcourier import api
+
         api.build_and_verify(source_dir=args.source_dir,
                              ui_validate_io=args.ui_validate_io,
                              validation_output=args.validation_output)
@@ -152,19 +468,194 @@ class _CliParser():
     def push(self, args):
         """Run the push command
         """
-        api.build_verify_and_push(args.namespace,
-                                  args.repository,
-                                  args.release,
-                                  args.token,
-                                  source_dir=args.source_dir,
-                                  validation_output=args.validation_output)
+        from operatorcourier import api
+        from operatorcourier.push import PushCmd, PUSH_STATUS_UNCHANGED
+
+        push_cmd = PushCmd(args.compression_level, args.compress_threads,
+                           retries=args.retries, backoff=args.retry_backoff,
+                           skip_unchanged=args.skip_unchanged,
+                           registry_url=args.registry_url)
+        result = api.build_verify_and_push(args.namespace,
+                                           args.repository,
+                                           args.release,
+                                           args.token,
+                                           source_dir=args.source_dir,
+                                           validation_output=args.validation_output,
+                                           push_cmd=push_cmd)
+        logger = logging.getLogger(__name__)
+        if result.status == PUSH_STATUS_UNCHANGED:
+            print('Release %s of %s/%s is unchanged, skipped push.'
+                  % (args.release, args.namespace, args.repository))
+            return
+        logger.info('Pushed sha256:%s to %s: %s', result.digest, result.uri,
+                    result.format_stats())
+
+    def push_many(self, args):
+        """Run the push-many command
+        """
+        import yaml
+        from operatorcourier import api
+
+        with open(args.entries_file) as entries_file:
+            entries = yaml.safe_load(entries_file)
+        reports = api.push_many(entries, args.token, args.concurrency,
+                                args.rate_limit, args.retries, args.retry_backoff,
+                                args.skip_unchanged, args.registry_url,
+                                args.journal, args.resume)
+        self._print_reports(reports, 'pushes')
+
+    def pull(self, args):
+        """Run the pull command
+        """
+        import yaml
+        from operatorcourier import api
+
+        bundle = api.pull(args.namespace, args.repository, args.release,
+                          token=args.token, registry_url=args.registry_url,
+                          cache_dir=args.cache_dir)
+        if args.output:
+            with open(args.output, 'w') as output_file:
+                yaml.safe_dump(bundle, output_file, default_flow_style=False)
+        else:
+            yaml.safe_dump(bundle, sys.stdout, default_flow_style=False)
 
     def nest(self, args):
         """Run the nest command
         """
-        api.nest(args.source_dir, args.registry_dir)
+        # the server does not run requests which remove files
+        if not args.catalog and not args.delete:
+            report = self._forward(dict(command='nest', source_dir=args.source_dir,
+                                        output_dir=args.registry_dir,
+                                        link_mode=args.link_mode, sync=args.sync,
+                                        delete=args.delete, dry_run=args.dry_run,
+                                        passthrough=args.passthrough))
+            if report is not None:
+                self._exit_on_error(report)
+                self._print_output_result(args, report['result'])
+                return
+
+        from operatorcourier import api
+
+        if args.catalog:
+            reports = api.nest_catalog(args.source_dir, args.registry_dir,
+                                       args.link_mode, sync=args.sync,
+                                       delete=args.delete, dry_run=args.dry_run,
+                                       passthrough=args.passthrough,
+                                       workers=args.workers)
+            self._print_catalog_reports(reports)
+            return
+
+        result = api.nest(args.source_dir, args.registry_dir, args.link_mode,
+                          sync=args.sync, delete=args.delete, dry_run=args.dry_run,
+                          passthrough=args.passthrough, workers=args.workers)
+        self._print_output_result(args, result)
 
     def flatten(self, args):
         """Parse the flatten command
         """
-        api.flatten(args.source_dir, args.dest_dir)
+        # the server does not run requests which remove files
+        if not args.catalog and not args.delete:
+            report = self._forward(dict(command='flatten', source_dir=args.source_dir,
+                                        dest_dir=args.dest_dir,
+                                        link_mode=args.link_mode, sync=args.sync,
+                                        delete=args.delete, dry_run=args.dry_run))
+            if report is not None:
+                self._exit_on_error(report)
+                self._print_output_result(args, report['result'])
+                return
+
+        from operatorcourier import api
+
+        if args.catalog:
+            reports = api.flatten_catalog(args.source_dir, args.dest_dir,
+                                          args.link_mode, sync=args.sync,
+                                          delete=args.delete, dry_run=args.dry_run,
+                                          workers=args.workers)
+            self._print_catalog_reports(reports)
+            return
+
+        result = api.flatten(args.source_dir, args.dest_dir, args.link_mode,
+                             sync=args.sync, delete=args.delete, dry_run=args.dry_run)
+        self._print_output_result(args, result)
+
+    def batch(self, args):
+        """Run the batch command
+        """
+        from operatorcourier.batch import run_batch
+
+        count, failed = run_batch(sys.stdin, sys.stdout, args.workers,
+                                  args.parse_cache_size)
+        if failed:
+            sys.exit('%d of %d requests failed.' % (failed, count))
+
+    def serve(self, args):
+        """Run the serve command
+        """
+        from operatorcourier.server import CourierServer
+
+        socket_path = args.socket or os.environ.get(SOCKET_ENV)
+        if not socket_path:
+            raise ValueError('Either --socket or the %s environment variable '
+                             'must be set.' % SOCKET_ENV)
+        server = CourierServer(socket_path, args.parse_cache_size)
+
+        # stop like on an interrupt, so that the socket file is removed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        print('Serving operator-courier at %s' % socket_path, flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    def _forward(self, request):
+        """Forward a request to the server listening on the socket in the
+        OPERATOR_COURIER_SOCKET environment variable, if one is running.
+
+        :param request: the request, see commands.run_command
+        :return: the report of the request, or None if no server is running
+        """
+        if not os.environ.get(SOCKET_ENV):
+            return None
+        from operatorcourier.client import CourierClient, get_server_socket
+
+        logger = logging.getLogger(__name__)
+        socket_path = get_server_socket()
+        if socket_path is None:
+            logger.debug('No server is listening on %s.', os.environ[SOCKET_ENV])
+            return None
+        try:
+            report = CourierClient(socket_path).run(request)
+        except OSError as e:
+            logger.debug('Running %s locally, the server at %s is unavailable: %s',
+                         request['command'], socket_path, e)
+            return None
+        return report
+
+    def _exit_on_error(self, report):
+        # exit like main does on the exception of a command run locally
+        if report['status'] == 'error':
+            logger = logging.getLogger(__name__)
+            for error in report['errors'][:-1]:
+                logger.error(error)
+            sys.exit(report['errors'][-1])
+
+    def _print_catalog_reports(self, reports):
+        self._print_reports(reports, 'packages')
+
+    def _print_reports(self, reports, noun):
+        for report in reports:
+            print(json.dumps(report, sort_keys=True))
+
+        failed = [report for report in reports if report['status'] == 'error']
+        if failed:
+            sys.exit('%d of %d %s failed.' % (len(failed), len(reports), noun))
+
+    def _print_output_result(self, args, result):
+        if result is None:
+            return
+        if args.dry_run:
+            for operation in result:
+                print(json.dumps(operation, sort_keys=True))
+        else:
+            print(', '.join('%s: %d' % (state, len(result[state]))
+                            for state in ['added', 'changed', 'removed', 'unchanged']))
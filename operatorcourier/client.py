@@ -0,0 +1,96 @@
+"""
+operatorcourier.client
+
+Forwards requests to a running server.CourierServer. This module only imports
+what the client needs, so that forwarding a command from the cli is faster
+than running it.
+"""
+import http.client
+import json
+import os
+import socket
+import stat
+
+from operatorcourier.defaults import SOCKET_ENV
+
+# the arguments of requests that are paths, which are resolved against the
+# working directory of the client, see commands.run_command
+PATH_ARGUMENTS = ('source_dir', 'output_dir', 'dest_dir', 'validation_output')
+
+
+def get_server_socket():
+    """
+    :return: the path in the OPERATOR_COURIER_SOCKET environment variable if it
+             is a Unix socket, which a server may be listening on, or None
+    """
+    socket_path = os.environ.get(SOCKET_ENV)
+    if not socket_path:
+        return None
+    try:
+        return socket_path if stat.S_ISSOCK(os.stat(socket_path).st_mode) else None
+    except OSError:
+        return None
+
+
+class CourierClient():
+    """Forwards requests to a CourierServer listening on a Unix socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        """
+        :param socket_path: the path of the Unix socket of the server
+        :param timeout: the timeout in seconds of socket operations
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def run(self, request):
+        """Run a request on the server. Relative paths in the arguments of the
+        request are resolved against the working directory of the client.
+
+        :param request: the request, see commands.run_command
+        :return: the report of the request, see commands.run_command
+        :raises OSError: When the server cannot be reached
+        """
+        request = dict(request)
+        for argument in PATH_ARGUMENTS:
+            if request.get(argument):
+                request[argument] = os.path.abspath(request[argument])
+        return self._request('POST', '/', request)
+
+    def get_health(self):
+        """
+        :return: the state of the server, see CourierServer.get_health
+        :raises OSError: When the server cannot be reached
+        """
+        return self._request('GET', '/health')
+
+    def _request(self, method, path, data=None):
+        connection = _UnixHTTPConnection(self.socket_path, self.timeout)
+        try:
+            body = json.dumps(data).encode('utf-8') if data is not None else None
+            connection.request(method, path, body=body,
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response_data = json.loads(response.read().decode('utf-8'))
+        except ValueError:
+            raise OSError('The server at %s responded with invalid JSON.'
+                          % self.socket_path)
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise OSError('The server at %s responded with %d: %s'
+                          % (self.socket_path, response.status,
+                             response_data.get('error')))
+        return response_data
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
@@ -0,0 +1,81 @@
+"""
+operatorcourier.commands
+
+Runs verify, nest and flatten requests given as JSON objects, for the serve
+mode of the cli, which keeps a process with warm caches running.
+"""
+import logging
+import os
+import time
+
+from operatorcourier.catalog import STATUS_SUCCESS, STATUS_ERROR, collect_errors
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = ('verify', 'nest', 'flatten')
+
+
+def run_command(request):
+    """
+    Run a verify, nest or flatten request. The errors of the command are
+    returned in its report rather than raised, so that one failing request
+    does not affect other requests.
+
+    :param request: a dict with the "command" to run, the keyword arguments of
+                    the api function of the command, and an optional "id",
+                    which is returned in the report. e.g. {"command": "nest",
+                    "source_dir": "bundle", "output_dir": "nested"}
+    :return: a report dict with the "id" and "command" of the request, the
+             "status" ("success" or "error"), the "errors" logged while
+             running the command, the "result" of the command, and its
+             "duration" in seconds. The result of verify is a dict with
+             whether the bundle is "nested" and its "validation" warnings
+             and errors, and the result of nest and flatten is the
+             result of the api function.
+    """
+    start = time.monotonic()
+    report = dict(id=None, command=None, status=STATUS_SUCCESS, errors=[],
+                  result=None, duration=None)
+
+    with collect_errors() as errors:
+        try:
+            if not isinstance(request, dict):
+                raise TypeError('A request must be a JSON object.')
+            kwargs = dict(request)
+            report['id'] = kwargs.pop('id', None)
+            report['command'] = command = kwargs.pop('command', None)
+            if command not in COMMANDS:
+                raise ValueError('Unknown command %r, expected one of: %s.'
+                                 % (command, ', '.join(COMMANDS)))
+            report['result'] = _run(command, kwargs)
+        except Exception as e:
+            # e.g. StopIteration has no message
+            message = str(e) or repr(e)
+            if message not in errors:
+                errors.append(message)
+            if getattr(e, 'validation_info', None):
+                report['result'] = dict(validation=e.validation_info)
+
+    if errors:
+        report['status'] = STATUS_ERROR
+        report['errors'] = errors
+    report['duration'] = time.monotonic() - start
+    return report
+
+
+def _run(command, kwargs):
+    source_dir = kwargs.get('source_dir')
+    if source_dir is not None and not os.path.isdir(source_dir):
+        raise ValueError('The source directory %s does not exist.' % source_dir)
+
+    from operatorcourier import api
+
+    if command == 'verify':
+        verified_manifest = api.build_and_verify(**kwargs)
+        return dict(nested=verified_manifest.nested,
+                    validation=verified_manifest.validation_dict)
+    if command == 'nest':
+        # requests already run concurrently, in threads of the server or in
+        # worker processes of batch, so nest does not start worker processes
+        kwargs.setdefault('workers', 1)
+    return getattr(api, command)(**kwargs)
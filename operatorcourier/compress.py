@@ -0,0 +1,83 @@
+"""
+operatorcourier.compress
+
+Gzip compression of file objects, optionally split over several threads.
+"""
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# size of the blocks compressed independently in multi-threaded mode
+GZIP_BLOCK_SIZE = 1024 * 1024
+# size of the deflate window, which is primed with the end of the previous block
+_WINDOW_SIZE = 32 * 1024
+
+
+def gzip_fileobj(src, dst, compresslevel=9, threads=1, mtime=None):
+    """
+    Gzip the content of the binary file object src into dst, which always results
+    in a single standard gzip member.
+
+    With more than one thread, the input is split into blocks that are deflated
+    concurrently, in the same way as pigz: every block ends with a sync flush so
+    that it is byte aligned, and is primed with the last 32 KiB of the previous
+    block. The blocks are concatenated and terminated with an empty final block.
+
+    :param src: Binary file object to read the uncompressed data from
+    :param dst: Binary file object to write the gzip stream to
+    :param compresslevel: zlib compression level from 0 to 9
+    :param threads: number of threads compressing blocks concurrently
+    :param mtime: modification time written to the gzip header,
+                  defaults to the current time
+    :return: the number of uncompressed bytes read from src
+    """
+    if mtime is None:
+        mtime = int(time.time())
+    xfl = 2 if compresslevel == 9 else 4 if compresslevel == 1 else 0
+    # magic, deflate method, no flags, mtime, extra flags, unknown OS
+    dst.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', mtime) + bytes([xfl, 255]))
+
+    crc = 0
+    size = 0
+
+    if threads <= 1:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        for block in iter(lambda: src.read(GZIP_BLOCK_SIZE), b''):
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            dst.write(compressor.compress(block))
+        dst.write(compressor.flush(zlib.Z_FINISH))
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            # bound the blocks held in memory to a few per thread
+            pending = deque()
+            previous_block = b''
+            for block in iter(lambda: src.read(GZIP_BLOCK_SIZE), b''):
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+                pending.append(executor.submit(_deflate_block, block,
+                                               previous_block[-_WINDOW_SIZE:],
+                                               compresslevel))
+                previous_block = block
+                if len(pending) >= 2 * threads:
+                    dst.write(pending.popleft().result())
+            while pending:
+                dst.write(pending.popleft().result())
+
+        # terminate the deflate stream with an empty final block
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        dst.write(compressor.flush(zlib.Z_FINISH))
+
+    dst.write(struct.pack('<II', crc & 0xffffffff, size & 0xffffffff))
+    return size
+
+
+def _deflate_block(block, window, compresslevel):
+    if window:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zdict=window)
+    else:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
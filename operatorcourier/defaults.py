@@ -0,0 +1,25 @@
+"""
+operatorcourier.defaults
+
+Defaults shared by the api and the cli. This module imports nothing, so that
+the cli can build its parser without importing the modules that use them.
+"""
+
+# default base and maximum delay in seconds between retries of a push
+DEFAULT_RETRY_BACKOFF = 1.0
+DEFAULT_MAX_RETRY_BACKOFF = 60.0
+# the base URL of the CNR app registry API, which can be overridden with the
+# registry_url of push.PushCmd or the environment variable REGISTRY_URL_ENV
+DEFAULT_REGISTRY_URL = 'https://quay.io/cnr'
+REGISTRY_URL_ENV = 'OPERATOR_COURIER_REGISTRY_URL'
+# the default number of bundles pushed concurrently by bulk.push_entries
+DEFAULT_CONCURRENCY = 4
+# the environment variable overriding the directory of the pull cache
+CACHE_DIR_ENV = 'OPERATOR_COURIER_CACHE_DIR'
+# the environment variable with the Unix socket of a running server, which the
+# cli forwards verify, nest and flatten commands to
+SOCKET_ENV = 'OPERATOR_COURIER_SOCKET'
+# the default number of parsed yaml files kept by the parse cache of a server
+DEFAULT_PARSE_CACHE_SIZE = 1024
+# the pstats file written by the --profile option of the cli without a path
+DEFAULT_PROFILE_PATH = 'operator-courier.pstats'
@@ -3,7 +3,10 @@ operatorcourier.errors
 
 Defines custom operator-courier exceptions.
 """
-from requests import RequestException
+import sys
+import threading
+
+_lazy_lock = threading.Lock()
 
 
 class OpCourierError(Exception):
@@ -37,13 +40,11 @@ class OpCourierBadBundle(OpCourierValueError):
 
 
 class OpCourierQuayError(OpCourierError):
-    """An error occurred while pushing bundle to Quay.io"""
-    pass
-
-
-class OpCourierQuayCommunicationError(OpCourierQuayError, RequestException):
-    """Communication with Quay.io failed"""
-    pass
+    """An error occurred while pushing bundle to Quay.io.
+    Errors raised by a push carry the push.PushResult of its attempts
+    as push_result.
+    """
+    push_result = None
 
 
 class OpCourierQuayErrorResponse(OpCourierQuayError, OpCourierValueError):
@@ -57,3 +58,30 @@ class OpCourierQuayErrorResponse(OpCourierQuayError, OpCourierValueError):
         super().__init__(msg)
         self.code = code
         self.error_response = error_response
+
+
+def _define_communication_error():
+    # requests is slow to import, so this exception is only defined once it is
+    # first used, which is when a push or pull imports requests anyway
+    from requests import RequestException
+
+    class OpCourierQuayCommunicationError(OpCourierQuayError, RequestException):
+        """Communication with Quay.io failed"""
+        pass
+
+    OpCourierQuayCommunicationError.__qualname__ = 'OpCourierQuayCommunicationError'
+    return OpCourierQuayCommunicationError
+
+
+def __getattr__(name):
+    if name == 'OpCourierQuayCommunicationError':
+        with _lazy_lock:
+            if name not in globals():
+                globals()[name] = _define_communication_error()
+        return globals()[name]
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+if sys.version_info < (3, 7):
+    # module __getattr__ is only supported from python 3.7
+    OpCourierQuayCommunicationError = _define_communication_error()
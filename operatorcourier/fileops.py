@@ -0,0 +1,284 @@
+"""
+operatorcourier.fileops
+
+Helpers to place manifest files into output directories.
+"""
+import hashlib
+import logging
+import os
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from shutil import copyfile
+from operatorcourier.errors import OpCourierValueError
+
+logger = logging.getLogger(__name__)
+
+LINK_MODE_COPY = 'copy'
+LINK_MODE_HARDLINK = 'hardlink'
+LINK_MODE_REFLINK = 'reflink'
+LINK_MODE_SYMLINK = 'symlink'
+LINK_MODES = [LINK_MODE_COPY, LINK_MODE_HARDLINK, LINK_MODE_REFLINK, LINK_MODE_SYMLINK]
+
+# ioctl request number of FICLONE on Linux, see ioctl_ficlone(2)
+_FICLONE = 0x40049409
+
+# OutputFile is a file planned to be written to an output directory, where path is
+# relative to the output directory. Its content is either taken unchanged from
+# src_file_path, or given as bytes in content.
+OutputFile = namedtuple('OutputFile', ['path', 'src_file_path', 'content'])
+OutputFile.__new__.__defaults__ = (None, None)
+
+
+def check_link_mode(link_mode):
+    if link_mode not in LINK_MODES:
+        msg = 'Unsupported link mode "%s", expected one of: %s' \
+              % (link_mode, ', '.join(LINK_MODES))
+        logger.error(msg)
+        raise OpCourierValueError(msg)
+
+
+def place_file(src_file_path, dest_file_path, link_mode=LINK_MODE_COPY):
+    """
+    Place the content of src_file_path at dest_file_path without modifying it.
+    Depending on link_mode, the file is copied, hardlinked, cloned with a
+    copy-on-write reflink or symlinked. If the filesystem does not support the
+    requested link mode, the file is copied instead.
+
+    :param src_file_path: the path of the file to be placed
+    :param dest_file_path: the path the file is placed at. An existing file at this
+                           path is replaced, and never written through. If it is
+                           src_file_path itself, it is left as is.
+    :param link_mode: one of LINK_MODES
+    """
+    check_link_mode(link_mode)
+
+    if _is_same_file(src_file_path, dest_file_path):
+        logger.debug('%s is already in place.', src_file_path)
+        return
+
+    # never write through a link left behind by a previous run
+    if os.path.lexists(dest_file_path):
+        os.remove(dest_file_path)
+
+    if link_mode != LINK_MODE_COPY:
+        try:
+            if link_mode == LINK_MODE_HARDLINK:
+                os.link(src_file_path, dest_file_path)
+            elif link_mode == LINK_MODE_SYMLINK:
+                os.symlink(os.path.abspath(src_file_path), dest_file_path)
+            else:
+                _reflink(src_file_path, dest_file_path)
+            return
+        except (OSError, ImportError) as e:
+            logger.debug('Unable to %s %s, falling back to copy: %s',
+                         link_mode, src_file_path, e)
+            if os.path.lexists(dest_file_path):
+                os.remove(dest_file_path)
+
+    copyfile(src_file_path, dest_file_path)
+
+
+def _is_same_file(src_file_path, dest_file_path):
+    """
+    :return: whether removing dest_file_path would remove the content of
+             src_file_path, e.g. when flattening a directory into itself
+    """
+    if not os.path.exists(dest_file_path) or \
+            not os.path.samefile(src_file_path, dest_file_path):
+        return False
+    # a symlink or hardlink to src_file_path left by a previous run is a
+    # separate directory entry, which can be replaced
+    if os.path.islink(dest_file_path) or os.lstat(dest_file_path).st_nlink > 1:
+        src_dir, src_name = os.path.split(os.path.abspath(src_file_path))
+        dest_dir, dest_name = os.path.split(os.path.abspath(dest_file_path))
+        return src_name == dest_name and os.path.samefile(src_dir, dest_dir)
+    return True
+
+
+def _reflink(src_file_path, dest_file_path):
+    import fcntl
+
+    with open(src_file_path, 'rb') as src, open(dest_file_path, 'wb') as dest:
+        fcntl.ioctl(dest.fileno(), _FICLONE, src.fileno())
+
+
+def write_output_file(output_file, dest_dir, link_mode=LINK_MODE_COPY):
+    """
+    Write an OutputFile into dest_dir, creating its parent folders as needed.
+
+    :param output_file: the OutputFile to be written
+    :param dest_dir: the directory the path of output_file is relative to
+    :param link_mode: one of LINK_MODES, used if output_file has a src_file_path
+    """
+    dest_file_path = os.path.join(dest_dir, output_file.path)
+    os.makedirs(os.path.dirname(dest_file_path), exist_ok=True)
+
+    if output_file.src_file_path is not None:
+        place_file(output_file.src_file_path, dest_file_path, link_mode)
+    else:
+        # write next to the destination and rename, so readers never see
+        # a partially written file
+        temp_file_path = '%s.%s.tmp' % (dest_file_path, uuid.uuid4().hex)
+        try:
+            with open(temp_file_path, 'wb') as outfile:
+                outfile.write(output_file.content)
+            os.replace(temp_file_path, dest_file_path)
+        finally:
+            if os.path.lexists(temp_file_path):
+                os.remove(temp_file_path)
+
+
+def write_output_files(output_files, dest_dir, link_mode=LINK_MODE_COPY, workers=None):
+    """
+    Write OutputFiles into dest_dir concurrently with a pool of workers.
+
+    :param output_files: the OutputFiles to be written
+    :param dest_dir: the directory the paths of output_files are relative to
+    :param link_mode: one of LINK_MODES, used for OutputFiles with a src_file_path
+    :param workers: the maximum number of files written concurrently
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(write_output_file, output_file, dest_dir, link_mode)
+                   for output_file in output_files]
+        for future in futures:
+            future.result()
+
+
+def plan_output_files(output_files, dest_dir=None, link_mode=LINK_MODE_COPY,
+                      sync=False, delete=False):
+    """
+    Plan how OutputFiles would be written into dest_dir, without touching it.
+
+    :param output_files: the OutputFiles to be written
+    :param dest_dir: the directory the paths of output_files are relative to,
+                     only needed in sync mode
+    :param link_mode: one of LINK_MODES, used for OutputFiles with a src_file_path
+    :param sync: compare output_files with the files in dest_dir by size and sha256
+                 digest, and skip those that are unchanged
+    :param delete: in sync mode, remove files in dest_dir which are not part of
+                   output_files
+    :return: a list of operations, where each operation is a dict with the
+             "operation" ("write", "remove", "skip" or the link mode), the "path"
+             relative to dest_dir, the "source" file path if any, and the size in
+             "bytes" of the file. In sync mode, each operation also has a "state",
+             which is one of "added", "changed", "removed" or "unchanged".
+    """
+    check_link_mode(link_mode)
+    operations = []
+    planned_paths = set()
+
+    for output_file in output_files:
+        path = os.path.normpath(output_file.path)
+        planned_paths.add(path)
+
+        if output_file.src_file_path is not None:
+            operation = dict(operation=link_mode, path=path,
+                             source=output_file.src_file_path,
+                             bytes=os.path.getsize(output_file.src_file_path))
+        else:
+            operation = dict(operation='write', path=path, source=None,
+                             bytes=len(output_file.content))
+
+        if sync:
+            dest_file_path = os.path.join(dest_dir, path)
+            if not os.path.lexists(dest_file_path):
+                operation['state'] = 'added'
+            elif _has_same_content(output_file, dest_file_path):
+                operation['state'] = 'unchanged'
+                operation['operation'] = 'skip'
+            else:
+                operation['state'] = 'changed'
+
+        operations.append(operation)
+
+    if sync and delete and os.path.isdir(dest_dir):
+        for root_path, dir_names, file_names in os.walk(dest_dir):
+            for file_name in file_names:
+                file_path = os.path.join(root_path, file_name)
+                path = os.path.relpath(file_path, dest_dir)
+                if path not in planned_paths:
+                    operations.append(dict(operation='remove', path=path, source=None,
+                                           bytes=os.lstat(file_path).st_size,
+                                           state='removed'))
+
+    return operations
+
+
+def sync_output_files(output_files, dest_dir, link_mode=LINK_MODE_COPY, delete=False):
+    """
+    Incrementally sync OutputFiles into dest_dir. Files already in dest_dir are
+    compared by size and sha256 digest, and only written if their content
+    changed, so that unchanged files keep their metadata.
+
+    :param output_files: the OutputFiles dest_dir should contain
+    :param dest_dir: the directory the paths of output_files are relative to
+    :param link_mode: one of LINK_MODES, used for OutputFiles with a src_file_path
+    :param delete: remove files in dest_dir which are not part of output_files
+    :return: a dict with the lists of "added", "changed", "removed" and
+             "unchanged" file paths, relative to dest_dir
+    """
+    operations = plan_output_files(output_files, dest_dir, link_mode,
+                                   sync=True, delete=delete)
+    output_files = {os.path.normpath(output_file.path): output_file
+                    for output_file in output_files}
+
+    for operation in operations:
+        if operation['operation'] == 'remove':
+            os.remove(os.path.join(dest_dir, operation['path']))
+        elif operation['operation'] != 'skip':
+            write_output_file(output_files[operation['path']], dest_dir, link_mode)
+
+    if delete and os.path.isdir(dest_dir):
+        for root_path, dir_names, file_names in os.walk(dest_dir, topdown=False):
+            if root_path != dest_dir and not os.listdir(root_path):
+                os.rmdir(root_path)
+
+    return get_sync_summary(operations)
+
+
+def get_sync_summary(operations):
+    """
+    :param operations: the operations planned by plan_output_files in sync mode
+    :return: a dict with the sorted lists of "added", "changed", "removed" and
+             "unchanged" file paths
+    """
+    summary = dict(added=[], changed=[], removed=[], unchanged=[])
+    for operation in operations:
+        summary[operation['state']].append(operation['path'])
+    for paths in summary.values():
+        paths.sort()
+    return summary
+
+
+def get_file_digest(file_path):
+    """
+    :param file_path: the path of the file
+    :return: the hex sha256 digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _has_same_content(output_file, dest_file_path):
+    if not os.path.isfile(dest_file_path):
+        return False
+
+    if output_file.src_file_path is not None:
+        if os.path.samefile(output_file.src_file_path, dest_file_path):
+            return True
+        size = os.path.getsize(output_file.src_file_path)
+    else:
+        size = len(output_file.content)
+
+    if size != os.path.getsize(dest_file_path):
+        return False
+
+    if output_file.src_file_path is not None:
+        digest = get_file_digest(output_file.src_file_path)
+    else:
+        digest = hashlib.sha256(output_file.content).hexdigest()
+    return digest == get_file_digest(dest_file_path)
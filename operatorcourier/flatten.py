@@ -1,21 +1,43 @@
 import logging
 import os
-from yaml import safe_load, MarkedYAMLError
+from collections import namedtuple
 from typing import Dict, Tuple
-from shutil import copyfile
-import semver
 from operatorcourier import identify
-from operatorcourier.errors import OpCourierBadBundle, OpCourierBadYaml
-from operatorcourier.manifest_parser \
-    import is_manifest_folder, get_csvs_pkg_info_from_root, is_yaml_file
+from operatorcourier.errors import OpCourierBadBundle
+from operatorcourier.fileops import OutputFile, \
+    write_output_files, sync_output_files, plan_output_files, LINK_MODE_COPY
+from operatorcourier.manifest_parser import \
+    get_csvs_pkg_info_from_root, is_yaml_file, CRD_STR, CSV_STR
 
 logger = logging.getLogger(__name__)
 
 
-def flatten_bundles(source_dir: str, dest_dir: str):
-    file_paths_to_copy = get_flattened_files_info(source_dir)
-    for (src_file_path, new_file_name) in file_paths_to_copy:
-        copyfile(src_file_path, os.path.join(dest_dir, new_file_name))
+def flatten_bundles(source_dir: str, dest_dir: str, link_mode: str = LINK_MODE_COPY,
+                    sync: bool = False, delete: bool = False, dry_run: bool = False):
+    """
+    :param source_dir: Path of the directory containing different versions
+    of operator bundles (CRD, CSV, package) in separate version directories
+    :param dest_dir: the flattened directory path where all necessary files are copied
+    :param link_mode: one of fileops.LINK_MODES
+    :param sync: only write files that are missing or changed in dest_dir
+    :param delete: in sync mode, remove files in dest_dir that are not part of
+    the flattened bundle
+    :param dry_run: only plan the operations, without writing anything
+    :return: in dry run mode, the operations returned by fileops.plan_output_files,
+    in sync mode, the summary returned by fileops.sync_output_files
+    """
+    output_files = [OutputFile(new_file_name, src_file_path=src_file_path)
+                    for (src_file_path, new_file_name)
+                    in get_flattened_files_info(source_dir)]
+
+    if dry_run:
+        return plan_output_files(output_files, dest_dir, link_mode, sync, delete)
+
+    if sync:
+        return sync_output_files(output_files, dest_dir, link_mode, delete)
+
+    write_output_files(output_files, dest_dir, link_mode)
+    return None
 
 
 def get_flattened_files_info(source_dir: str) -> [(str, str)]:
@@ -27,28 +49,31 @@ def get_flattened_files_info(source_dir: str) -> [(str, str)]:
     the new file name to be used in the file copy.
     """
 
-    # get package content and check if CSV exists in source_dir root, and
-    # process all subdirectories and filter those that do not contain valid manifest files
+    # get package content and check if CSV exists in source_dir root
     root_path, dir_names, root_dir_files = next(os.walk(source_dir))
     csvs_path_and_content, pkg_path_and_content \
         = get_csvs_pkg_info_from_root(source_dir)
 
     dir_paths = [os.path.join(source_dir, dir_name) for dir_name in dir_names]
-    manifest_paths = list(filter(lambda x: is_manifest_folder(x), dir_paths))
+
+    # classify each subdirectory in a single pass, which yields its version,
+    # CSVs and CRDs, and filter out those that do not contain valid manifest files
+    manifest_folders_info = []
+    for dir_path in dir_paths:
+        folder_info = get_manifest_folder_info(dir_path)
+        if folder_info is not None:
+            manifest_folders_info.append(folder_info)
 
     # nested layout
-    if manifest_paths:
+    if manifest_folders_info:
         file_paths_to_copy = []  # [ (SRC_FILE_PATH, NEW_FILE_NAME) ]
 
         crd_dict = {}  # { CRD_NAME => (VERSION, CRD_PATH) }
         csv_paths = []
 
-        for manifest_path in manifest_paths:
-            folder_semver = get_folder_semver(manifest_path)
-            if not folder_semver:
-                continue
-            parse_manifest_folder(manifest_path, folder_semver,
-                                  csv_paths, crd_dict)
+        for folder_info in manifest_folders_info:
+            csv_paths.extend(folder_info.csv_paths)
+            merge_crd_dict(crd_dict, folder_info)
 
         # add package in source_dir
         package_path = pkg_path_and_content[0]
@@ -77,92 +102,94 @@ def get_flattened_files_info(source_dir: str) -> [(str, str)]:
     raise OpCourierBadBundle(msg, {})
 
 
-def get_folder_semver(folder_path: str):
-    for item in os.listdir(folder_path):
-        item_path = os.path.join(folder_path, item)
-        if not os.path.isfile(item_path) or not is_yaml_file(item_path):
-            continue
-
-        with open(item_path, 'r') as f:
-            file_content = f.read()
-
-        if identify.get_operator_artifact_type(file_content) == 'ClusterServiceVersion':
-            try:
-                csv_version = safe_load(file_content)['spec']['version']
-            except MarkedYAMLError:
-                msg = f'{item} is not a valid YAML file.'
-                logger.error(msg)
-                raise OpCourierBadYaml(msg)
-            except KeyError:
-                msg = f'{item} is not a valid CSV file as "spec.version" ' \
-                      f'field is required'
-                logger.error(msg)
-                raise OpCourierBadBundle(msg, {})
-            return csv_version
-
-    return None
+ManifestFolderInfo = namedtuple('ManifestFolderInfo',
+                                ['path', 'semver', 'csv_paths', 'crd_paths'])
 
 
-def parse_manifest_folder(manifest_path: str, folder_semver: str,
-                          csv_paths: list, crd_dict: Dict[str, Tuple[str, str]]):
+def get_manifest_folder_info(folder_path: str):
     """
-    Parse the version folder of the bundle and collect information of CSV and CRDs
-    in the bundle
+    Classify the files of a version folder of the bundle in a single pass, where
+    each file is read and parsed only once.
 
-    :param manifest_path: The path of the manifest folder containing bundle files
-    :param folder_semver: The semantic version of the current folder
-    :param csv_paths: A list of CSV file paths inside version folders
-    :param crd_dict: dict that contains CRD info collected from different version folders,
-    where the key is the CRD name, and the value is a tuple where the first element is
-    the version of the bundle, and the second is the path of the CRD file
+    :param folder_path: The path of the version folder
+    :return: A ManifestFolderInfo with the semantic version of the folder, taken from
+    the first CSV found, the paths of the CSV files, and a dict of CRD names to
+    CRD file paths. None is returned if the folder contains no valid CSV file.
     """
-    logger.info('Parsing folder %s for operator version %s',
-                os.path.basename(manifest_path), folder_semver)
-
-    contains_csv = False
+    folder_semver = None
+    csv_paths = []
+    crd_paths = {}  # { CRD_NAME => CRD_PATH }
+    ignored_items = []
 
-    for item in os.listdir(manifest_path):
-        item_path = os.path.join(manifest_path, item)
+    for item in os.listdir(folder_path):
+        item_path = os.path.join(folder_path, item)
 
         if not os.path.isfile(item_path):
-            logger.warning('Ignoring %s as it is not a regular file.', item)
+            ignored_items.append((item, 'it is not a regular file'))
             continue
         if not is_yaml_file(item_path):
-            logger.warning('Ignoring %s as the file does not end with .yaml or .yml',
-                           item_path)
+            ignored_items.append((item_path, 'the file does not end with .yaml or .yml'))
             continue
 
         with open(item_path, 'r') as f:
             file_content = f.read()
 
-        yaml_type = identify.get_operator_artifact_type(file_content)
-
-        if yaml_type == 'ClusterServiceVersion':
-            contains_csv = True
+        yaml_type, yaml_data = identify.load_operator_artifact(file_content)
+
+        if yaml_type == CSV_STR:
+            if folder_semver is None:
+                try:
+                    folder_semver = yaml_data['spec']['version']
+                except (KeyError, TypeError):
+                    msg = f'{item} is not a valid CSV file as "spec.version" ' \
+                          f'field is required'
+                    logger.error(msg)
+                    raise OpCourierBadBundle(msg, {})
             csv_paths.append(item_path)
-        elif yaml_type == 'CustomResourceDefinition':
+        elif yaml_type == CRD_STR:
             try:
-                crd_name = safe_load(file_content)['metadata']['name']
-            except MarkedYAMLError:
-                msg = "Courier requires valid input YAML files"
-                logger.error(msg)
-                raise OpCourierBadYaml(msg)
-            except KeyError:
+                crd_name = yaml_data['metadata']['name']
+            except (KeyError, TypeError):
                 msg = f'{item} is not a valid CRD file as "metadata.name" ' \
                       f'field is required'
                 logger.error(msg)
                 raise OpCourierBadBundle(msg, {})
-            # create new CRD type entry if not found in dict
-            if crd_name not in crd_dict:
-                crd_dict[crd_name] = (folder_semver, item_path)
-            # update the CRD type entry with the file with the newest version
-            elif semver.compare(folder_semver, crd_dict[crd_name][0]) > 0:
-                crd_dict[crd_name] = (crd_dict[crd_name][0], item_path)
-
-    if not contains_csv:
-        msg = 'This version directory does not contain any valid CSV file.'
-        logger.error(msg)
-        raise OpCourierBadBundle(msg, {})
+            crd_paths[crd_name] = item_path
+
+    folder_name = os.path.basename(folder_path)
+    if not csv_paths:
+        logger.warning('Ignoring folder "%s" as it is not a valid manifest '
+                       'folder', folder_name)
+        return None
+
+    logger.info('Parsing folder %s for operator version %s',
+                folder_name, folder_semver)
+    for item, reason in ignored_items:
+        logger.warning('Ignoring %s as %s.', item, reason)
+
+    return ManifestFolderInfo(folder_path, folder_semver, csv_paths, crd_paths)
+
+
+def merge_crd_dict(crd_dict: Dict[str, Tuple[str, str]],
+                   folder_info: ManifestFolderInfo):
+    """
+    Merge the CRDs of a version folder into crd_dict, keeping the CRD file of the
+    newest version for each CRD name
+
+    :param crd_dict: dict that contains CRD info collected from different version folders,
+    where the key is the CRD name, and the value is a tuple where the first element is
+    the version of the bundle, and the second is the path of the CRD file
+    :param folder_info: The ManifestFolderInfo of the version folder
+    """
+    # imported here, so that nest does not pay for importing semver
+    import semver
+
+    for crd_name, crd_path in folder_info.crd_paths.items():
+        # create new CRD type entry if not found in dict, or
+        # update the CRD type entry with the file with the newest version
+        if crd_name not in crd_dict or \
+                semver.compare(folder_info.semver, crd_dict[crd_name][0]) > 0:
+            crd_dict[crd_name] = (folder_info.semver, crd_path)
 
 
 # parse all CSVs and ensure those with same names are handled
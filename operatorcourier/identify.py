@@ -1,13 +1,96 @@
 from yaml import safe_load
 from yaml import MarkedYAMLError
+import copy
 import logging
+import threading
+from collections import OrderedDict
+from operatorcourier.defaults import DEFAULT_PARSE_CACHE_SIZE
 from operatorcourier.errors import OpCourierBadYaml
-from operatorcourier.manifest_parser import CRD_STR, CSV_STR, PKG_STR
+# manifest_parser imports this module, so its names are resolved at call time
+from operatorcourier import manifest_parser
 
 logger = logging.getLogger(__name__)
 
 UNKNOWN_FILE = "Unknown"
 
+# the ParseCache used by load_operator_artifact, see set_parse_cache
+_parse_cache = None
+
+
+class ParseCache():
+    """A bounded cache of parsed yaml strings, for long running processes that
+    parse the same manifest files repeatedly. Entries are keyed by the yaml
+    string itself, so a changed file is a cache miss, and the least recently
+    used entries are evicted. Every lookup returns a deep copy of the cached
+    object, because callers modify the objects they parse.
+    """
+
+    def __init__(self, max_entries=DEFAULT_PARSE_CACHE_SIZE):
+        """
+        :param max_entries: the maximum number of parsed yaml strings kept
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, yaml_string):
+        """
+        :param yaml_string: the yaml string to look up
+        :return: a tuple of the artifact type and a copy of the parsed object,
+                 or None if yaml_string is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(yaml_string)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(yaml_string)
+            self.hits += 1
+        return entry[0], copy.deepcopy(entry[1])
+
+    def put(self, yaml_string, artifact_type, yaml_data):
+        """
+        :param yaml_string: the parsed yaml string
+        :param artifact_type: the artifact type of the parsed object
+        :param yaml_data: the parsed object, which is copied into the cache
+        """
+        entry = (artifact_type, copy.deepcopy(yaml_data))
+        with self._lock:
+            self._entries[yaml_string] = entry
+            self._entries.move_to_end(yaml_string)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self):
+        """
+        :return: a dict with the number of "entries", "hits" and "misses"
+        """
+        with self._lock:
+            return dict(entries=len(self._entries), hits=self.hits,
+                        misses=self.misses)
+
+
+def get_parse_cache():
+    """
+    :return: the ParseCache used by load_operator_artifact, or None if caching
+             is disabled, see set_parse_cache
+    """
+    return _parse_cache
+
+
+def set_parse_cache(parse_cache):
+    """set_parse_cache sets the ParseCache used by load_operator_artifact for
+    the whole process. The cache is disabled by default.
+
+    :param parse_cache: the ParseCache to use, or None to disable caching
+    :return: the previously used ParseCache, or None
+    """
+    global _parse_cache
+    previous_cache, _parse_cache = _parse_cache, parse_cache
+    return previous_cache
+
 
 def get_operator_artifact_type(operatorArtifactString):
     """get_operator_artifact_type takes a yaml string and determines if it is
@@ -15,9 +98,25 @@ def get_operator_artifact_type(operatorArtifactString):
 
     :param operatorArtifactString: Yaml string to type check
     """
+    artifact_type, _ = load_operator_artifact(operatorArtifactString)
+    return artifact_type
 
-    # Default to unknown file unless identified
-    artifact_type = UNKNOWN_FILE
+
+def load_operator_artifact(operatorArtifactString):
+    """load_operator_artifact takes a yaml string, parses it once and returns
+    both its bundle type and the parsed object, so that callers which need the
+    content do not have to parse the same string again.
+
+    :param operatorArtifactString: Yaml string to parse and type check
+    :return: A tuple of the artifact type and the parsed yaml object
+    """
+    parse_cache = _parse_cache
+    if parse_cache is not None and isinstance(operatorArtifactString, str):
+        cached = parse_cache.get(operatorArtifactString)
+        if cached is not None:
+            return cached
+    else:
+        parse_cache = None
 
     try:
         operatorArtifact = safe_load(operatorArtifactString)
@@ -25,10 +124,27 @@ def get_operator_artifact_type(operatorArtifactString):
         msg = "Courier requires valid input YAML files"
         logger.error(msg)
         raise OpCourierBadYaml(msg)
-    else:
-        if isinstance(operatorArtifact, dict):
-            if "packageName" in operatorArtifact:
-                artifact_type = PKG_STR
-            elif operatorArtifact.get("kind") in {CRD_STR, CSV_STR}:
-                artifact_type = operatorArtifact["kind"]
-        return artifact_type
+
+    artifact_type = get_parsed_artifact_type(operatorArtifact)
+    if parse_cache is not None:
+        parse_cache.put(operatorArtifactString, artifact_type, operatorArtifact)
+    return artifact_type, operatorArtifact
+
+
+def get_parsed_artifact_type(operatorArtifact):
+    """get_parsed_artifact_type takes an already parsed yaml object and
+    determines if it is one of the expected bundle types.
+
+    :param operatorArtifact: Parsed yaml object to type check
+    """
+
+    # Default to unknown file unless identified
+    artifact_type = UNKNOWN_FILE
+
+    if isinstance(operatorArtifact, dict):
+        if "packageName" in operatorArtifact:
+            artifact_type = manifest_parser.PKG_STR
+        elif operatorArtifact.get("kind") in {manifest_parser.CRD_STR,
+                                              manifest_parser.CSV_STR}:
+            artifact_type = operatorArtifact["kind"]
+    return artifact_type
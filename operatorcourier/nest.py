@@ -1,11 +1,15 @@
-from distutils.dir_util import copy_tree
+import errno
 import logging
 import os
+import uuid
+import warnings
 import yaml
-from shutil import copyfile
-from tempfile import TemporaryDirectory
+from concurrent.futures import ProcessPoolExecutor
+from shutil import rmtree
 from operatorcourier import identify
 from operatorcourier.errors import OpCourierBadBundle
+from operatorcourier.fileops import OutputFile, check_link_mode, \
+    write_output_files, sync_output_files, plan_output_files, LINK_MODE_COPY
 from operatorcourier.manifest_parser import \
     is_manifest_folder, get_csvs_pkg_info_from_root, get_crd_csv_files_info, \
     CRD_STR, CSV_STR, PKG_STR
@@ -13,8 +17,68 @@ from operatorcourier.manifest_parser import \
 
 logger = logging.getLogger(__name__)
 
+# the number of CSVs below which they are dumped by the current process, since
+# starting worker processes would take longer than dumping them
+PARALLEL_DUMP_MIN_CSVS = 4
 
-def nest_bundles(source_dir, output_dir):
+
+def nest_bundles(source_dir, output_dir, link_mode=LINK_MODE_COPY,
+                 sync=False, delete=False, workers=None, dry_run=False,
+                 passthrough=False):
+    """
+    Nest the bundle in source_dir into output_dir.
+
+    By default the nested bundle is written into a staging directory next to
+    output_dir and then published to it, atomically only if output_dir is
+    missing or empty, see _publish_staging_dir. In sync mode, files are written
+    straight into output_dir, and only if their content differs from what is
+    on disk.
+
+    :param source_dir: Path of the flat or nested bundle directory
+    :param output_dir: Path of the directory to be populated
+    :param link_mode: one of fileops.LINK_MODES, used for files that are copied
+                      unchanged from source_dir
+    :param sync: only write files that are missing or changed in output_dir
+    :param delete: in sync mode, remove files in output_dir that are not part of
+                   the nested bundle
+    :param workers: the maximum number of worker processes serializing the CSVs
+                    of a flat bundle, and of files written concurrently,
+                    defaults to the number of processors
+    :param dry_run: only plan the operations, without writing anything
+    :param passthrough: copy the original bytes of flat manifest files instead of
+                        re-serializing their parsed yaml
+    :return: in dry run mode, the operations returned by fileops.plan_output_files,
+             in sync mode, the summary returned by fileops.sync_output_files
+    """
+    check_link_mode(link_mode)
+
+    output_files = get_nested_files_info(source_dir, passthrough, workers)
+    if output_files is None:
+        return None
+
+    if dry_run:
+        return plan_output_files(output_files, output_dir, link_mode, sync, delete)
+
+    if sync:
+        return sync_output_files(output_files, output_dir, link_mode, delete)
+
+    _write_staged_output_files(output_files, output_dir, link_mode, workers)
+    return None
+
+
+def get_nested_files_info(source_dir, passthrough=False, workers=None):
+    """
+    Plan the nested bundle of source_dir without writing anything, which is the
+    counterpart of flatten.get_flattened_files_info.
+
+    :param source_dir: Path of the flat or nested bundle directory
+    :param passthrough: copy the original bytes of flat manifest files instead of
+                        re-serializing their parsed yaml
+    :param workers: the maximum number of worker processes serializing the
+                    CSVs of a flat bundle, defaults to the number of processors
+    :return: the list of OutputFiles of the nested bundle, with paths relative to
+             the output directory, or None if nesting the flat bundle failed
+    """
     root_path, dir_names, root_dir_files = next(os.walk(source_dir))
     csvs_info, pkg_info = get_csvs_pkg_info_from_root(source_dir)
 
@@ -24,35 +88,22 @@ def nest_bundles(source_dir, output_dir):
     # nested layout
     if manifest_paths:
         logger.warning('The source directory is already nested.')
-
-        # extract paths of package file in root dir and
-        # valid CRD/CSV files from subdirectories, and ignore irrelevant ones
-        manifest_files_path = [pkg_info[0]]
-
-        for manifest_path in manifest_paths:
-            crds_info, csvs_info = get_crd_csv_files_info(manifest_path)
-            crd_csv_file_paths = [file_info[0] for file_info in (crds_info + csvs_info)]
-            manifest_files_path.extend(crd_csv_file_paths)
-
-        # copy all manifest files to output_dir with folder structure preserved
-        os.makedirs(output_dir, exist_ok=True)
-        for file_path in manifest_files_path:
-            file_path_relative = os.path.relpath(file_path, source_dir)
-            output_file_path = os.path.join(output_dir, file_path_relative)
-            os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-            copyfile(file_path, output_file_path)
+        return _get_manifest_folder_files(source_dir, pkg_info, manifest_paths)
 
     # flat layout
     elif csvs_info and pkg_info:
         # extract all valid manifest (CRD, CSV, PKG) files from root
         # and make nested bundles
         crds_info, csvs_info = get_crd_csv_files_info(source_dir)
-        with TemporaryDirectory() as temp_dir:
-            manifest_files_content = [pkg_info[1]]
-            manifest_files_content.extend(
-                [file_content for (_, file_content) in (crds_info + csvs_info)])
+        manifest_files_info = [pkg_info] + crds_info + csvs_info
 
-            nest_flat_bundles(manifest_files_content, output_dir, temp_dir)
+        output_files, errors = _plan_nested_bundle(manifest_files_info, passthrough,
+                                                   workers)
+        if len(errors) != 0:
+            for err in errors:
+                logger.error(err)
+            return None
+        return output_files
     else:
         msg = 'The source directory structure is not in valid flat or nested format,' \
               'because no valid CSV file is found in root or manifest directories.'
@@ -60,31 +111,131 @@ def nest_bundles(source_dir, output_dir):
         raise OpCourierBadBundle(msg, {})
 
 
-def nest_flat_bundles(manifest_files_content, output_dir, temp_registry_dir):
+def get_nested_manifest_files(source_dir):
+    """
+    Get the manifest files of an already nested bundle directory, which are the
+    package file in source_dir and the CRD and CSV files of its manifest folders.
+    Any other files are ignored.
+
+    :param source_dir: Path of the nested bundle directory
+    :return: the list of OutputFiles of the manifest files, with paths relative
+             to source_dir
+    """
+    root_path, dir_names, root_dir_files = next(os.walk(source_dir))
+    _, pkg_info = get_csvs_pkg_info_from_root(source_dir)
+
+    dir_paths = [os.path.join(source_dir, dir_name) for dir_name in dir_names]
+    manifest_paths = list(filter(lambda x: is_manifest_folder(x), dir_paths))
+    return _get_manifest_folder_files(source_dir, pkg_info, manifest_paths)
+
+
+def _get_manifest_folder_files(source_dir, pkg_info, manifest_paths):
+    # extract paths of package file in root dir and
+    # valid CRD/CSV files from subdirectories, and ignore irrelevant ones
+    manifest_files_path = [pkg_info[0]]
+
+    for manifest_path in manifest_paths:
+        crds_info, csvs_info = get_crd_csv_files_info(manifest_path)
+        crd_csv_file_paths = [file_info[0] for file_info in (crds_info + csvs_info)]
+        manifest_files_path.extend(crd_csv_file_paths)
+
+    # keep all manifest files with folder structure preserved
+    return [OutputFile(os.path.relpath(file_path, source_dir),
+                       src_file_path=file_path)
+            for file_path in manifest_files_path]
+
+
+def nest_flat_bundles(manifest_files_content, output_dir, temp_registry_dir=None, *,
+                      workers=None):
+    """
+    Nest the given flat manifest files into output_dir. The nested bundle is
+    written into a staging directory next to output_dir, and only published to
+    output_dir once every file has been written without errors.
+
+    CSVs are serialized by a pool of worker processes, each CRD is serialized
+    once and reused by every version folder that owns it, and files are written
+    concurrently.
+
+    :param manifest_files_content: the yaml strings of the flat manifest files
+    :param output_dir: Path of the directory to be populated
+    :param temp_registry_dir: deprecated and ignored, since the nested bundle is
+                              staged next to output_dir
+    :param workers: the maximum number of worker processes serializing CSVs,
+                    and of files written concurrently, defaults to the number
+                    of processors
+    """
+    if temp_registry_dir is not None:
+        warnings.warn('The temp_registry_dir argument of nest_flat_bundles is '
+                      'ignored.', DeprecationWarning, stacklevel=2)
+
+    manifest_files_info = [("", file_content) for file_content in manifest_files_content]
+    output_files, errors = _plan_nested_bundle(manifest_files_info, workers=workers)
+
+    # if errors were encountered, nothing is written at all.
+    if len(errors) != 0:
+        for err in errors:
+            logger.error(err)
+        return
+
+    _write_staged_output_files(output_files, output_dir, LINK_MODE_COPY, workers)
+
+
+def _write_staged_output_files(output_files, output_dir, link_mode, workers):
+    staging_dir = _create_staging_dir(output_dir)
+    try:
+        write_output_files(output_files, staging_dir, link_mode, workers)
+        _publish_staging_dir(staging_dir, output_dir)
+    finally:
+        rmtree(staging_dir, ignore_errors=True)
+
+
+def _plan_nested_bundle(manifest_files_info, passthrough=False, workers=None):
+    """
+    Parse the flat manifest files and plan the files of the nested bundle.
+
+    :param manifest_files_info: a list of tuples of the file path and the yaml
+                                string of the flat manifest files, where the
+                                file path may be empty
+    :param passthrough: route the original files into the nested bundle instead
+                        of re-serializing their parsed yaml. Parsed yaml is then
+                        only used to route the files.
+    :param workers: the maximum number of worker processes serializing CSVs,
+                    see _dump_yaml_files
+    :return: a tuple of the list of OutputFiles of the nested bundle, and
+             a list of errors
+    """
     package = {}
-    crds = {}
-    csvs = []
+    package_source = None
+    crds = {}  # { CRD_NAME => (CRD, CRD_SOURCE) }
+    csvs = []  # [ (CSV, CSV_SOURCE) ]
 
     errors = []
 
     # first lets parse all the files
-    for yaml_string in manifest_files_content:
-        yaml_type = identify.get_operator_artifact_type(yaml_string)
+    for source in manifest_files_info:
+        yaml_type, yaml_data = identify.load_operator_artifact(source[1])
         if yaml_type == PKG_STR:
             if not package:
-                package = yaml.safe_load(yaml_string)
+                package, package_source = yaml_data, source
             else:
                 errors.append("Multiple packages in directory.")
         if yaml_type == CRD_STR:
-            crd = yaml.safe_load(yaml_string)
+            crd = yaml_data
             if "metadata" in crd and "name" in crd["metadata"]:
                 crd_name = crd["metadata"]["name"]
-                crds[crd_name] = crd
+                crds[crd_name] = (crd, source)
             else:
                 errors.append("CRD has no `metadata.name` field defined")
         if yaml_type == CSV_STR:
-            csv = yaml.safe_load(yaml_string)
-            csvs.append(csv)
+            csvs.append((yaml_data, source))
+
+    def output_file(path, yaml_data, source):
+        if not passthrough:
+            return OutputFile(path, content=_dump_yaml(yaml_data))
+        file_path, yaml_string = source
+        if file_path:
+            return OutputFile(path, src_file_path=file_path)
+        return OutputFile(path, content=yaml_string.encode('utf-8'))
 
     if len(csvs) == 0:
         errors.append("No csvs in directory.")
@@ -92,18 +243,18 @@ def nest_flat_bundles(manifest_files_content, output_dir, temp_registry_dir):
     if not package:
         errors.append("No package file in directory.")
 
-    # write the package file
+    output_files = []
+    crd_files = {}  # { CRD_NAME => CRD_OUTPUT_FILE }, each CRD is dumped once
+    csv_files = []  # [ (OUTPUT_FILES_INDEX, CSV) ], dumped by worker processes
+
     if "packageName" in package:
         package_name = package["packageName"]
-        packagefile_name = os.path.join(temp_registry_dir, '%s.package.yaml'
-                                        % package_name)
-        with open(packagefile_name, 'w') as outfile:
-            yaml.dump(package, outfile, default_flow_style=False)
-            outfile.flush()
+        output_files.append(output_file('%s.package.yaml' % package_name,
+                                        package, package_source))
 
-        # now lets create a subdirectory for each version of the csv,
+        # now lets plan a subdirectory for each version of the csv,
         # and add all the relevant crds to it
-        for csv in csvs:
+        for csv, csv_source in csvs:
             if "metadata" not in csv:
                 errors.append("CSV has no `metadata` field defined")
                 continue
@@ -118,16 +269,14 @@ def nest_flat_bundles(manifest_files_content, output_dir, temp_registry_dir):
             if "version" not in csv["spec"]:
                 errors.append("CSV %s has no `spec.version` field defined" % csv_name)
                 continue
-            version = csv["spec"]["version"]
-            csv_folder = temp_registry_dir + "/" + version
-
-            if not os.path.exists(csv_folder):
-                os.makedirs(csv_folder)
+            version = str(csv["spec"]["version"])
 
-            csv_path = os.path.join(csv_folder, f'{csv_name}.clusterserviceversion.yaml')
-            with open(csv_path, 'w') as outfile:
-                yaml.dump(csv, outfile, default_flow_style=False)
-                outfile.flush()
+            csv_path = os.path.join(version, f'{csv_name}.clusterserviceversion.yaml')
+            if passthrough:
+                output_files.append(output_file(csv_path, csv, csv_source))
+            else:
+                csv_files.append((len(output_files), csv))
+                output_files.append(OutputFile(csv_path))
 
             if "customresourcedefinitions" in csv["spec"]:
                 if "owned" in csv["spec"]["customresourcedefinitions"]:
@@ -139,23 +288,96 @@ def nest_flat_bundles(manifest_files_content, output_dir, temp_registry_dir):
                             continue
                         crd_name = csv_crd["name"]
                         if crd_name in crds:
-                            crd = crds[crd_name]
-                            crdfile_name = os.path.join(csv_folder, '%s.crd.yaml'
-                                                        % crd_name)
-                            with open(crdfile_name, 'w') as outfile:
-                                yaml.dump(crd, outfile, default_flow_style=False)
-                                outfile.flush()
+                            if crd_name not in crd_files:
+                                crd_files[crd_name] = output_file('', *crds[crd_name])
+                            output_files.append(crd_files[crd_name]._replace(
+                                path=os.path.join(version, '%s.crd.yaml' % crd_name)))
                         else:
                             errors.append("CRD %s mentioned in CSV %s was not found"
                                           "in directory." % (crd_name, csv_name))
     else:
         errors.append("Package file has no `packageName` field defined")
 
-    # if no errors were encountered, lets create the real directory and populate it.
-    if len(errors) == 0:
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        copy_tree(temp_registry_dir, output_dir)
-    else:
-        for err in errors:
-            logger.error(err)
+    # nothing is written when there are errors, so skip serializing the CSVs
+    if not errors:
+        csv_contents = _dump_yaml_files([csv for _, csv in csv_files], workers)
+        for (index, _), content in zip(csv_files, csv_contents):
+            output_files[index] = output_files[index]._replace(content=content)
+
+    return output_files, errors
+
+
+def _dump_yaml_files(yaml_data_list, workers=None):
+    """
+    Serialize parsed yaml objects with a pool of worker processes, since
+    serializing holds the GIL and would not scale with threads.
+
+    :param yaml_data_list: the parsed yaml objects to serialize
+    :param workers: the maximum number of worker processes, defaults to the
+                    number of processors. With a single worker, or fewer than
+                    PARALLEL_DUMP_MIN_CSVS objects, they are serialized by the
+                    current process.
+    :return: the list of serialized yaml bytes, in the order of yaml_data_list
+    """
+    workers = min(workers or os.cpu_count() or 1, len(yaml_data_list))
+    if workers <= 1 or len(yaml_data_list) < PARALLEL_DUMP_MIN_CSVS:
+        return [_dump_yaml(yaml_data) for yaml_data in yaml_data_list]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_dump_yaml, yaml_data_list))
+
+
+def _dump_yaml(yaml_data):
+    # keys are sorted, so that repeated runs produce byte-identical files
+    return yaml.dump(yaml_data, default_flow_style=False,
+                     sort_keys=True).encode('utf-8')
+
+
+def _create_staging_dir(output_dir):
+    """
+    Create an empty staging directory next to output_dir, so that it lives on
+    the same filesystem and can be published with a rename.
+
+    :param output_dir: Path of the directory the staging directory is published to
+    :return: the path of the staging directory
+    """
+    output_dir = os.path.abspath(output_dir)
+    parent_dir, output_name = os.path.split(output_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+
+    staging_dir = os.path.join(parent_dir, '.%s.%s.tmp' % (output_name,
+                                                           uuid.uuid4().hex))
+    os.mkdir(staging_dir)
+    return staging_dir
+
+
+def _publish_staging_dir(staging_dir, output_dir):
+    """
+    Publish a fully written staging directory as output_dir. A missing or empty
+    output_dir is replaced with a single atomic rename, otherwise the staged
+    files are moved into the existing output_dir one rename at a time.
+
+    :param staging_dir: Path of the staging directory created next to output_dir
+    :param output_dir: Path of the directory to be populated
+    """
+    if not os.path.exists(output_dir) or \
+            (os.path.isdir(output_dir) and not os.listdir(output_dir)):
+        try:
+            # an empty directory is replaced by the rename itself, so output_dir
+            # never disappears in between
+            os.replace(staging_dir, output_dir)
+            return
+        except OSError as e:
+            # output_dir got populated concurrently
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+    _merge_dir(staging_dir, output_dir)
+
+
+def _merge_dir(source_dir, dest_dir):
+    for item in os.listdir(source_dir):
+        source_path = os.path.join(source_dir, item)
+        dest_path = os.path.join(dest_dir, item)
+        if os.path.isdir(source_path) and os.path.isdir(dest_path):
+            _merge_dir(source_path, dest_path)
+        else:
+            os.replace(source_path, dest_path)
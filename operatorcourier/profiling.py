@@ -0,0 +1,215 @@
+"""
+operatorcourier.profiling
+
+Profiles a command of the cli with cProfile, and breaks its time down into
+the phases of operator-courier. This module is only imported when profiling
+is requested, so it adds no overhead otherwise.
+"""
+import cProfile
+import os
+import pstats
+from collections import namedtuple
+
+# the functions whose time makes up each phase, as tuples of the path of their
+# module and their name. Phases nest, e.g. yaml load is called by identify,
+# which is called by the directory scan.
+PHASES = [
+    ('directory scan', [
+        ('operatorcourier/manifest_parser.py', 'get_csvs_pkg_info_from_root'),
+        ('operatorcourier/manifest_parser.py', 'get_crd_csv_files_info'),
+        ('operatorcourier/manifest_parser.py', 'is_manifest_folder'),
+        ('operatorcourier/flatten.py', 'get_manifest_folder_info'),
+    ]),
+    ('identify', [
+        ('operatorcourier/identify.py', 'load_operator_artifact'),
+    ]),
+    ('yaml load', [
+        ('yaml/__init__.py', 'load'),
+    ]),
+    ('build', [
+        ('operatorcourier/build.py', 'build_bundle'),
+    ]),
+    ('validate', [
+        ('operatorcourier/validate.py', 'validate'),
+    ]),
+    ('format', [
+        ('operatorcourier/format.py', 'format_bundle'),
+        ('operatorcourier/format.py', 'unformat_bundle'),
+    ]),
+    ('write', [
+        ('operatorcourier/fileops.py', 'write_output_files'),
+        ('operatorcourier/fileops.py', 'sync_output_files'),
+        ('operatorcourier/nest.py', '_publish_staging_dir'),
+        ('operatorcourier/verified_manifest.py', 'write_validation_to_file'),
+    ]),
+]
+
+PhaseTime = namedtuple('PhaseTime', ['phase', 'calls', 'duration',
+                                     'cumulative_duration'])
+
+
+def profile_call(profile_path, output, func, *args, **kwargs):
+    """
+    Call func with cProfile, write the stats of the profile to profile_path,
+    and print the phase breakdown of the call to output. The stats are written
+    even if func raises.
+
+    :param profile_path: the path of the pstats file, which can be read with
+                         pstats.Stats, or visualized with e.g. snakeviz
+    :param output: the text file the phase breakdown is printed to
+    :param func: the function to profile, which is called with args and kwargs
+    :return: the return value of func
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
+        stats = pstats.Stats(profiler)
+        print('Wrote profile to %s' % profile_path, file=output)
+        print(format_phase_breakdown(get_phase_breakdown(stats), stats.total_tt),
+              file=output)
+
+
+def get_phase_breakdown(stats):
+    """
+    Break the time of a profile down into PHASES. The time spent in each
+    function is attributed to the innermost phase it was called from, like
+    gprof does. A function called from several phases has its time split
+    between them, in proportion to the time spent in it from each caller.
+
+    :param stats: the pstats.Stats of a profile
+    :return: a list of PhaseTimes in the order of PHASES, with the number of
+             calls of the functions of each phase, the duration in seconds
+             attributed to the phase, excluding nested phases, and the
+             cumulative duration of the functions of the phase
+    """
+    phase_functions = {}  # { (MODULE_PATH, FUNCTION_NAME) => PHASE }
+    for phase, functions in PHASES:
+        for function in functions:
+            phase_functions[function] = phase
+
+    roots = {}  # { PSTATS_KEY => PHASE }
+    for key in stats.stats:
+        file_name, _, function_name = key
+        module_path = '/'.join(os.path.normpath(file_name).split(os.sep)[-2:])
+        if (module_path, function_name) in phase_functions:
+            roots[key] = phase_functions[(module_path, function_name)]
+
+    # the callers of each function, where functions that make up a phase
+    # belong to it no matter where they are called from
+    callers = {key: {} if key in roots else stat[4]
+               for key, stat in stats.stats.items()}
+
+    # recursive functions are treated as a single function, which is called
+    # from outside of the recursion, and callers are processed before callees
+    shares_by_key = {}
+    for component in reversed(_get_call_cycles(callers)):
+        caller_times = {}
+        for key in component:
+            for caller, caller_stat in callers.get(key, {}).items():
+                if caller not in component:
+                    caller_times[caller] = \
+                        caller_times.get(caller, 0.0) + caller_stat[3]
+        total_time = sum(caller_times.values())
+
+        shares = {}
+        for caller, time in caller_times.items():
+            weight = time / total_time if total_time else 1 / len(caller_times)
+            for phase, share in shares_by_key[caller].items():
+                shares[phase] = shares.get(phase, 0.0) + share * weight
+        for key in component:
+            shares_by_key[key] = {roots[key]: 1.0} if key in roots else shares
+
+    calls, durations, cumulative_durations = {}, {}, {}
+    for key, stat in stats.stats.items():
+        primitive_calls, _, total_time, cumulative_time, _ = stat
+        if key in roots:
+            phase = roots[key]
+            calls[phase] = calls.get(phase, 0) + primitive_calls
+            cumulative_durations[phase] = \
+                cumulative_durations.get(phase, 0.0) + cumulative_time
+        for phase, share in shares_by_key[key].items():
+            durations[phase] = durations.get(phase, 0.0) + total_time * share
+
+    return [PhaseTime(phase, calls.get(phase, 0), durations.get(phase, 0.0),
+                      cumulative_durations.get(phase, 0.0))
+            for phase, _ in PHASES]
+
+
+def _get_call_cycles(callers):
+    """
+    Find the strongly connected components of the call graph with Tarjan's
+    algorithm, without recursion, since call graphs can be deep.
+
+    :param callers: a dict of every function to a dict of its callers
+    :return: a list of sets of functions, where the callees of each set come
+             before it
+    """
+    callees = {key: [] for key in callers}
+    for key, key_callers in callers.items():
+        for caller in key_callers:
+            callees.setdefault(caller, []).append(key)
+
+    index, lowlinks, stack, on_stack, components = {}, {}, [], set(), []
+    for start_key in callees:
+        if start_key in index:
+            continue
+        work = [(start_key, iter(callees[start_key]))]
+        index[start_key] = lowlinks[start_key] = len(index)
+        stack.append(start_key)
+        on_stack.add(start_key)
+        while work:
+            key, key_callees = work[-1]
+            for callee in key_callees:
+                if callee not in index:
+                    index[callee] = lowlinks[callee] = len(index)
+                    stack.append(callee)
+                    on_stack.add(callee)
+                    work.append((callee, iter(callees[callee])))
+                    break
+                if callee in on_stack:
+                    lowlinks[key] = min(lowlinks[key], index[callee])
+            else:
+                work.pop()
+                if work:
+                    caller = work[-1][0]
+                    lowlinks[caller] = min(lowlinks[caller], lowlinks[key])
+                if lowlinks[key] == index[key]:
+                    component = set()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.add(member)
+                        if member == key:
+                            break
+                    components.append(component)
+    return components
+
+
+def format_phase_breakdown(breakdown, total_duration):
+    """
+    :param breakdown: the list of PhaseTimes returned by get_phase_breakdown
+    :param total_duration: the total duration of the profile in seconds
+    :return: a table of the phases, with their calls, duration, share of the
+             total duration and cumulative duration, followed by the time
+             spent outside of any phase
+    """
+    other_duration = total_duration - sum(phase_time.duration
+                                          for phase_time in breakdown)
+    rows = breakdown + [
+        PhaseTime('other', None, other_duration, None),
+        PhaseTime('total', None, total_duration, total_duration),
+    ]
+
+    lines = ['%-16s %8s %10s %7s %12s'
+             % ('phase', 'calls', 'seconds', 'share', 'cumulative')]
+    for phase_time in rows:
+        share = phase_time.duration / total_duration if total_duration else 0.0
+        lines.append('%-16s %8s %10.3f %6.1f%% %12s' % (
+            phase_time.phase,
+            phase_time.calls if phase_time.calls is not None else '',
+            phase_time.duration, share * 100,
+            '%.3f' % phase_time.cumulative_duration
+            if phase_time.cumulative_duration is not None else ''))
+    return '\n'.join(lines)
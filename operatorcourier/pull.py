@@ -0,0 +1,309 @@
+"""
+operatorcourier.pull
+
+Fetches released bundles back from the app registry, through a local
+digest-keyed cache.
+"""
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tarfile
+from collections import OrderedDict, namedtuple
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+
+import requests
+import yaml
+from operatorcourier import identify
+from operatorcourier.build import BuildCmd
+from operatorcourier.defaults import CACHE_DIR_ENV
+from operatorcourier.errors import OpCourierBadBundle, \
+    OpCourierQuayCommunicationError, OpCourierValueError
+from operatorcourier.flatten import ManifestFolderInfo, merge_crd_dict
+from operatorcourier.format import unformat_bundle
+from operatorcourier.manifest_parser import CRD_STR, CSV_STR, PKG_STR
+from operatorcourier.push import ARCHIVE_SPOOL_SIZE, get_error_response, \
+    get_registry_url
+
+logger = logging.getLogger(__name__)
+
+# the size of the chunks the response is streamed in
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+PulledBundle = namedtuple('PulledBundle', ['bundle', 'digest', 'cached'])
+
+
+def get_default_cache_dir():
+    """
+    :return: the directory of the pull cache, from the OPERATOR_COURIER_CACHE_DIR
+             environment variable, or operator-courier in the user cache directory
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir:
+        return cache_dir
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'operator-courier')
+
+
+def _check_path_component(name, value):
+    separators = [sep for sep in (os.sep, os.altsep, '/') if sep]
+    if value in ('', '.', '..') or '\0' in value or \
+            any(sep in value for sep in separators):
+        msg = 'The %s %r is not a valid name.' % (name, value)
+        logger.error(msg)
+        raise OpCourierValueError(msg)
+
+
+class PullCmd():
+    name = 'pull'
+
+    def __init__(self, session=None, registry_url=None, cache_dir=None):
+        """
+        :param session: requests.Session to fetch releases with, see
+                        push.create_session
+        :param registry_url: base URL of the CNR app registry API, see
+                             push.PushCmd
+        :param cache_dir: directory of the local cache, defaults to
+                          get_default_cache_dir(). The archives of releases are
+                          stored by their sha256 digest, next to the digest and
+                          ETag of each pulled release.
+        """
+        self.session = session
+        self.registry_url = get_registry_url(registry_url)
+        self.cache_dir = cache_dir if cache_dir is not None else \
+            get_default_cache_dir()
+        # parsed bundles by digest, so that repeated pulls skip parsing
+        self._bundles = {}
+
+    def pull(self, namespace, repository, release, auth_token=None):
+        """Pull fetches a release from the app registry and converts it back
+        into a bundle.
+
+        The request is conditional on the ETag of the cached release, so an
+        unchanged release is not downloaded again. Otherwise the base64 encoded
+        archive is decoded and hashed as it streams in, and stored in the cache
+        by its digest.
+
+        :param namespace: Namespace that contains the repository of the release.
+        :param repository: Repository name of the application.
+        :param release: Release version of the bundle.
+        :param auth_token: Optional authentication token of the app registry.
+        :return: a PulledBundle with the bundle, the sha256 digest of its archive,
+                 and whether the archive was served from the cache.
+
+        :raises OpCourierValueError: When namespace, repository or release is not
+                                     a single path component, which would
+                                     escape the cache directory
+        """
+        for name, value in [('namespace', namespace), ('repository', repository),
+                            ('release', release)]:
+            _check_path_component(name, value)
+
+        pull_uri = '%s/api/v1/packages/%s/%s/%s/helm/pull' % (
+            self.registry_url, namespace, repository, release)
+        ref_path = os.path.join(self.cache_dir, 'refs', namespace, repository,
+                                release + '.json')
+        ref = _read_json(ref_path)
+        if ref is not None and not os.path.exists(self._get_blob_path(ref['digest'])):
+            ref = None
+
+        headers = {'Accept': 'application/json'}
+        if auth_token:
+            headers['Authorization'] = auth_token
+        if ref is not None and ref.get('etag'):
+            headers['If-None-Match'] = ref['etag']
+
+        http = self.session if self.session is not None else requests
+        logger.info('Pulling bundle from %s' % pull_uri)
+        try:
+            with http.get(pull_uri, params={'format': 'json'}, headers=headers,
+                          stream=True) as r:
+                if r.status_code == 304 and ref is not None:
+                    logger.info('Release %s of %s/%s is cached.',
+                                release, namespace, repository)
+                    return PulledBundle(self._load_bundle(ref['digest']),
+                                        ref['digest'], True)
+                if r.status_code != 200:
+                    raise get_error_response(r)
+                digest = self._store_blob(r)
+                etag = r.headers.get('ETag')
+        except requests.RequestException as e:
+            msg = str(e)
+            logger.error(msg)
+            raise OpCourierQuayCommunicationError(msg)
+
+        _write_json(ref_path, dict(digest=digest, etag=etag, uri=pull_uri))
+        return PulledBundle(self._load_bundle(digest), digest, False)
+
+    def _get_blob_path(self, digest):
+        return os.path.join(self.cache_dir, 'blobs', 'sha256', digest + '.tar.gz')
+
+    def _store_blob(self, r):
+        """Decode the archive of a pull response into the cache.
+
+        :param r: the streamed requests.Response, either with a JSON body with
+                  the base64 encoded archive as "blob", or with the raw archive
+        :return: the hex encoded sha256 digest of the archive
+        """
+        chunks = r.iter_content(DOWNLOAD_CHUNK_SIZE)
+        if 'json' in r.headers.get('Content-Type', ''):
+            chunks = _iter_json_blob(chunks)
+
+        with SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as blob:
+            sha256 = hashlib.sha256()
+            for chunk in chunks:
+                sha256.update(chunk)
+                blob.write(chunk)
+            digest = sha256.hexdigest()
+
+            blob_path = self._get_blob_path(digest)
+            if not os.path.exists(blob_path):
+                blob.seek(0)
+                _write_atomic(blob_path,
+                              iter(lambda: blob.read(DOWNLOAD_CHUNK_SIZE), b''))
+        return digest
+
+    def _load_bundle(self, digest):
+        if digest not in self._bundles:
+            with open(self._get_blob_path(digest), 'rb') as blob:
+                self._bundles[digest] = _read_bundle_archive(blob)
+        return self._bundles[digest]
+
+
+def _iter_json_blob(chunks):
+    """Extract the base64 encoded "blob" of a streamed JSON object, and decode
+    it chunk by chunk.
+
+    :param chunks: iterable of the bytes of the JSON object
+    :return: a generator of the decoded chunks of the blob
+    """
+    buffer = b''
+    chunks = iter(chunks)
+    # find the start of the value of the blob key
+    for chunk in chunks:
+        buffer += chunk
+        key_index = buffer.find(b'"blob"')
+        if key_index == -1:
+            continue
+        value_index = buffer.find(b'"', key_index + len(b'"blob"'))
+        if value_index != -1:
+            buffer = buffer[value_index + 1:]
+            break
+    else:
+        raise OpCourierBadBundle('The pulled release has no blob.', {})
+
+    pending = b''
+    for chunk in itertools.chain([buffer], chunks):
+        end_index = chunk.find(b'"')
+        # base64 contains no backslashes, but JSON may escape its slashes
+        pending += chunk[:end_index if end_index != -1 else None].replace(b'\\', b'')
+        decodable_length = len(pending) - len(pending) % 4
+        if decodable_length:
+            yield base64.b64decode(pending[:decodable_length])
+            pending = pending[decodable_length:]
+        if end_index != -1:
+            break
+    if pending:
+        yield base64.b64decode(pending)
+
+
+def _read_bundle_archive(fileobj):
+    """Convert a pulled archive back into a bundle. A flat release contains a
+    formatted bundle.yaml, which is unformatted, while the manifest files of a
+    nested release are rebuilt into the bundle of its package, see
+    _build_nested_bundle.
+
+    :param fileobj: Binary file object of the gzipped tarball of the release
+    :return: the bundle
+    """
+    with tarfile.open(fileobj=fileobj, mode='r:gz') as tar:
+        members = sorted((member for member in tar.getmembers() if member.isfile()),
+                         key=lambda member: member.name)
+        for member in members:
+            if os.path.basename(member.name) == 'bundle.yaml':
+                return unformat_bundle(yaml.safe_load(tar.extractfile(member)))
+
+        manifest_files = [(member.name,
+                           tar.extractfile(member).read().decode('utf-8'))
+                          for member in members
+                          if os.path.splitext(member.name)[1] in ('.yaml', '.yml')]
+    return _build_nested_bundle(manifest_files)
+
+
+def _build_nested_bundle(manifest_files):
+    """Build the bundle of the package of a nested release the way flatten
+    does: the package file, the CSVs of every version directory, and each CRD
+    once, from the newest version directory that contains it. The bundle has
+    no metadata.filenames, like an unformatted flat release.
+
+    :param manifest_files: list of tuples of the path of each manifest file in
+                           the archive, and of its content, sorted by path
+    :return: the bundle
+    """
+    bundle = BuildCmd()._get_empty_bundle()
+    crd_dict = {}  # { CRD_NAME => (VERSION, CRD_PATH) }
+    crds = {}  # { CRD_PATH => CRD_DATA }
+    folder_files = OrderedDict()  # { VERSION_DIR => [ (PATH, TYPE, DATA) ] }
+
+    for path, content in manifest_files:
+        yaml_type, yaml_data = identify.load_operator_artifact(content)
+        if yaml_type == PKG_STR:
+            bundle['data']['packages'].append(yaml_data)
+        elif yaml_type in (CSV_STR, CRD_STR):
+            folder_files.setdefault(os.path.dirname(path), []).append(
+                (path, yaml_type, yaml_data))
+
+    for folder, files in folder_files.items():
+        csvs = [yaml_data for _, yaml_type, yaml_data in files
+                if yaml_type == CSV_STR]
+        if not csvs:
+            logger.warning('Ignoring folder "%s" as it is not a valid manifest '
+                           'folder', folder)
+            continue
+        bundle['data']['clusterServiceVersions'].extend(csvs)
+
+        crd_paths = {}  # { CRD_NAME => CRD_PATH }
+        try:
+            for path, yaml_type, yaml_data in files:
+                if yaml_type == CRD_STR:
+                    crd_paths[yaml_data['metadata']['name']] = path
+                    crds[path] = yaml_data
+            folder_semver = csvs[0]['spec']['version']
+        except (KeyError, TypeError):
+            msg = 'The folder "%s" of the pulled release has a CSV without ' \
+                  '"spec.version" or a CRD without "metadata.name".' % folder
+            logger.error(msg)
+            raise OpCourierBadBundle(msg, {})
+        merge_crd_dict(crd_dict, ManifestFolderInfo(folder, folder_semver, [],
+                                                    crd_paths))
+
+    bundle['data']['customResourceDefinitions'] = [
+        crds[crd_path] for _, crd_path in sorted(crd_dict.values(),
+                                                 key=lambda crd: crd[1])]
+    return bundle
+
+
+def _read_json(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    _write_atomic(path, [json.dumps(data, sort_keys=True).encode('utf-8')])
+
+
+def _write_atomic(path, chunks):
+    """Write the chunks into path through a temporary file, so that concurrent
+    readers of the cache never see a partially written file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as tmp_file:
+        for chunk in chunks:
+            tmp_file.write(chunk)
+    os.replace(tmp_file.name, path)
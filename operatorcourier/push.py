@@ -1,72 +1,555 @@
 import os
 import base64
+import datetime
+import email.utils
+import hashlib
+import io
+import json
+import random
+import time
 import requests
+import requests.adapters
 import tarfile
 import logging
-from tempfile import TemporaryDirectory
+from tempfile import SpooledTemporaryFile
 from operatorcourier.errors import (
     OpCourierQuayCommunicationError,
     OpCourierQuayErrorResponse
 )
-from operatorcourier.manifest_parser import filterOutFiles
+from operatorcourier.fileops import OutputFile
+from operatorcourier.compress import gzip_fileobj
+from operatorcourier.defaults import DEFAULT_RETRY_BACKOFF, \
+    DEFAULT_MAX_RETRY_BACKOFF, DEFAULT_REGISTRY_URL, REGISTRY_URL_ENV
 
 logger = logging.getLogger(__name__)
-# BLACK_LIST is a list of files to be removed from the manifest directory
+# BLACK_LIST is a list of files excluded from the pushed bundle
 BLACK_LIST = ["art.yaml", "image-references"]
+# the tarball is base64 encoded in chunks of this size, which must be a
+# multiple of 3 so that the concatenated chunks form a single base64 string
+BASE64_CHUNK_SIZE = 3 * 64 * 1024
+# archives are built in memory, and only spill to disk beyond this size
+ARCHIVE_SPOOL_SIZE = 64 * 1024 * 1024
+# statuses of a PushResult
+PUSH_STATUS_PUSHED = 'pushed'
+PUSH_STATUS_UNCHANGED = 'unchanged'
+
+
+def get_registry_url(registry_url=None):
+    """Resolve the base URL of the CNR app registry API.
+
+    :param registry_url: the base URL, if given explicitly
+    :return: registry_url, or the URL in the REGISTRY_URL_ENV environment
+             variable, or DEFAULT_REGISTRY_URL, without a trailing slash
+    """
+    if registry_url is None:
+        registry_url = os.environ.get(REGISTRY_URL_ENV) or DEFAULT_REGISTRY_URL
+    return registry_url.rstrip('/')
+
+
+def get_error_response(r):
+    """Convert an error response of the app registry into an exception.
+
+    :param r: the requests.Response with an error status
+    :return: the OpCourierQuayErrorResponse with the message of the response
+    """
+    try:
+        r_json = r.json()
+    except ValueError:
+        r_json = {}
+
+    msg = r_json.get('error', {}).get(
+        'message', 'Failed to get error details.'
+    )
+    return OpCourierQuayErrorResponse(msg, r.status_code, r_json)
+
+
+def create_session(pool_size=10):
+    """Create a requests.Session that keeps up to pool_size connections per host
+    open, so that concurrent and consecutive pushes reuse their connections.
+
+    :param pool_size: the maximum number of connections kept open per host
+    :return: the requests.Session
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 
 class PushCmd():
     name = 'push'
 
-    def __init__(self):
-        pass
+    def __init__(self, compresslevel=9, compress_threads=1, session=None,
+                 rate_limiter=None, retries=0, backoff=DEFAULT_RETRY_BACKOFF,
+                 max_backoff=DEFAULT_MAX_RETRY_BACKOFF, skip_unchanged=False,
+                 registry_url=None):
+        """
+        :param compresslevel: gzip compression level of the bundle archive, from
+                              0 (no compression) to 9 (best compression).
+        :param compress_threads: number of threads compressing the bundle archive.
+                                 With more than 1 thread, blocks of the archive are
+                                 compressed concurrently into a standard gzip stream.
+        :param session: requests.Session whose connections are reused by every
+                        push of this PushCmd, see create_session. Without a
+                        session, each push opens a new connection.
+        :param rate_limiter: object with a wait(url) method, called before each
+                             request, e.g. a bulk.HostRateLimiter.
+        :param retries: number of times a push is retried after a connection
+                        error, a timeout, or a 429 or 5xx response.
+        :param backoff: base delay in seconds before the first retry, which
+                        doubles with every further retry, with random jitter.
+        :param max_backoff: maximum delay in seconds before a retry, which also
+                            caps delays requested by Retry-After headers.
+        :param skip_unchanged: look up the release in the app registry first, and
+                               skip the upload if its digest matches the archive.
+                               The digest is that of the gzipped archive, which
+                               depends on compresslevel and compress_threads, so
+                               the same content pushed with other compression
+                               settings is not detected as unchanged.
+        :param registry_url: base URL of the CNR app registry API, defaults to
+                             the OPERATOR_COURIER_REGISTRY_URL environment
+                             variable, or to https://quay.io/cnr.
+        """
+        self.compresslevel = compresslevel
+        self.compress_threads = compress_threads
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.skip_unchanged = skip_unchanged
+        self.registry_url = get_registry_url(registry_url)
 
     def push(self, bundle_dir, namespace, repository, release, auth_token):
         """Push takes a bundle and pushes it to the specified app registry repository.
 
+        The bundle is archived in memory, spilling to a temporary file only for
+        very large bundles, and the base64 encoded JSON request body is streamed
+        from the archive in chunks. The archive is reproducible, so the same
+        bundle always results in the same bytes and digest.
+
         :param bundle_dir: Path to generated local directory that contains the bundle.
         :param namespace: Namespace that contains the repository for the application.
         :param repository: Repository name of the application described by the bundle.
         :param release: Release version of the bundle.
-        :param auth_token: Authentication token used to push to Quay.io.
+        :param auth_token: Authentication token used to push to the app registry.
+        :return: the PushResult with the digest of the archive and the attempts
+                 made to push it. Its status is "unchanged" if the upload was
+                 skipped, because the release already has the same digest.
+        """
+        return self.push_files(_get_bundle_files(bundle_dir), namespace, repository,
+                               release, auth_token)
+
+    def push_files(self, bundle_files, namespace, repository, release, auth_token):
+        """Push the given files as a bundle to the specified app registry repository.
+
+        The files are archived straight from their source paths or contents, so
+        a bundle can be pushed without copying it into a directory first.
+
+        :param bundle_files: list of fileops.OutputFiles, whose paths are the
+                             paths of the files in the bundle.
+        :param namespace: Namespace that contains the repository for the application.
+        :param repository: Repository name of the application described by the bundle.
+        :param release: Release version of the bundle.
+        :param auth_token: Authentication token used to push to the app registry.
+        :return: the PushResult of the push, see push.
         """
         logger.info('Generating 64 bit bundle and pushing to app registry.')
-        filterOutFiles(bundle_dir, BLACK_LIST)
-        base64_bundle = self._create_base64_bundle(bundle_dir, repository)
-        self._push_to_registry(namespace, repository, release, base64_bundle, auth_token)
-
-    def _create_base64_bundle(self, bundle_dir, repository):
-        with TemporaryDirectory() as temp_dir:
-            tarfile_name = os.path.join(temp_dir, "%s.tar.gz" % repository)
-            with tarfile.open(tarfile_name, "w:gz") as tar:
-                tar.add(bundle_dir, os.path.basename(bundle_dir))
-            with open(tarfile_name, "rb") as tarball:
-                result = tarball.read()
-            result64 = base64.b64encode(result).decode("utf-8")
-            return result64
-
-    def _push_to_registry(self, namespace, repository, release, bundle, auth_token):
-        push_uri = 'https://quay.io/cnr/api/v1/packages/%s/%s' % (namespace, repository)
-        logger.info('Pushing bundle to %s' % push_uri)
-        headers = {'Content-Type': 'application/json', 'Authorization': auth_token}
-        json = {'blob': bundle, 'release': release, "media_type": "helm"}
+        result = PushResult(self._get_push_uri(namespace, repository))
+        with SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as tarball:
+            result.digest = self._create_tarball_from_files(bundle_files, tarball,
+                                                            repository, result)
+            release_digest = None
+            if self.skip_unchanged:
+                lookup_start = time.monotonic()
+                release_digest = self._get_release_digest(namespace, repository,
+                                                          release, auth_token)
+                result.add_phase('lookup', time.monotonic() - lookup_start)
+                if release_digest == result.digest:
+                    logger.info('Release %s of %s/%s is unchanged, skipping push.',
+                                release, namespace, repository)
+                    result.status = PUSH_STATUS_UNCHANGED
+                    logger.debug('Push of %s/%s@%s: %s', namespace, repository,
+                                 release, result.format_stats())
+                    return result
+            try:
+                return self._push_to_registry(namespace, repository, release,
+                                              tarball, auth_token, result)
+            except OpCourierQuayErrorResponse as e:
+                if e.code == 409 and release_digest is not None:
+                    logger.error('Release %s of %s/%s already exists with digest %s, '
+                                 'but the archive has digest %s. The digest depends '
+                                 'on the compression level and threads, so pushing '
+                                 'the same content with other compression settings '
+                                 'is not detected as unchanged.', release, namespace,
+                                 repository, release_digest, result.digest)
+                raise
+            finally:
+                logger.debug('Push of %s/%s@%s: %s', namespace, repository, release,
+                             result.format_stats())
+
+    def get_digest(self, bundle_dir, repository):
+        """Get the sha256 digest of the archive that push creates for a bundle,
+        without pushing it.
+
+        :param bundle_dir: Path to the local directory that contains the bundle.
+        :param repository: Repository name of the application described by the bundle.
+        :return: the hex encoded sha256 digest of the gzipped tarball.
+        """
+        with SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as tarball:
+            return self._create_tarball(bundle_dir, tarball, arcname=repository)
+
+    def _create_tarball(self, bundle_dir, fileobj, arcname=None):
+        """Archive bundle_dir into fileobj, without the files in BLACK_LIST,
+        see _create_tarball_from_files.
+
+        :param bundle_dir: Path to the local directory that contains the bundle.
+        :param fileobj: Binary file object the gzipped tarball is written to.
+        :param arcname: Name of the top level directory in the archive,
+                        defaults to the name of bundle_dir.
+        :return: the hex encoded sha256 digest of the gzipped tarball.
+        """
+        if arcname is None:
+            arcname = os.path.basename(os.path.normpath(bundle_dir))
+        return self._create_tarball_from_files(_get_bundle_files(bundle_dir),
+                                               fileobj, arcname)
+
+    def _create_tarball_from_files(self, bundle_files, fileobj, arcname,
+                                   result=None):
+        """Archive the bundle files into fileobj as a reproducible gzipped tarball,
+        compressed with the compression level and threads of this PushCmd.
+
+        Entries are added in sorted order, with their owner, modification time
+        and permissions normalized, and the gzip header carries no timestamp,
+        so that the archive only depends on the names and contents of the files.
+
+        :param bundle_files: list of fileops.OutputFiles of the bundle.
+        :param fileobj: Binary file object the gzipped tarball is written to.
+        :param arcname: Name of the top level directory in the archive.
+        :param result: PushResult the durations and sizes of the tar, gzip and
+                       digest phases are recorded in.
+        :return: the hex encoded sha256 digest of the gzipped tarball.
+        """
+        if result is None:
+            result = PushResult(None)
+        start = fileobj.tell()
+        with SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as tar_fileobj:
+            phase_start = time.monotonic()
+            with tarfile.open(fileobj=tar_fileobj, mode="w",
+                              format=tarfile.PAX_FORMAT) as tar:
+                _add_bundle_files(tar, bundle_files, arcname)
+            tar_fileobj.seek(0)
+            result.add_phase('tar', time.monotonic() - phase_start)
+
+            phase_start = time.monotonic()
+            result.tar_bytes = gzip_fileobj(tar_fileobj, fileobj, self.compresslevel,
+                                            self.compress_threads, mtime=0)
+            result.archive_bytes = fileobj.tell() - start
+            result.add_phase('gzip', time.monotonic() - phase_start)
+
+        phase_start = time.monotonic()
+        fileobj.seek(start)
+        sha256 = hashlib.sha256()
+        for chunk in iter(lambda: fileobj.read(BASE64_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+        fileobj.seek(start)
+        result.add_phase('digest', time.monotonic() - phase_start)
+        return sha256.hexdigest()
+
+    def _iter_push_body(self, tarball, release, result=None):
+        """Generate the JSON request body of a push in chunks, where the blob
+        is base64 encoded from the tarball one chunk at a time.
+
+        :param tarball: Binary file object of the gzipped bundle tarball.
+        :param release: Release version of the bundle.
+        :param result: PushResult the time spent encoding and the size of the
+                       body are recorded in.
+        """
+        tarball.seek(0)
+        body_bytes = 0
+        head = b'{"blob": "'
+        body_bytes += len(head)
+        yield head
+        for chunk in iter(lambda: tarball.read(BASE64_CHUNK_SIZE), b''):
+            encode_start = time.monotonic()
+            encoded_chunk = base64.b64encode(chunk)
+            if result is not None:
+                result.add_phase('base64', time.monotonic() - encode_start)
+            body_bytes += len(encoded_chunk)
+            yield encoded_chunk
+        tail = ('", "release": %s, "media_type": "helm"}'
+                % json.dumps(release)).encode('utf-8')
+        body_bytes += len(tail)
+        if result is not None:
+            result.body_bytes = body_bytes
+        yield tail
+
+    def _get_push_uri(self, namespace, repository):
+        return '%s/api/v1/packages/%s/%s' % (self.registry_url, namespace, repository)
+
+    def _get_release_digest(self, namespace, repository, release, auth_token):
+        """Look up the digest of the content of a release in the app registry.
+
+        :return: the hex encoded sha256 digest of the release, or None if the
+                 release does not exist or could not be looked up.
+        """
+        release_uri = '%s/%s/helm' % (self._get_push_uri(namespace, repository),
+                                      release)
+        http = self.session if self.session is not None else requests
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait(release_uri)
 
         try:
-            r = requests.post(push_uri, json=json, headers=headers)
+            r = http.get(release_uri, headers={'Authorization': auth_token})
         except requests.RequestException as e:
-            msg = str(e)
-            logger.error(msg)
-            raise OpCourierQuayCommunicationError(msg)
-
+            logger.warning('Failed to look up %s: %s', release_uri, e)
+            return None
+        if r.status_code == 404:
+            return None
         if r.status_code != 200:
-            logger.error(r.text)
+            logger.warning('Failed to look up %s: status %d', release_uri,
+                           r.status_code)
+            return None
+
+        try:
+            return r.json()['content']['digest']
+        except (ValueError, TypeError, KeyError):
+            logger.warning('Release %s has no content digest.', release_uri)
+            return None
+
+    def _push_to_registry(self, namespace, repository, release, tarball, auth_token,
+                          result=None):
+        """Post the tarball to the app registry, and retry transient failures.
+
+        Connection errors, timeouts and 429 or 5xx responses are retried up to
+        self.retries times, after an exponential backoff with full jitter, or
+        after the delay requested by a Retry-After header. Any other error
+        response fails immediately.
+
+        :param result: the PushResult the attempts are recorded in
+        :return: the PushResult of the push
+        """
+        push_uri = self._get_push_uri(namespace, repository)
+        logger.info('Pushing bundle to %s' % push_uri)
+        headers = {'Content-Type': 'application/json', 'Authorization': auth_token}
+        http = self.session if self.session is not None else requests
+        if result is None:
+            result = PushResult(push_uri)
 
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait(push_uri)
+
+            attempt_start = time.monotonic()
+            status_code = retry_after = None
             try:
-                r_json = r.json()
-            except ValueError:
-                r_json = {}
-
-            msg = r_json.get('error', {}).get(
-                'message', 'Failed to get error details.'
-            )
-            raise OpCourierQuayErrorResponse(msg, r.status_code, r_json)
+                # a generator body is sent with chunked transfer encoding
+                r = http.post(push_uri,
+                              data=self._iter_push_body(tarball, release, result),
+                              headers=headers)
+            except requests.RequestException as e:
+                error_text = str(e)
+                error = OpCourierQuayCommunicationError(error_text)
+                # only connection errors and timeouts are transient
+                retryable = isinstance(e, (requests.ConnectionError, requests.Timeout))
+            else:
+                status_code = r.status_code
+                if status_code == 200:
+                    result.add_attempt(time.monotonic() - attempt_start, status_code)
+                    return result
+                error_text = r.text
+                error = get_error_response(r)
+                retryable = status_code == 429 or status_code >= 500
+                retry_after = _parse_retry_after(r.headers.get('Retry-After'))
+            result.add_attempt(time.monotonic() - attempt_start, status_code)
+
+            if not retryable or result.attempts > self.retries:
+                logger.error(error_text)
+                error.push_result = result
+                raise error
+
+            delay = self._get_retry_delay(result.attempts, retry_after)
+            logger.warning('Push attempt %d to %s failed: %s. Retrying in %.1fs.',
+                           result.attempts, push_uri, error, delay)
+            time.sleep(delay)
+
+    def _get_retry_delay(self, attempts, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        # full jitter, so that concurrent pushes do not retry in lockstep
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** (attempts - 1)))
+
+
+class PushResult():
+    """The attempts made to push a bundle, and whether it was "pushed" or its
+    release was "unchanged". Failed pushes carry it as the push_result of their
+    OpCourierQuayError.
+
+    The durations of the phases of the push are recorded in phase_durations,
+    in seconds, by the name of the phase: "validate", "tar", "gzip", "digest",
+    "lookup", and "upload", which includes the "base64" encoding of the body
+    streamed during the upload. The sizes of the uncompressed tarball, the
+    gzipped archive and the request body are recorded in bytes.
+    """
+
+    def __init__(self, uri, digest=None):
+        """
+        :param uri: the URI the bundle was pushed to
+        :param digest: the hex encoded sha256 digest of the pushed archive
+        """
+        self.uri = uri
+        self.digest = digest
+        self.status = PUSH_STATUS_PUSHED
+        self.attempt_durations = []
+        self.status_codes = []
+        self.phase_durations = {}
+        self.tar_bytes = None
+        self.archive_bytes = None
+        self.body_bytes = None
+
+    @property
+    def attempts(self):
+        """The number of requests made to push the bundle."""
+        return len(self.attempt_durations)
+
+    @property
+    def duration(self):
+        """The total duration of all requests in seconds, excluding backoff."""
+        return sum(self.attempt_durations)
+
+    @property
+    def compression_ratio(self):
+        """The size of the uncompressed tarball divided by the archive size."""
+        if not self.tar_bytes or not self.archive_bytes:
+            return None
+        return self.tar_bytes / self.archive_bytes
+
+    @property
+    def upload_throughput(self):
+        """The request body bytes per second of the last, successful attempt."""
+        if not self.body_bytes or self.status_codes[-1:] != [200] or \
+                not self.attempt_durations[-1]:
+            return None
+        return self.body_bytes / self.attempt_durations[-1]
+
+    def add_phase(self, phase, duration):
+        """Add to the duration of a phase of the push.
+
+        :param phase: the name of the phase
+        :param duration: the duration in seconds
+        """
+        self.phase_durations[phase] = self.phase_durations.get(phase, 0.0) + duration
+
+    def add_attempt(self, duration, status_code=None):
+        """Record an attempt to push the bundle.
+
+        :param duration: the duration of the request in seconds
+        :param status_code: the status code of the response, or None if no
+                            response was received
+        """
+        self.attempt_durations.append(duration)
+        self.status_codes.append(status_code)
+        self.add_phase('upload', duration)
+
+    def format_stats(self):
+        """Format the phase durations, sizes and throughput for logging."""
+        stats = ', '.join('%s %.3fs' % phase_duration
+                          for phase_duration in self.phase_durations.items())
+        if self.archive_bytes is not None:
+            stats += '; tar %d bytes, gzip %d bytes' % (self.tar_bytes,
+                                                        self.archive_bytes)
+        if self.compression_ratio is not None:
+            stats += ' (ratio %.2f)' % self.compression_ratio
+        if self.body_bytes is not None:
+            stats += ', body %d bytes' % self.body_bytes
+        if self.upload_throughput is not None:
+            stats += '; upload %.1f KiB/s' % (self.upload_throughput / 1024)
+        return '%s in %d attempts: %s' % (self.status, self.attempts, stats)
+
+    def to_dict(self):
+        """Return the push result as a JSON serializable dict."""
+        return dict(uri=self.uri, digest=self.digest, status=self.status,
+                    attempts=self.attempts,
+                    attempt_durations=self.attempt_durations,
+                    status_codes=self.status_codes,
+                    phase_durations=self.phase_durations,
+                    tar_bytes=self.tar_bytes, archive_bytes=self.archive_bytes,
+                    body_bytes=self.body_bytes,
+                    compression_ratio=self.compression_ratio,
+                    upload_throughput=self.upload_throughput)
+
+
+def _get_bundle_files(bundle_dir):
+    """List the files of bundle_dir and its subdirectories as OutputFiles,
+    without the files in BLACK_LIST.
+    """
+    bundle_files = []
+    for root, _, file_names in os.walk(bundle_dir):
+        for file_name in file_names:
+            if file_name in BLACK_LIST:
+                continue
+            file_path = os.path.join(root, file_name)
+            bundle_files.append(OutputFile(os.path.relpath(file_path, bundle_dir),
+                                           src_file_path=file_path))
+    return bundle_files
+
+
+def _add_bundle_files(tar, bundle_files, arcname):
+    """Add the bundle files below the directory arcname to tar, in sorted order
+    and with the metadata that differs between checkouts and machines stripped,
+    only keeping whether a file is executable.
+    """
+    def tar_info(name, directory=False):
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.mode = 0o755 if directory else 0o644
+        if directory:
+            tarinfo.type = tarfile.DIRTYPE
+        return tarinfo
+
+    tar.addfile(tar_info(arcname, directory=True))
+    added_dirs = set()
+    for bundle_file in sorted(bundle_files,
+                              key=lambda f: os.path.normpath(f.path).split(os.sep)):
+        parts = os.path.normpath(bundle_file.path).split(os.sep)
+        for depth in range(1, len(parts)):
+            dir_name = '/'.join([arcname] + parts[:depth])
+            if dir_name not in added_dirs:
+                added_dirs.add(dir_name)
+                tar.addfile(tar_info(dir_name, directory=True))
+
+        tarinfo = tar_info('/'.join([arcname] + parts))
+        if bundle_file.src_file_path is None:
+            tarinfo.size = len(bundle_file.content)
+            tar.addfile(tarinfo, io.BytesIO(bundle_file.content))
+            continue
+        with open(bundle_file.src_file_path, 'rb') as src:
+            stat = os.fstat(src.fileno())
+            tarinfo.size = stat.st_size
+            if stat.st_mode & 0o100:
+                tarinfo.mode = 0o755
+            tar.addfile(tarinfo, src)
+
+
+def _parse_retry_after(value):
+    """Parse a Retry-After header, which is either a number of seconds or
+    an HTTP date, into a number of seconds, or None if it is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_time is None:
+        return None
+    if retry_time.tzinfo is None:
+        retry_time = retry_time.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (retry_time - now).total_seconds())
@@ -0,0 +1,251 @@
+"""
+operatorcourier.registry_server
+
+A minimal in-memory stand-in for the CNR app registry API, to test and
+benchmark pushes and pulls locally. It implements the push, release lookup
+and pull endpoints, and can inject latency and errors into its responses.
+
+Run it with `python -m operatorcourier.registry_server`.
+"""
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import random
+import re
+import socketserver
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+logger = logging.getLogger(__name__)
+
+_PACKAGE_PATH = re.compile(r'^/api/v1/packages/(?P<namespace>[^/]+)/'
+                           r'(?P<repository>[^/]+)$')
+_RELEASE_PATH = re.compile(r'^/api/v1/packages/(?P<namespace>[^/]+)/'
+                           r'(?P<repository>[^/]+)/(?P<release>[^/]+)/'
+                           r'(?P<media_type>[^/]+)$')
+_PULL_PATH = re.compile(r'^/api/v1/packages/(?P<namespace>[^/]+)/'
+                        r'(?P<repository>[^/]+)/(?P<release>[^/]+)/'
+                        r'(?P<media_type>[^/]+)/pull$')
+
+
+class RegistryServer():
+    """An app registry stand-in serving on localhost from a background thread.
+
+    Releases are kept in memory, keyed by namespace, repository, release and
+    media type, and every request is counted by method in requests.
+    """
+
+    def __init__(self, port=0, latency=0.0, error_rate=0.0, error_status=503,
+                 seed=None):
+        """
+        :param port: the port to listen on, 0 picks a free port
+        :param latency: the delay in seconds added to every response
+        :param error_rate: the fraction of requests, from 0 to 1, answered
+                           with error_status instead of being served
+        :param error_status: the status code of injected errors
+        :param seed: seed of the random generator that injects errors
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.releases = {}
+        self.requests = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        handler = type('_BoundRegistryHandler', (_RegistryHandler,),
+                       {'registry': self})
+        self._httpd = _ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+    @property
+    def url(self):
+        """The base URL of the registry, to be used as registry_url."""
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        """Serve requests from a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests and close the socket."""
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        """Serve requests from the current thread until interrupted."""
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count_request(self, method):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            return self._random.random() < self.error_rate
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _RegistryHandler(BaseHTTPRequestHandler):
+    registry = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._read_body()
+        if self._inject():
+            return
+        path, _, query = self.path.partition('?')
+        match = _RELEASE_PATH.match(path) or _PULL_PATH.match(path)
+        if not match:
+            return self._send_error(404, 'Not found')
+
+        key = tuple(match.group('namespace', 'repository', 'release', 'media_type'))
+        release = self.registry.releases.get(key)
+        if release is None:
+            return self._send_error(404, 'Release not found')
+        if match.re is _RELEASE_PATH:
+            return self._send_json(200, release['manifest'])
+
+        etag = '"%s"' % release['manifest']['content']['digest']
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if 'format=json' in query.split('&'):
+            return self._send_json(200, {
+                'package': release['manifest']['package'],
+                'release': release['manifest']['release'],
+                'filename': '%s_%s.tar.gz' % (key[1], key[2]),
+                'blob': base64.b64encode(release['blob']).decode('utf-8'),
+            }, {'ETag': etag})
+        self._send_body(200, release['blob'], 'application/x-gzip', {'ETag': etag})
+
+    def do_POST(self):
+        body = self._read_body()
+        if self._inject():
+            return
+        match = _PACKAGE_PATH.match(self.path.split('?')[0])
+        if not match:
+            return self._send_error(404, 'Not found')
+
+        try:
+            data = json.loads(body.decode('utf-8'))
+            blob = base64.b64decode(data['blob'], validate=True)
+            release, media_type = str(data['release']), data['media_type']
+        except (ValueError, KeyError, TypeError, binascii.Error):
+            return self._send_error(400, 'Invalid package')
+
+        namespace, repository = match.group('namespace', 'repository')
+        key = (namespace, repository, release, media_type)
+        manifest = {
+            'package': '%s/%s' % (namespace, repository),
+            'release': release,
+            'mediaType': media_type,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'content': {
+                'digest': hashlib.sha256(blob).hexdigest(),
+                'size': len(blob),
+                'mediaType': 'application/vnd.cnr.package.%s.v0.tar+gzip'
+                             % media_type,
+            },
+        }
+        with self.registry._lock:
+            exists = key in self.registry.releases
+            if not exists:
+                self.registry.releases[key] = {'manifest': manifest, 'blob': blob}
+        if exists:
+            return self._send_error(409, 'Package %s/%s@%s already exists'
+                                    % (namespace, repository, release))
+        self._send_json(200, manifest)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    # skip the trailer up to the final empty line
+                    while self.rfile.readline().strip():
+                        pass
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _inject(self):
+        fail = self.registry._count_request(self.command)
+        if self.registry.latency:
+            time.sleep(self.registry.latency)
+        if fail:
+            self._send_error(self.registry.error_status, 'Injected error')
+        return fail
+
+    def _send_error(self, status_code, message):
+        self._send_json(status_code, {'error': {'code': status_code,
+                                                'message': message}})
+
+    def _send_json(self, status_code, data, headers=None):
+        self._send_body(status_code, json.dumps(data).encode('utf-8'),
+                        'application/json', headers)
+
+    def _send_body(self, status_code, body, content_type, headers=None):
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve an in-memory stand-in of the CNR app registry API '
+                    'for local push tests and benchmarks.')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='The port to listen on.')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='The delay in seconds added to every response.')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.0,
+                        help='The fraction of requests answered with an error.')
+    parser.add_argument('--error-status', dest='error_status', type=int,
+                        default=503, help='The status code of injected errors.')
+    args = parser.parse_args()
+
+    server = RegistryServer(args.port, args.latency, args.error_rate,
+                            args.error_status)
+    print('Serving app registry at %s' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+operatorcourier.server
+
+A long running server for verify, nest and flatten requests, which keeps the
+modules of operator-courier loaded and its parse cache warm between requests.
+It serves HTTP on a Unix socket only its owner can connect to, and requests
+are handled concurrently, each by its own thread. It does not listen on TCP,
+where any local process, and any web page through the browser, could send it
+requests that read and write arbitrary paths.
+
+Requests are POSTed as JSON objects to /, see commands.run_command, and the
+server state is returned by GET /health. See client.CourierClient. Requests
+with an Origin header, a Host other than localhost, or a Content-Type other
+than application/json are rejected, as are requests with delete, which
+removes files.
+"""
+import json
+import logging
+import os
+import socketserver
+import stat
+import threading
+from http.server import BaseHTTPRequestHandler
+
+from operatorcourier import identify
+from operatorcourier.client import CourierClient
+from operatorcourier.commands import COMMANDS, run_command
+from operatorcourier.defaults import DEFAULT_PARSE_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# the Host headers of requests from a client on the same machine
+LOOPBACK_HOSTS = ('localhost', '127.0.0.1', '[::1]')
+
+
+class CourierServer():
+    """Serves verify, nest and flatten requests on a Unix socket from a
+    background thread, or from the current thread with serve_forever.
+    """
+
+    def __init__(self, socket_path, parse_cache_size=DEFAULT_PARSE_CACHE_SIZE):
+        """
+        :param socket_path: the path of the Unix socket to listen on, which
+                            only the current user can connect to. A stale
+                            socket file left by a server that is no longer
+                            running is replaced.
+        :param parse_cache_size: the maximum number of parsed yaml files kept
+                                 in the identify.ParseCache of the server,
+                                 0 disables the cache
+        """
+        self.socket_path = socket_path
+        self.parse_cache = identify.ParseCache(parse_cache_size) \
+            if parse_cache_size else None
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._previous_parse_cache = None
+
+        handler = type('_BoundCourierHandler', (_CourierHandler,), {'server_': self})
+        _remove_stale_socket(socket_path)
+        # the socket is created without permissions for group and others,
+        # rather than restricted after it is bound
+        umask = os.umask(0o177)
+        try:
+            self._httpd = _ThreadingUnixServer(socket_path, handler)
+        finally:
+            os.umask(umask)
+
+    def start(self):
+        """Serve requests from a background thread."""
+        self._enable_parse_cache()
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests and close the socket."""
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._close()
+
+    def serve_forever(self):
+        """Serve requests from the current thread until interrupted."""
+        self._enable_parse_cache()
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get_health(self):
+        """
+        :return: a dict with the "status" of the server, its "pid", the
+                 "commands" it runs, the number of "requests" it has handled,
+                 and the stats of its "parse_cache"
+        """
+        with self._lock:
+            requests = self.requests
+        return dict(status='ok', pid=os.getpid(), commands=list(COMMANDS),
+                    requests=requests,
+                    parse_cache=self.parse_cache.get_stats()
+                    if self.parse_cache is not None else None)
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def _enable_parse_cache(self):
+        self._previous_parse_cache = identify.set_parse_cache(self.parse_cache)
+
+    def _close(self):
+        identify.set_parse_cache(self._previous_parse_cache)
+        self._httpd.server_close()
+        try:
+            if stat.S_ISSOCK(os.lstat(self.socket_path).st_mode):
+                os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _remove_stale_socket(socket_path):
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError('%s exists and is not a socket.' % socket_path)
+    try:
+        CourierClient(socket_path, timeout=1).get_health()
+    except OSError:
+        os.remove(socket_path)
+        return
+    raise OSError('A server is already listening on %s.' % socket_path)
+
+
+def _get_host_name(host):
+    # strip the port of e.g. "localhost:80" or "[::1]:80"
+    if host.startswith('['):
+        return host[:host.find(']') + 1]
+    return host.split(':')[0]
+
+
+class _CourierHandler(BaseHTTPRequestHandler):
+    server_ = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if not self._check_headers():
+            return
+        if self.path.split('?')[0] != '/health':
+            return self._send_json(404, {'error': 'Not found'})
+        self._send_json(200, self.server_.get_health())
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self._check_headers():
+            return
+        if self.path.split('?')[0] != '/':
+            return self._send_json(404, {'error': 'Not found'})
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip()
+        if content_type.lower() != 'application/json':
+            return self._send_json(415, {'error': 'The Content-Type of requests '
+                                                  'must be application/json.'})
+        try:
+            request = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return self._send_json(400, {'error': 'The request is not valid JSON.'})
+        if isinstance(request, dict) and request.get('delete'):
+            return self._send_json(403, {'error': 'Requests with delete are not '
+                                                  'run by the server.'})
+
+        self.server_._count_request()
+        self._send_json(200, run_command(request))
+
+    def _check_headers(self):
+        # requests sent by web pages carry an Origin, or the Host of the page
+        host = _get_host_name(self.headers.get('Host', ''))
+        if self.headers.get('Origin') is not None or host not in LOOPBACK_HOSTS:
+            self._send_json(403, {'error': 'Cross-origin requests are not allowed.'})
+            return False
+        return True
+
+    def _send_json(self, status_code, data):
+        body = json.dumps(data, sort_keys=True).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # clients of a Unix socket have no address
+        return 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
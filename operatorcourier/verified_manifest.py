@@ -2,6 +2,7 @@ import os
 import copy
 import logging
 import json
+from operatorcourier import identify
 from operatorcourier.build import BuildCmd
 from operatorcourier.validate import ValidateCmd
 from operatorcourier.errors import OpCourierBadBundle
@@ -57,7 +58,9 @@ class VerifiedManifest:
         :param source_dir: Path to local directory of operator manifests, which can be
                            in either flat or nested format
         :return: A dictionary object where the key is the folder name of the operator
-                 manifest, and the value is a list of yaml strings of manifest files
+                 manifest, and the value is a list of yaml strings of manifest files.
+                 In nested layouts the package is parsed once, and its parsed
+                 object is shared by all version entries.
 
                  FLAT_KEY is used as key if the directory structure is flat
         """
@@ -84,8 +87,13 @@ class VerifiedManifest:
 
                 crd_files_info, csv_files_info = get_crd_csv_files_info(manifest_path)
                 manifests[manifest_dir_name] = crd_files_info + csv_files_info
+
+            # parse the package once and share the same object between the
+            # builds and package validations of every version
+            pkg_path, pkg_content = pkg_path_and_content
+            _, pkg_data = identify.load_operator_artifact(pkg_content)
             for manifest_dir_name in manifests:
-                manifests[manifest_dir_name].append(pkg_path_and_content)
+                manifests[manifest_dir_name].append((pkg_path, pkg_data))
         # flat layout: collect all valid manifest files and add to FLAT_KEY entry
         elif pkg_path_and_content and csvs_path_and_content:
             logger.info('The source directory is in flat structure.')
@@ -1,8 +1,11 @@
+import tarfile
+
 import pytest
 import yaml
 from operatorcourier import api
 from operatorcourier.format import unformat_bundle
 from operatorcourier.errors import OpCourierBadBundle
+from operatorcourier.push import PushCmd
 
 
 @pytest.mark.parametrize('directory,expected', [
@@ -107,3 +110,40 @@ def test_invalid_flat_bundles(nested_source_dir):
         api.build_and_verify(source_dir=nested_source_dir, repository='oneagent')
 
     assert str(err.value) == "Only 1 package is expected to exist in source root folder."
+
+
+@pytest.mark.parametrize('source_dir,expected_names', [
+    ("tests/test_files/bundles/api/etcd_valid_nested_bundle_with_random_folder", [
+        'etcd', 'etcd/etcd.package.yaml', 'etcd/version_0.6',
+        'etcd/version_0.6/etcdcluster.crd.yaml',
+        'etcd/version_0.6/etcdoperator.clusterserviceversion.yaml',
+        'etcd/version_0.8', 'etcd/version_0.8/etcdbackup.crd.yaml',
+        'etcd/version_0.8/etcdcluster.crd.yaml',
+        'etcd/version_0.8/etcdoperator.v0.9.0.clusterserviceversion.yaml',
+        'etcd/version_0.8/etcdrestore.crd.yaml',
+        'etcd/version_0.9', 'etcd/version_0.9/etcdbackup.crd.yaml',
+        'etcd/version_0.9/etcdcluster.crd.yaml',
+        'etcd/version_0.9/etcdoperator.v0.9.2.clusterserviceversion.yaml',
+        'etcd/version_0.9/etcdrestore.crd.yaml',
+    ]),
+    ("tests/test_files/bundles/api/valid_flat_bundle_with_random_folder",
+     ['marketplace', 'marketplace/bundle.yaml']),
+])
+def test_build_verify_and_push_archives_source(monkeypatch, source_dir,
+                                               expected_names):
+    push_cmd = PushCmd()
+    pushed = {}
+
+    def push_to_registry(namespace, repository, release, tarball, auth_token,
+                         result):
+        with tarfile.open(fileobj=tarball) as tar:
+            pushed['names'] = tar.getnames()
+        return result
+
+    monkeypatch.setattr(push_cmd, '_push_to_registry', push_to_registry)
+    repository = expected_names[0]
+    result = api.build_verify_and_push('ns', repository, '1.0.0', 'token',
+                                       source_dir=source_dir, push_cmd=push_cmd)
+
+    assert pushed['names'] == expected_names
+    assert result.digest
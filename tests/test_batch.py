@@ -0,0 +1,73 @@
+import io
+import json
+
+from operatorcourier.batch import READ_AHEAD, run_batch
+
+FLAT_BUNDLE_DIR = 'tests/test_files/bundles/api/valid_flat_bundle'
+NESTED_BUNDLE_DIR = 'tests/test_files/bundles/api/etcd_valid_nested_bundle'
+INVALID_BUNDLE_DIR = 'tests/test_files/bundles/api/etcd_invalid_nested_bundle'
+
+
+def _run_batch(requests, **kwargs):
+    lines = [request if isinstance(request, str) else json.dumps(request)
+             for request in requests]
+    output = io.StringIO()
+    count, failed = run_batch(lines, output, **kwargs)
+    reports = [json.loads(line) for line in output.getvalue().splitlines()]
+    return count, failed, sorted(reports, key=lambda report: report['line'])
+
+
+def test_run_batch(tmp_path):
+    count, failed, reports = _run_batch([
+        dict(id='flat', command='verify', source_dir=FLAT_BUNDLE_DIR),
+        '',
+        dict(command='verify', source_dir=INVALID_BUNDLE_DIR),
+        'not json',
+        dict(command='nest', source_dir=FLAT_BUNDLE_DIR,
+             output_dir=str(tmp_path / 'nested'), sync=True),
+        dict(command='flatten', source_dir=NESTED_BUNDLE_DIR,
+             dest_dir=str(tmp_path / 'flat'), dry_run=True),
+    ], workers=2)
+
+    assert (count, failed) == (5, 2)
+    assert [report['line'] for report in reports] == [1, 3, 4, 5, 6]
+    assert [report['status'] for report in reports] == \
+        ['success', 'error', 'error', 'success', 'success']
+    assert reports[0]['id'] == 'flat'
+    assert reports[0]['result']['nested'] is False
+    assert reports[1]['errors'] == ['Resulting bundle is invalid, '
+                                    'input yaml is improperly defined.']
+    assert reports[2]['errors'][0].startswith('Invalid JSON: ')
+    assert len(reports[3]['result']['added']) == 3
+    assert {operation['path'] for operation in reports[4]['result']} >= \
+        {'etcd.package.yaml', 'etcdcluster.crd.yaml'}
+    assert all(report['duration'] >= 0 for report in reports)
+    assert not (tmp_path / 'flat').exists()
+
+
+def test_run_batch_reads_ahead():
+    requests = [json.dumps(dict(id=i, command='verify', source_dir=NESTED_BUNDLE_DIR))
+                for i in range(20)]
+    read_lines = []
+
+    def iter_lines():
+        for line in requests:
+            read_lines.append(line)
+            yield line
+
+    class Output(io.StringIO):
+        def write(self, text):
+            # the number of lines read when each report is written
+            reads.append(len(read_lines))
+            return super().write(text)
+
+    reads = []
+    output = Output()
+    count, failed = run_batch(iter_lines(), output, workers=1, parse_cache_size=0)
+    reports = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    assert (count, failed) == (20, 0)
+    assert sorted(report['id'] for report in reports) == list(range(20))
+    # the reader holds at most one line while it waits for a free slot
+    for written, read in enumerate(reads):
+        assert read <= written + 1 + READ_AHEAD + 1
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+from benchmarks.generate import generate_bundle
+from benchmarks.suite import SUBSYSTEMS, get_yaml_backends, run_suite
+from operatorcourier import api
+
+
+@pytest.mark.parametrize('layout', ['flat', 'nested'])
+def test_generate_bundle_is_valid(tmp_path, layout):
+    source_dir = str(tmp_path / layout)
+    paths = generate_bundle(source_dir, layout, versions=3, crds=2,
+                            schema_properties=8, alm_examples=2)
+
+    # a flat bundle shares its crds, a nested bundle has them in each version
+    assert len(paths) == (1 + 3 + 2 if layout == 'flat' else 1 + 3 * (1 + 2))
+    verified_manifest = api.build_and_verify(source_dir=source_dir)
+    assert verified_manifest.nested == (layout == 'nested')
+    assert verified_manifest.validation_dict == {'errors': [], 'warnings': []}
+
+
+def test_generate_bundle_nests_into_nested_layout(tmp_path):
+    flat_dir = str(tmp_path / 'flat')
+    nested_dir = str(tmp_path / 'nested')
+    generate_bundle(flat_dir, 'flat', versions=2, crds=2)
+    generate_bundle(nested_dir, 'nested', versions=2, crds=2)
+
+    api.nest(flat_dir, str(tmp_path / 'output'))
+
+    assert sorted(os.listdir(str(tmp_path / 'output'))) == sorted(os.listdir(nested_dir))
+
+
+def test_generate_bundle_invalid_layout(tmp_path):
+    with pytest.raises(ValueError):
+        generate_bundle(str(tmp_path), 'deep')
+
+
+def test_run_suite(tmp_path):
+    results = run_suite(str(tmp_path), repeat=1, versions=2, crds=1,
+                        schema_properties=4, alm_examples=1)
+
+    assert [(result.backend, result.subsystem) for result in results] == \
+        [(backend, subsystem) for backend, _ in get_yaml_backends()
+         for subsystem in SUBSYSTEMS]
+    for result in results:
+        assert result.duration > 0
+        assert result.bundles_per_second > 0
+        assert result.peak_megabytes > 0
+    assert sorted(os.listdir(str(tmp_path))) == ['flat', 'nested']
+
+
+def test_run_suite_unavailable_backend(tmp_path):
+    with pytest.raises(ValueError):
+        run_suite(str(tmp_path), backends=['ruamel'], repeat=1)
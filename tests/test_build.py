@@ -1,3 +1,4 @@
+import yaml
 from operatorcourier.build import BuildCmd
 
 
@@ -19,3 +20,14 @@ def test_create_bundle():
     assert bool(bundle["data"]["packages"]) is True
     assert bool(bundle["data"]["clusterServiceVersions"]) is True
     assert bool(bundle["data"]["customResourceDefinitions"]) is True
+
+
+def test_create_bundle_with_parsed_package():
+    with open("tests/test_files/package.yaml") as f:
+        package = yaml.safe_load(f)
+
+    bundles = [BuildCmd().build_bundle([("package.yaml", package)]) for _ in range(2)]
+
+    # the parsed package object is shared by both bundles instead of re-parsed
+    assert bundles[0]["data"]["packages"][0] is package
+    assert bundles[1]["data"]["packages"][0] is package
@@ -0,0 +1,191 @@
+import json
+import threading
+
+import pytest
+from operatorcourier import api
+from operatorcourier.bulk import HostRateLimiter, PushEntry, PushJournal, \
+    load_push_entries, push_entries
+from operatorcourier.errors import OpCourierValueError
+from operatorcourier.push import PushCmd, create_session
+
+
+class _Response():
+    status_code = 200
+
+
+class _Session():
+    """Records the pushes posted through it"""
+
+    def __init__(self):
+        self.posted = []
+        self._lock = threading.Lock()
+
+    def post(self, uri, data, headers):
+        body = json.loads(b''.join(data).decode('utf-8'))
+        with self._lock:
+            self.posted.append((uri, body['release']))
+        return _Response()
+
+
+def test_load_push_entries():
+    entries = load_push_entries([{'source_dir': 'dir', 'namespace': 'ns',
+                                  'repository': 'repo', 'release': '1.10'}])
+    assert entries == [PushEntry('dir', 'ns', 'repo', '1.10')]
+
+
+@pytest.mark.parametrize('entries_data', [
+    {'source_dir': 'dir'},
+    [{'source_dir': 'dir', 'namespace': 'ns', 'repository': 'repo'}],
+    ['dir'],
+    # an unquoted YAML release 1.10 is loaded as the float 1.1
+    [{'source_dir': 'dir', 'namespace': 'ns', 'repository': 'repo', 'release': 1.1}],
+    [{'source_dir': 'dir', 'namespace': 'ns', 'repository': 1, 'release': '1.0'}],
+])
+def test_load_push_entries_invalid(entries_data):
+    with pytest.raises(OpCourierValueError):
+        load_push_entries(entries_data)
+
+
+def test_push_entries():
+    session = _Session()
+    entries = [
+        PushEntry('tests/test_files/bundles/api/valid_flat_bundle',
+                  'ns', 'marketplace', '1.0.0'),
+        PushEntry('tests/test_files/bundles/api/etcd_invalid_nested_bundle',
+                  'ns', 'etcd', '1.0.0'),
+        PushEntry('tests/test_files/bundles/api/etcd_valid_nested_bundle',
+                  'ns', 'etcd', '2.0.0'),
+    ]
+
+    reports = push_entries(entries, 'token', concurrency=3,
+                           push_cmd=PushCmd(session=session))
+
+    assert [report['release'] for report in reports] == \
+        ['1.0.0', '1.0.0', '2.0.0']
+    assert [report['status'] for report in reports] == \
+        ['success', 'error', 'success']
+    assert reports[1]['errors']
+    assert reports[0]['attempts'] == 1
+    assert 'attempts' not in reports[1]
+    assert sorted(session.posted) == [
+        ('https://quay.io/cnr/api/v1/packages/ns/etcd', '2.0.0'),
+        ('https://quay.io/cnr/api/v1/packages/ns/marketplace', '1.0.0'),
+    ]
+
+
+def test_api_push_many(monkeypatch):
+    session = _Session()
+    monkeypatch.setattr('operatorcourier.bulk.create_session',
+                        lambda pool_size: session)
+
+    reports = api.push_many([{
+        'source_dir': 'tests/test_files/bundles/api/valid_flat_bundle',
+        'namespace': 'ns', 'repository': 'marketplace', 'release': '1.0.0'}],
+        'token')
+
+    assert reports[0]['status'] == 'success'
+    assert session.posted == [
+        ('https://quay.io/cnr/api/v1/packages/ns/marketplace', '1.0.0')]
+
+
+class _Clock():
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+def test_host_rate_limiter(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr('operatorcourier.bulk.time', clock)
+    limiter = HostRateLimiter(20)
+    for _ in range(3):
+        limiter.wait('https://quay.io/cnr/api/v1/packages/ns/repo')
+    # another host is not slowed down by the first one
+    limiter.wait('https://example.com/cnr')
+
+    assert clock.sleeps == pytest.approx([0.05, 0.05])
+    assert clock.now == pytest.approx(100.1)
+
+
+def test_push_entries_keeps_rate_limiter_of_push_cmd():
+    session = _Session()
+    push_cmd = PushCmd(session=session)
+    push_entries([PushEntry('tests/test_files/bundles/api/valid_flat_bundle',
+                            'ns', 'marketplace', '1.0.0')],
+                 'token', rate_limit=10, push_cmd=push_cmd)
+
+    assert push_cmd.rate_limiter is None
+    assert session.posted == [
+        ('https://quay.io/cnr/api/v1/packages/ns/marketplace', '1.0.0')]
+
+
+def test_create_session():
+    session = create_session(8)
+    assert session.get_adapter('https://quay.io')._pool_maxsize == 8
+
+
+def test_push_entries_skip_unchanged():
+    bundle_dir = 'tests/test_files/bundles/api/etcd_valid_nested_bundle'
+    digest = PushCmd().get_digest(bundle_dir, 'etcd')
+
+    class _LookupResponse():
+        status_code = 200
+
+        def json(self):
+            return {'content': {'digest': digest}}
+
+    session = _Session()
+    session.get = lambda uri, headers: _LookupResponse()
+
+    reports = push_entries([PushEntry(bundle_dir, 'ns', 'etcd', '1.0.0')], 'token',
+                           skip_unchanged=True,
+                           push_cmd=PushCmd(session=session, skip_unchanged=True))
+
+    assert reports[0]['status'] == 'unchanged'
+    assert reports[0]['digest'] == digest
+    assert reports[0]['attempts'] == 0
+    assert session.posted == []
+
+
+def test_push_entries_journal_resume(tmpdir):
+    journal = str(tmpdir.join('journal.jsonl'))
+    entries = [
+        PushEntry('tests/test_files/bundles/api/etcd_valid_nested_bundle',
+                  'ns', 'etcd', '%d.0.0' % index)
+        for index in range(3)
+    ]
+
+    session = _Session()
+    reports = push_entries(entries[:2], 'token', journal=journal,
+                           push_cmd=PushCmd(session=session))
+    assert [report['status'] for report in reports] == ['success', 'success']
+
+    # a push killed while writing leaves a truncated line behind
+    with open(journal, 'a') as journal_file:
+        journal_file.write('{"namespace": "ns", "repos')
+
+    session = _Session()
+    reports = push_entries(entries, 'token', journal=journal, resume=True,
+                           push_cmd=PushCmd(session=session))
+
+    assert [report['status'] for report in reports] == \
+        ['skipped', 'skipped', 'success']
+    assert reports[0]['digest'] == reports[2]['digest']
+    assert session.posted == [
+        ('https://quay.io/cnr/api/v1/packages/ns/etcd', '2.0.0')]
+
+    done_digests = PushJournal(journal).load()
+    assert sorted(done_digests) == [('ns', 'etcd', '0.0.0'), ('ns', 'etcd', '1.0.0'),
+                                    ('ns', 'etcd', '2.0.0')]
+
+
+def test_push_many_resume_requires_journal():
+    with pytest.raises(TypeError):
+        api.push_many([], 'token', resume=True)
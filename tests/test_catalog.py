@@ -0,0 +1,38 @@
+import os
+from distutils.dir_util import copy_tree
+from tempfile import TemporaryDirectory
+from operatorcourier import api
+
+
+def _make_catalog(catalog_dir):
+    copy_tree('tests/test_files/bundles/flatten/etcd_valid_input_4',
+              os.path.join(catalog_dir, 'etcd'))
+    copy_tree('tests/test_files/bundles/nest/flat_bundle2_without_crds',
+              os.path.join(catalog_dir, 'svcat'))
+    copy_tree('tests/test_files/yaml_source_dir/invalid_yamls_without_package',
+              os.path.join(catalog_dir, 'invalid'))
+
+
+def test_nest_catalog():
+    with TemporaryDirectory() as catalog_dir, TemporaryDirectory() as output_root:
+        _make_catalog(catalog_dir)
+        reports = api.nest_catalog(catalog_dir, output_root, workers=2)
+
+        assert [(report['package'], report['status']) for report in reports] == [
+            ('etcd', 'success'), ('invalid', 'error'), ('svcat', 'success')]
+        assert reports[1]['errors'] == ['Bundle does not contain any packages.']
+        assert sorted(os.listdir(os.path.join(output_root, 'svcat'))) == \
+            ['0.1.34', 'svcat.package.yaml']
+        assert sorted(os.listdir(os.path.join(output_root, 'etcd'))) == \
+            ['0.6.1', '0.9.0', '0.9.2', 'etcd.package.yaml']
+
+
+def test_flatten_catalog_dry_run():
+    with TemporaryDirectory() as catalog_dir, TemporaryDirectory() as dest_root:
+        _make_catalog(catalog_dir)
+        reports = api.flatten_catalog(catalog_dir, dest_root, dry_run=True)
+
+        assert [(report['package'], report['status']) for report in reports] == [
+            ('etcd', 'success'), ('invalid', 'error'), ('svcat', 'success')]
+        assert len(reports[0]['result']) == 7
+        assert os.listdir(dest_root) == []
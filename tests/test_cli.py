@@ -0,0 +1,62 @@
+import subprocess
+import sys
+
+import pytest
+
+from operatorcourier import cli
+
+
+def _get_imported_modules(code):
+    result = subprocess.run(
+        [sys.executable, '-c', code + '\nimport sys\nprint(" ".join(sys.modules))'],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return set(result.stdout.split())
+
+
+@pytest.mark.parametrize('code', [
+    'import operatorcourier.cli',
+    'import operatorcourier.api',
+])
+def test_import_defers_slow_modules(code):
+    modules = _get_imported_modules(code)
+    for module in ['requests', 'pkg_resources', 'validators', 'semver', 'tarfile',
+                   'cProfile']:
+        assert module not in modules
+
+
+def test_version(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['operator-courier', '--version'])
+    with pytest.raises(SystemExit) as exc_info:
+        cli._CliParser().parse()
+    assert exc_info.value.code == 0
+    assert capsys.readouterr().out.strip() == cli._get_version()
+    assert cli._get_version() != 'unknown'
+
+
+def test_forward_to_server(tmp_path, capsys, monkeypatch):
+    from operatorcourier.server import CourierServer
+
+    socket_path = str(tmp_path / 'courier.sock')
+    monkeypatch.setenv('OPERATOR_COURIER_SOCKET', socket_path)
+    bundle_dir = 'tests/test_files/bundles/api/valid_flat_bundle'
+    argv = ['operator-courier', 'nest', bundle_dir, str(tmp_path / 'nested'), '--sync']
+
+    with CourierServer(socket_path) as server:
+        for _ in range(2):
+            monkeypatch.setattr(sys, 'argv', argv)
+            cli._CliParser().parse()
+        monkeypatch.setattr(sys, 'argv', [
+            'operator-courier', 'verify',
+            'tests/test_files/bundles/api/etcd_invalid_nested_bundle'])
+        with pytest.raises(SystemExit) as exc_info:
+            cli._CliParser().parse()
+
+    assert server.requests == 3
+    out, err = capsys.readouterr()
+    assert out.splitlines() == [
+        'added: 3, changed: 0, removed: 0, unchanged: 0',
+        'added: 0, changed: 0, removed: 0, unchanged: 3',
+    ]
+    assert 'ERROR: csv spec.installModes not defined' in err.splitlines()
+    assert exc_info.value.code == ('Resulting bundle is invalid, '
+                                   'input yaml is improperly defined.')
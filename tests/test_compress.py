@@ -0,0 +1,47 @@
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+from operatorcourier.compress import gzip_fileobj, GZIP_BLOCK_SIZE
+from operatorcourier.push import PushCmd
+
+
+@pytest.mark.parametrize('compresslevel', [0, 1, 6, 9])
+@pytest.mark.parametrize('threads', [1, 4])
+def test_gzip_fileobj(compresslevel, threads):
+    # compressible data, spread over several blocks with a partial last block
+    data = os.urandom(1024) * (3 * GZIP_BLOCK_SIZE // 1024) + b'tail'
+    compressed = io.BytesIO()
+
+    size = gzip_fileobj(io.BytesIO(data), compressed, compresslevel, threads)
+
+    assert size == len(data)
+    assert gzip.decompress(compressed.getvalue()) == data
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_gzip_fileobj_empty(threads):
+    compressed = io.BytesIO()
+    assert gzip_fileobj(io.BytesIO(), compressed, threads=threads) == 0
+    assert gzip.decompress(compressed.getvalue()) == b''
+
+
+def test_gzip_fileobj_mtime():
+    compressed = io.BytesIO()
+    gzip_fileobj(io.BytesIO(b'data'), compressed, mtime=0)
+    assert compressed.getvalue()[4:8] == b'\x00\x00\x00\x00'
+
+
+@pytest.mark.parametrize('compresslevel,threads', [(1, 1), (9, 2)])
+def test_create_tarball(compresslevel, threads):
+    bundle_dir = "tests/test_files/bundles/api/etcd_valid_nested_bundle"
+    tarball = io.BytesIO()
+
+    PushCmd(compresslevel, threads)._create_tarball(bundle_dir, tarball)
+
+    assert tarball.tell() == 0
+    with tarfile.open(fileobj=tarball, mode='r:gz') as tar:
+        names = tar.getnames()
+    assert 'etcd_valid_nested_bundle/etcd.package.yaml' in names
@@ -68,3 +68,13 @@ def test_create_quay_error_response():
     assert str(e) == 'oh no'
     assert e.code == 500
     assert e.error_response == {'error': 'uh oh'}
+
+
+def test_lazy_communication_error():
+    from operatorcourier import errors
+
+    assert issubclass(errors.OpCourierQuayCommunicationError, RequestException)
+    assert errors.OpCourierQuayCommunicationError is \
+        errors.OpCourierQuayCommunicationError
+    with pytest.raises(AttributeError):
+        errors.OpCourierMissingError
@@ -0,0 +1,107 @@
+import os
+import pytest
+from tempfile import TemporaryDirectory
+from operatorcourier.errors import OpCourierValueError
+from operatorcourier.fileops import place_file, sync_output_files, \
+    OutputFile, LINK_MODES
+
+
+@pytest.mark.parametrize('link_mode', LINK_MODES)
+def test_place_file(link_mode):
+    with TemporaryDirectory() as temp_dir:
+        src_file_path = os.path.join(temp_dir, 'src.yaml')
+        dest_file_path = os.path.join(temp_dir, 'dest.yaml')
+        with open(src_file_path, 'w') as f:
+            f.write('packageName: etcd\n')
+
+        # placing twice replaces the file left behind by the first run
+        place_file(src_file_path, dest_file_path, link_mode)
+        place_file(src_file_path, dest_file_path, link_mode)
+
+        with open(dest_file_path) as f:
+            assert f.read() == 'packageName: etcd\n'
+
+        if link_mode == 'hardlink':
+            assert os.path.samefile(src_file_path, dest_file_path)
+        elif link_mode == 'symlink':
+            assert os.path.islink(dest_file_path)
+        else:
+            assert not os.path.samefile(src_file_path, dest_file_path)
+
+
+def test_place_file_does_not_write_through_links():
+    with TemporaryDirectory() as temp_dir:
+        src_file_path = os.path.join(temp_dir, 'src.yaml')
+        dest_file_path = os.path.join(temp_dir, 'dest.yaml')
+        with open(src_file_path, 'w') as f:
+            f.write('packageName: etcd\n')
+
+        place_file(src_file_path, dest_file_path, 'symlink')
+        place_file(src_file_path, dest_file_path, 'copy')
+
+        assert not os.path.islink(dest_file_path)
+        with open(src_file_path) as f:
+            assert f.read() == 'packageName: etcd\n'
+
+
+@pytest.mark.parametrize('link_mode', LINK_MODES)
+def test_place_file_onto_itself(link_mode):
+    with TemporaryDirectory() as temp_dir:
+        src_file_path = os.path.join(temp_dir, 'src.yaml')
+        with open(src_file_path, 'w') as f:
+            f.write('packageName: etcd\n')
+
+        place_file(src_file_path, os.path.join(temp_dir, '.', 'src.yaml'), link_mode)
+
+        assert not os.path.islink(src_file_path)
+        with open(src_file_path) as f:
+            assert f.read() == 'packageName: etcd\n'
+
+
+def test_place_file_with_invalid_link_mode():
+    with pytest.raises(OpCourierValueError):
+        place_file('src.yaml', 'dest.yaml', 'move')
+
+
+def test_sync_output_files():
+    with TemporaryDirectory() as temp_dir:
+        src_file_path = os.path.join(temp_dir, 'src.yaml')
+        dest_dir = os.path.join(temp_dir, 'dest')
+        with open(src_file_path, 'w') as f:
+            f.write('packageName: etcd\n')
+
+        output_files = [
+            OutputFile('etcd.package.yaml', src_file_path=src_file_path),
+            OutputFile(os.path.join('0.9.0', 'csv.yaml'), content=b'kind: csv\n'),
+        ]
+        summary = sync_output_files(output_files, dest_dir)
+        assert summary == {
+            'added': [os.path.join('0.9.0', 'csv.yaml'), 'etcd.package.yaml'],
+            'changed': [], 'removed': [], 'unchanged': [],
+        }
+        package_inode = os.stat(os.path.join(dest_dir, 'etcd.package.yaml')).st_ino
+
+        # a stale file is only removed when delete is set
+        os.makedirs(os.path.join(dest_dir, '0.6.1'))
+        open(os.path.join(dest_dir, '0.6.1', 'stale.yaml'), 'w').close()
+        output_files[1] = OutputFile(os.path.join('0.9.0', 'csv.yaml'),
+                                     content=b'kind: CSV\n')
+        summary = sync_output_files(output_files, dest_dir)
+        assert summary == {
+            'added': [], 'changed': [os.path.join('0.9.0', 'csv.yaml')],
+            'removed': [], 'unchanged': ['etcd.package.yaml'],
+        }
+        assert os.path.exists(os.path.join(dest_dir, '0.6.1', 'stale.yaml'))
+
+        summary = sync_output_files(output_files, dest_dir, delete=True)
+        assert summary == {
+            'added': [], 'changed': [],
+            'removed': [os.path.join('0.6.1', 'stale.yaml')],
+            'unchanged': [os.path.join('0.9.0', 'csv.yaml'), 'etcd.package.yaml'],
+        }
+        assert sorted(os.listdir(dest_dir)) == ['0.9.0', 'etcd.package.yaml']
+        with open(os.path.join(dest_dir, '0.9.0', 'csv.yaml')) as f:
+            assert f.read() == 'kind: CSV\n'
+        # unchanged files are never rewritten
+        assert package_inode == \
+            os.stat(os.path.join(dest_dir, 'etcd.package.yaml')).st_ino
@@ -1,5 +1,9 @@
+import os
 import pytest
 import operatorcourier.flatten as flatten
+from tempfile import TemporaryDirectory
+from distutils.dir_util import copy_tree
+from operatorcourier.fileops import LINK_MODES
 
 
 @pytest.mark.parametrize('input_dir,expected_flattened_file_paths', [
@@ -141,3 +145,79 @@ import operatorcourier.flatten as flatten
 def test_flatten_with_valid_bundle(input_dir, expected_flattened_file_paths):
     actual_flattened_file_paths = flatten.get_flattened_files_info(input_dir)
     assert set(expected_flattened_file_paths) == set(actual_flattened_file_paths)
+
+
+@pytest.mark.parametrize('link_mode', ['hardlink', 'symlink'])
+def test_flatten_with_link_mode(link_mode):
+    input_dir = 'tests/test_files/bundles/flatten/etcd_valid_input_4'
+    with TemporaryDirectory() as dest_dir:
+        flatten.flatten_bundles(input_dir, dest_dir, link_mode)
+
+        for src_file_path, new_file_name in flatten.get_flattened_files_info(input_dir):
+            assert os.path.samefile(src_file_path, os.path.join(dest_dir, new_file_name))
+
+
+@pytest.mark.parametrize('link_mode', LINK_MODES)
+def test_flatten_into_source_dir(link_mode):
+    input_dir = 'tests/test_files/bundles/api/etcd_valid_nested_bundle'
+    with TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'etcd')
+        copy_tree(input_dir, source_dir)
+
+        flatten.flatten_bundles(source_dir, source_dir, link_mode)
+
+        # the files of the bundle are kept, and the flat files added next to them
+        for root, _, file_names in os.walk(input_dir):
+            for file_name in file_names:
+                relative_path = os.path.relpath(os.path.join(root, file_name),
+                                                input_dir)
+                assert os.path.isfile(os.path.join(source_dir, relative_path))
+        assert 'etcdcluster.crd.yaml' in os.listdir(source_dir)
+
+
+def test_get_manifest_folder_info():
+    folder_path = 'tests/test_files/bundles/flatten/etcd_valid_input_3/0.90'
+    folder_info = flatten.get_manifest_folder_info(folder_path)
+
+    assert folder_info.semver == '0.9.0'
+    assert folder_info.csv_paths == [
+        os.path.join(folder_path, 'etcdoperator.v0.9.0.clusterserviceversion.yaml')]
+    assert folder_info.crd_paths == {
+        name: os.path.join(folder_path, file_name) for name, file_name in [
+            ('etcdbackups.etcd.database.coreos.com', 'etcdbackup.crd.yaml'),
+            ('etcdclusters.etcd.database.coreos.com', 'etcdcluster.crd.yaml'),
+            ('etcdrestores.etcd.database.coreos.com', 'etcdrestore.crd.yaml'),
+        ]}
+    assert flatten.get_manifest_folder_info(
+        'tests/test_files/bundles/flatten/etcd_valid_input_3/random_folder') is None
+
+
+def test_flatten_parses_version_folder_files_once(monkeypatch):
+    input_dir = 'tests/test_files/bundles/flatten/etcd_valid_input_4'
+    load_operator_artifact = flatten.identify.load_operator_artifact
+    parsed_contents = []
+
+    def counting_load_operator_artifact(file_content):
+        parsed_contents.append(file_content)
+        return load_operator_artifact(file_content)
+
+    monkeypatch.setattr(flatten.identify, 'load_operator_artifact',
+                        counting_load_operator_artifact)
+    flatten.get_flattened_files_info(input_dir)
+
+    # the package in the root folder, and 3 version folders with 4 files each
+    assert len(parsed_contents) == 1 + 3 * 4
+
+
+def test_flatten_dry_run():
+    input_dir = 'tests/test_files/bundles/flatten/etcd_valid_input_4'
+    with TemporaryDirectory() as temp_dir:
+        dest_dir = os.path.join(temp_dir, 'dest')
+        operations = flatten.flatten_bundles(input_dir, dest_dir, dry_run=True)
+        assert not os.path.exists(dest_dir)
+
+        assert {(operation['source'], operation['path']) for operation in operations} \
+            == set(flatten.get_flattened_files_info(input_dir))
+        for operation in operations:
+            assert operation['operation'] == 'copy'
+            assert operation['bytes'] == os.path.getsize(operation['source'])
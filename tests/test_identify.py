@@ -42,3 +42,40 @@ def test_get_operator_artifact_type_with_invalid_yaml(fname):
                 'ERROR',
                 'Courier requires valid input YAML files'),)
     assert 'Courier requires valid input YAML files' == str(e.value)
+
+
+@pytest.mark.parametrize('fname,expected', [
+    ("tests/test_files/csv.yaml", "ClusterServiceVersion"),
+    ("tests/test_files/crd.yaml", "CustomResourceDefinition"),
+    ("tests/test_files/package.yaml", "Package"),
+])
+def test_load_operator_artifact(fname, expected):
+    with open(fname) as f:
+        yaml = f.read()
+
+    artifact_type, artifact = identify.load_operator_artifact(yaml)
+    assert artifact_type == expected
+    assert identify.get_parsed_artifact_type(artifact) == expected
+
+
+def test_parse_cache():
+    with open("tests/test_files/csv.yaml") as f:
+        yaml = f.read()
+
+    parse_cache = identify.ParseCache(max_entries=1)
+    previous_cache = identify.set_parse_cache(parse_cache)
+    try:
+        artifact_type, parsed = identify.load_operator_artifact(yaml)
+        parsed['kind'] = 'Modified'
+        cached_type, cached = identify.load_operator_artifact(yaml)
+        identify.load_operator_artifact('packageName: etcd')
+        identify.load_operator_artifact(yaml)
+    finally:
+        identify.set_parse_cache(previous_cache)
+
+    assert artifact_type == cached_type == "ClusterServiceVersion"
+    # cached objects are copies, which callers can modify
+    assert cached['kind'] == "ClusterServiceVersion"
+    assert cached is not parsed
+    # the package evicted the csv
+    assert parse_cache.get_stats() == dict(entries=1, hits=1, misses=3)
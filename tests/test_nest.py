@@ -1,7 +1,8 @@
 import pytest
 import os
 from tempfile import TemporaryDirectory
-from operatorcourier.nest import nest_bundles
+from operatorcourier import nest
+from operatorcourier.nest import nest_bundles, nest_flat_bundles
 
 
 @pytest.mark.parametrize('folder_to_nest,expected_output_dir', [
@@ -20,6 +21,172 @@ def test_nest(folder_to_nest, expected_output_dir):
         assert _get_dir_file_paths(output_dir) == _get_dir_file_paths(expected_output_dir)
 
 
+@pytest.mark.parametrize('folder_to_nest,expected_output_dir', [
+    ("tests/test_files/bundles/nest/flat_bundle2_without_crds",
+     "tests/test_files/bundles/nest/flat_bundle2_without_crds_result"),
+    ("tests/test_files/bundles/nest/nested_bundle1",
+     "tests/test_files/bundles/nest/nested_bundle1_result"),
+])
+def test_nest_publishes_staging_dir(folder_to_nest, expected_output_dir):
+    with TemporaryDirectory() as temp_dir:
+        # output directory does not exist yet
+        output_dir = os.path.join(temp_dir, 'new')
+        nest_bundles(folder_to_nest, output_dir)
+        assert _get_dir_file_paths(output_dir) == \
+            _get_dir_file_paths(expected_output_dir)
+
+        # output directory already has content, which is kept
+        output_dir = os.path.join(temp_dir, 'existing')
+        os.makedirs(output_dir)
+        open(os.path.join(output_dir, 'existing.txt'), 'w').close()
+        nest_bundles(folder_to_nest, output_dir)
+        assert _get_dir_file_paths(output_dir) == \
+            _get_dir_file_paths(expected_output_dir) | {'./existing.txt'}
+
+        # no staging directories are left behind
+        assert sorted(os.listdir(temp_dir)) == ['existing', 'new']
+
+
+def test_nest_with_errors_leaves_no_output():
+    with TemporaryDirectory() as temp_dir:
+        output_dir = os.path.join(temp_dir, 'output')
+        with open('tests/test_files/csv.yaml') as f:
+            csv = f.read()
+
+        # no package file is given, so nothing may be published
+        nest_flat_bundles([csv], output_dir)
+        assert os.listdir(temp_dir) == []
+
+
+def test_nest_flat_bundles_ignores_temp_registry_dir():
+    folder_to_nest = 'tests/test_files/bundles/nest/flat_bundle1'
+    with TemporaryDirectory() as temp_dir:
+        output_dir = os.path.join(temp_dir, 'output')
+        os.makedirs(output_dir)
+        manifest_files_content = []
+        for file_name in sorted(os.listdir(folder_to_nest)):
+            if not file_name.endswith('.yaml'):
+                continue
+            with open(os.path.join(folder_to_nest, file_name)) as f:
+                manifest_files_content.append(f.read())
+
+        # the former third positional parameter is still accepted
+        with pytest.warns(DeprecationWarning):
+            nest_flat_bundles(manifest_files_content, output_dir, temp_dir)
+        assert os.listdir(output_dir)
+        assert sorted(os.listdir(temp_dir)) == ['output']
+
+        with pytest.raises(TypeError):
+            nest_flat_bundles(manifest_files_content, output_dir, None, 1)
+
+
+@pytest.mark.parametrize('folder_to_nest', [
+    "tests/test_files/bundles/nest/flat_bundle2_without_crds",
+    "tests/test_files/bundles/nest/nested_bundle1",
+])
+def test_nest_sync(folder_to_nest):
+    with TemporaryDirectory() as output_dir:
+        summary = nest_bundles(folder_to_nest, output_dir, sync=True)
+        file_paths = sorted(os.path.normpath(path)
+                            for path in _get_dir_file_paths(output_dir))
+        assert summary == {'added': file_paths, 'changed': [],
+                           'removed': [], 'unchanged': []}
+
+        summary = nest_bundles(folder_to_nest, output_dir, sync=True)
+        assert summary == {'added': [], 'changed': [],
+                           'removed': [], 'unchanged': file_paths}
+
+
+def test_nest_dry_run():
+    folder_to_nest = "tests/test_files/bundles/nest/flat_bundle2_without_crds"
+    with TemporaryDirectory() as temp_dir:
+        output_dir = os.path.join(temp_dir, 'output')
+        operations = nest_bundles(folder_to_nest, output_dir, dry_run=True)
+        assert os.listdir(temp_dir) == []
+
+        nest_bundles(folder_to_nest, output_dir)
+        csv_path = os.path.join('0.1.34', 'svcat.v0.1.34.clusterserviceversion.yaml')
+        assert [(operation['operation'], operation['path']) for operation in operations] \
+            == [('write', 'svcat.package.yaml'), ('write', csv_path)]
+        for operation in operations:
+            assert operation['bytes'] == \
+                os.path.getsize(os.path.join(output_dir, operation['path']))
+
+        # in sync mode, a dry run compares with the files already written
+        operations = nest_bundles(folder_to_nest, output_dir, sync=True, dry_run=True)
+        assert [operation['operation'] for operation in operations] == ['skip', 'skip']
+
+
+def test_nest_passthrough():
+    folder_to_nest = "tests/test_files/bundles/nest/flat_bundle2_without_crds"
+    with TemporaryDirectory() as output_dir:
+        nest_bundles(folder_to_nest, output_dir, passthrough=True)
+
+        for source_file, output_file in [
+            ('svcat.package.yaml', 'svcat.package.yaml'),
+            ('svcat.v0.1.34.clusterserviceversion.yaml',
+             os.path.join('0.1.34', 'svcat.v0.1.34.clusterserviceversion.yaml')),
+        ]:
+            with open(os.path.join(folder_to_nest, source_file), 'rb') as f:
+                source_content = f.read()
+            with open(os.path.join(output_dir, output_file), 'rb') as f:
+                assert f.read() == source_content
+
+
+def test_nest_is_reproducible():
+    folder_to_nest = "tests/test_files/bundles/nest/flat_bundle2_without_crds"
+    with TemporaryDirectory() as output_dir:
+        nest_bundles(folder_to_nest, output_dir)
+        summary = nest_bundles(folder_to_nest, output_dir, sync=True)
+        assert summary['added'] == summary['changed'] == []
+
+
+def test_nest_dumps_each_crd_once(monkeypatch):
+    dump_yaml = nest._dump_yaml
+    dumped_crd_names = []
+
+    def recording_dump_yaml(yaml_data):
+        if yaml_data.get('kind') == 'CustomResourceDefinition':
+            dumped_crd_names.append(yaml_data['metadata']['name'])
+        return dump_yaml(yaml_data)
+
+    monkeypatch.setattr(nest, '_dump_yaml', recording_dump_yaml)
+    with TemporaryDirectory() as output_dir:
+        nest_bundles("tests/test_files/bundles/nest/flat_bundle1", output_dir,
+                     workers=1)
+        crd_file_paths = [path for path in _get_dir_file_paths(output_dir)
+                          if path.endswith('.crd.yaml')]
+
+    # CRDs are written into several version folders, but only dumped once
+    assert len(crd_file_paths) > len(dumped_crd_names)
+    assert sorted(dumped_crd_names) == sorted(set(dumped_crd_names))
+
+
+def test_nest_dumps_csvs_in_worker_processes(monkeypatch):
+    folder_to_nest = "tests/test_files/bundles/nest/flat_bundle1"
+    executors = []
+
+    class RecordingExecutor(nest.ProcessPoolExecutor):
+        def __init__(self, max_workers=None):
+            super().__init__(max_workers)
+            executors.append(max_workers)
+
+    monkeypatch.setattr(nest, 'ProcessPoolExecutor', RecordingExecutor)
+    monkeypatch.setattr(nest, 'PARALLEL_DUMP_MIN_CSVS', 1)
+    with TemporaryDirectory() as serial_dir, TemporaryDirectory() as parallel_dir:
+        nest_bundles(folder_to_nest, serial_dir, workers=1)
+        assert executors == []
+        nest_bundles(folder_to_nest, parallel_dir, workers=2)
+        assert executors == [2]
+
+        file_paths = _get_dir_file_paths(serial_dir)
+        assert file_paths == _get_dir_file_paths(parallel_dir)
+        for file_path in file_paths:
+            with open(os.path.join(serial_dir, file_path), 'rb') as serial_file, \
+                    open(os.path.join(parallel_dir, file_path), 'rb') as parallel_file:
+                assert serial_file.read() == parallel_file.read()
+
+
 def _get_dir_file_paths(source_dir):
     """
     :param source_dir: the path of the input directory
@@ -0,0 +1,77 @@
+import io
+import os
+import pstats
+import sys
+
+import pytest
+from operatorcourier import cli, identify
+from operatorcourier.build import BuildCmd
+from operatorcourier.profiling import profile_call, get_phase_breakdown, \
+    _get_call_cycles
+
+BUNDLE_DIR = 'tests/test_files/bundles/api/valid_flat_bundle'
+
+
+def _identify_and_build(file_names):
+    bundle_data = []
+    for file_name in file_names:
+        with open(file_name) as f:
+            yaml_string = f.read()
+        identify.load_operator_artifact(yaml_string)
+        bundle_data.append((file_name, yaml_string))
+    return BuildCmd().build_bundle(bundle_data)
+
+
+def test_profile_call(tmp_path):
+    profile_path = str(tmp_path / 'profile.pstats')
+    output = io.StringIO()
+    file_names = ['tests/test_files/csv.yaml', 'tests/test_files/crd.yaml']
+
+    bundle = profile_call(profile_path, output, _identify_and_build, file_names)
+
+    assert len(bundle['data']['clusterServiceVersions']) == 1
+    stats = pstats.Stats(profile_path)
+    breakdown = {phase_time.phase: phase_time
+                 for phase_time in get_phase_breakdown(stats)}
+    assert breakdown['identify'].calls == 4
+    assert breakdown['build'].calls == 1
+    assert breakdown['yaml load'].calls == 4
+    assert breakdown['validate'].calls == 0
+    # yaml is loaded by identify and by build, but only attributed to yaml load
+    assert breakdown['yaml load'].duration == \
+        pytest.approx(breakdown['yaml load'].cumulative_duration)
+    assert breakdown['build'].duration < breakdown['build'].cumulative_duration
+    assert sum(phase_time.duration for phase_time in breakdown.values()) <= \
+        stats.total_tt * 1.001
+
+    lines = output.getvalue().splitlines()
+    assert lines[0] == 'Wrote profile to %s' % profile_path
+    assert [line.split()[0] for line in lines[2:]] == \
+        ['directory', 'identify', 'yaml', 'build', 'validate', 'format', 'write',
+         'other', 'total']
+
+
+def test_get_call_cycles():
+    # a calls b, b and c call each other, and c calls d
+    callers = {'a': {}, 'b': {'a': None, 'c': None}, 'c': {'b': None},
+               'd': {'c': None}}
+
+    assert _get_call_cycles(callers) == [{'d'}, {'b', 'c'}, {'a'}]
+
+
+@pytest.mark.parametrize('profile_arg,profile_file', [
+    ('--profile', 'operator-courier.pstats'),
+    ('--profile=nest.pstats', 'nest.pstats'),
+    ('--profile nest.pstats', 'nest.pstats'),
+])
+def test_cli_profile(profile_arg, profile_file, tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['operator-courier', *profile_arg.split(), 'nest',
+                                      os.path.abspath(BUNDLE_DIR), 'nested'])
+    monkeypatch.chdir(tmp_path)
+    cli._CliParser().parse()
+
+    assert (tmp_path / 'nested' / 'marketplace.package.yaml').is_file()
+    assert pstats.Stats(str(tmp_path / profile_file)).total_tt > 0
+    err = capsys.readouterr().err
+    assert 'Wrote profile to %s' % profile_file in err
+    assert 'directory scan' in err
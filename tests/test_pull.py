@@ -0,0 +1,102 @@
+import base64
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from operatorcourier import api
+from operatorcourier.errors import OpCourierQuayErrorResponse, OpCourierValueError
+from operatorcourier.format import unformat_bundle
+from operatorcourier.pull import PullCmd, _iter_json_blob
+from operatorcourier.push import PushCmd
+from operatorcourier.registry_server import RegistryServer
+
+
+@pytest.mark.parametrize('source_dir,repository', [
+    ('tests/test_files/bundles/api/valid_flat_bundle', 'marketplace'),
+    ('tests/test_files/bundles/api/etcd_valid_nested_bundle', 'etcd'),
+])
+def test_pull(tmpdir, source_dir, repository):
+    cache_dir = str(tmpdir)
+    with RegistryServer() as server:
+        push_result = api.build_verify_and_push(
+            'ns', repository, '1.0.0', 'token', source_dir=source_dir,
+            push_cmd=PushCmd(registry_url=server.url))
+
+        pull_cmd = PullCmd(registry_url=server.url, cache_dir=cache_dir)
+        pulled = pull_cmd.pull('ns', repository, '1.0.0')
+        repulled = pull_cmd.pull('ns', repository, '1.0.0')
+        # the cache on disk is shared between processes
+        bundle = api.pull('ns', repository, '1.0.0', registry_url=server.url,
+                          cache_dir=cache_dir)
+        # the printed bundle does not depend on the hash seed of the process
+        outputs = set()
+        for hash_seed in ('1', '2'):
+            outputs.add(subprocess.check_output(
+                [sys.executable, '-c', 'from operatorcourier.cli import main; main()',
+                 'pull', 'ns', repository, '1.0.0', '--registry-url', server.url,
+                 '--cache-dir', cache_dir],
+                env=dict(os.environ, PYTHONHASHSEED=hash_seed)))
+        requests = dict(server.requests)
+
+    assert pulled.digest == repulled.digest == push_result.digest
+    assert (pulled.cached, repulled.cached) == (False, True)
+    assert repulled.bundle is pulled.bundle
+    assert bundle == pulled.bundle
+    assert requests == {'POST': 1, 'GET': 5}
+    assert os.path.exists(os.path.join(cache_dir, 'blobs', 'sha256',
+                                       pulled.digest + '.tar.gz'))
+
+    if repository == 'marketplace':
+        verified_manifest = api.build_and_verify(source_dir=source_dir)
+        assert pulled.bundle == unformat_bundle(verified_manifest.bundle)
+    else:
+        # a nested release is rebuilt into a single package with unique CRDs
+        data = pulled.bundle['data']
+        assert len(data['packages']) == 1
+        assert len(data['clusterServiceVersions']) == 3
+        assert sorted(crd['metadata']['name']
+                      for crd in data['customResourceDefinitions']) == [
+            'etcdbackups.etcd.database.coreos.com',
+            'etcdclusters.etcd.database.coreos.com',
+            'etcdrestores.etcd.database.coreos.com']
+
+    assert len(outputs) == 1
+
+
+def test_pull_missing_release(tmpdir):
+    with RegistryServer() as server:
+        with pytest.raises(OpCourierQuayErrorResponse) as error:
+            PullCmd(registry_url=server.url, cache_dir=str(tmpdir)).pull(
+                'ns', 'repo', '1.0.0')
+
+    assert error.value.code == 404
+
+
+@pytest.mark.parametrize('namespace,repository,release', [
+    ('ns', 'etcd', '../../../escaped'),
+    ('ns', '../etcd', '1.0.0'),
+    ('..', 'etcd', '1.0.0'),
+    ('ns', 'etcd', ''),
+])
+def test_pull_rejects_path_traversal(tmpdir, namespace, repository, release):
+    pull_cmd = PullCmd(registry_url='http://localhost:1',
+                       cache_dir=str(tmpdir.join('cache')))
+    with pytest.raises(OpCourierValueError):
+        pull_cmd.pull(namespace, repository, release)
+
+    assert tmpdir.listdir() == []
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1024])
+def test_iter_json_blob(chunk_size):
+    blob = os.urandom(1000)
+    body = json.dumps({'package': 'ns/repo',
+                       'blob': base64.b64encode(blob).decode('utf-8'),
+                       'release': '1.0.0'})
+    # JSON encoders may escape the slashes of the base64 alphabet
+    body = body.replace('/', '\\/').encode('utf-8')
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+    assert b''.join(_iter_json_blob(chunks)) == blob
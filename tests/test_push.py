@@ -1,17 +1,21 @@
 import base64
+import hashlib
+import io
+import json
 import tarfile
 
 import pytest
 import os
 from tempfile import TemporaryDirectory
 from distutils.dir_util import copy_tree
-from operatorcourier.push import PushCmd
+from operatorcourier import errors, push
+from operatorcourier.push import PushCmd, BASE64_CHUNK_SIZE
 
 
 @pytest.mark.parametrize('bundle_dir', [
     "tests/test_files/bundles/api/etcd_valid_nested_bundle"
 ])
-def test_create_base64_bundle(bundle_dir):
+def test_push_body_archives_bundle_dir(bundle_dir):
     with TemporaryDirectory() as scratch:
         directory_name = "directory-abcd"
         # make a subdirectory with a known name so that the bundle is always the same
@@ -19,7 +23,11 @@ def test_create_base64_bundle(bundle_dir):
         os.mkdir(inpath)
 
         copy_tree(bundle_dir, inpath)
-        out = PushCmd()._create_base64_bundle(inpath, "repo")
+        push_cmd = PushCmd()
+        tarball = io.BytesIO()
+        push_cmd._create_tarball(inpath, tarball)
+        body = b''.join(push_cmd._iter_push_body(tarball, '1.0.0'))
+        out = json.loads(body.decode('utf-8'))['blob']
 
         outpath = os.path.join(scratch, "out")
         os.mkdir(outpath)
@@ -38,3 +46,218 @@ def test_create_base64_bundle(bundle_dir):
 
         # ensure the surrouding directory was packed into the tar archive
         assert directory_name in outfiles
+
+
+@pytest.mark.parametrize('release', ['1.0.0', 'a "quoted" release'])
+def test_iter_push_body(release):
+    tarball = io.BytesIO(os.urandom(3 * BASE64_CHUNK_SIZE + 1))
+    body = b''.join(PushCmd()._iter_push_body(tarball, release))
+
+    assert json.loads(body.decode('utf-8')) == {
+        'blob': base64.b64encode(tarball.getvalue()).decode('utf-8'),
+        'release': release,
+        'media_type': 'helm',
+    }
+
+
+def test_push_streams_body(monkeypatch):
+    posted = {}
+
+    class _Response():
+        status_code = 200
+
+    def post(uri, data, headers):
+        # the body is a generator, so requests sends it as a chunked upload
+        assert not isinstance(data, (bytes, str, dict))
+        posted['uri'] = uri
+        posted['body'] = json.loads(b''.join(data).decode('utf-8'))
+        return _Response()
+
+    monkeypatch.setattr(push.requests, 'post', post)
+    with TemporaryDirectory() as scratch:
+        bundle_dir = os.path.join(scratch, 'bundle')
+        copy_tree("tests/test_files/bundles/api/valid_flat_bundle", bundle_dir)
+        PushCmd().push(bundle_dir, 'namespace', 'repo', '1.0.0', 'token')
+
+    assert posted['uri'] == 'https://quay.io/cnr/api/v1/packages/namespace/repo'
+    assert posted['body']['release'] == '1.0.0'
+    tardata = base64.b64decode(posted['body']['blob'])
+    with tarfile.open(fileobj=io.BytesIO(tardata)) as tar:
+        assert 'repo/csv.yaml' in tar.getnames()
+
+
+class _ScriptedSession():
+    """Answers each post with the next scripted response or exception"""
+
+    def __init__(self, outcomes, lookups=()):
+        self.outcomes = list(outcomes)
+        self.lookups = list(lookups)
+        self.posts = 0
+        self.gets = []
+
+    def get(self, uri, headers):
+        self.gets.append(uri)
+        outcome = self.lookups.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def post(self, uri, data, headers):
+        b''.join(data)
+        self.posts += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class _ScriptedResponse():
+    def __init__(self, status_code, headers=None, json_data=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = 'status %d' % status_code
+        self.json_data = json_data
+
+    def json(self):
+        if self.json_data is not None:
+            return self.json_data
+        return {'error': {'message': self.text}}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(push.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_push_retries_transient_failures(sleeps):
+    session = _ScriptedSession([
+        push.requests.ConnectionError('connection reset'),
+        _ScriptedResponse(503),
+        _ScriptedResponse(429, {'Retry-After': '7'}),
+        _ScriptedResponse(200),
+    ])
+    push_cmd = PushCmd(session=session, retries=3, backoff=2)
+
+    result = push_cmd._push_to_registry('ns', 'repo', '1.0.0', io.BytesIO(b'x'),
+                                        'token')
+
+    assert result.attempts == 4
+    assert result.status_codes == [None, 503, 429, 200]
+    assert len(result.attempt_durations) == 4
+    # full jitter below the exponential backoff, then the Retry-After delay
+    assert 0 <= sleeps[0] <= 2
+    assert 0 <= sleeps[1] <= 4
+    assert sleeps[2] == 7
+
+
+@pytest.mark.parametrize('outcomes,error_type,posts', [
+    ([_ScriptedResponse(400)], errors.OpCourierQuayErrorResponse, 1),
+    ([_ScriptedResponse(500)] * 3, errors.OpCourierQuayErrorResponse, 3),
+    ([push.requests.Timeout('timed out')] * 3,
+     errors.OpCourierQuayCommunicationError, 3),
+    ([push.requests.exceptions.InvalidURL('bad url')],
+     errors.OpCourierQuayCommunicationError, 1),
+])
+def test_push_retries_exhausted(sleeps, outcomes, error_type, posts):
+    session = _ScriptedSession(outcomes)
+    push_cmd = PushCmd(session=session, retries=2)
+
+    with pytest.raises(error_type) as error:
+        push_cmd._push_to_registry('ns', 'repo', '1.0.0', io.BytesIO(b'x'), 'token')
+
+    assert session.posts == posts
+    assert error.value.push_result.attempts == posts
+    assert len(sleeps) == posts - 1
+
+
+@pytest.mark.parametrize('value,expected', [
+    (None, None),
+    ('120', 120.0),
+    ('-1', 0.0),
+    ('Wed, 21 Oct 2015 07:28:00 GMT', 0.0),
+    ('soon', None),
+])
+def test_parse_retry_after(value, expected):
+    assert push._parse_retry_after(value) == expected
+
+
+def test_create_tarball_is_reproducible():
+    bundle_dir = "tests/test_files/bundles/api/etcd_valid_nested_bundle"
+    with TemporaryDirectory() as scratch:
+        copy_dir = os.path.join(scratch, 'copy')
+        copy_tree(bundle_dir, copy_dir)
+        # touch every copied file, as a fresh checkout would
+        for root, _, files in os.walk(copy_dir):
+            for file_name in files:
+                os.utime(os.path.join(root, file_name), (1, 1))
+
+        tarballs = [io.BytesIO(), io.BytesIO()]
+        digests = [PushCmd()._create_tarball(bundle_dir, tarballs[0], 'etcd'),
+                   PushCmd()._create_tarball(copy_dir, tarballs[1], 'etcd')]
+
+    assert tarballs[0].getvalue() == tarballs[1].getvalue()
+    assert digests[0] == digests[1] == \
+        hashlib.sha256(tarballs[0].getvalue()).hexdigest()
+    assert digests[0] == PushCmd().get_digest(bundle_dir, 'etcd')
+
+    with tarfile.open(fileobj=tarballs[0]) as tar:
+        members = tar.getmembers()
+    names = [member.name for member in members]
+    assert names[0] == 'etcd'
+    assert names[1:] == sorted(names[1:], key=lambda name: name.split('/'))
+    assert {(member.mtime, member.uid, member.uname) for member in members} == \
+        {(0, 0, '')}
+
+
+@pytest.mark.parametrize('lookup,status,posts', [
+    ('same digest', 'unchanged', 0),
+    (_ScriptedResponse(200, json_data={'content': {'digest': 'other'}}), 'pushed', 1),
+    (_ScriptedResponse(404), 'pushed', 1),
+    (_ScriptedResponse(500), 'pushed', 1),
+    (push.requests.ConnectionError('connection reset'), 'pushed', 1),
+])
+def test_push_skip_unchanged(lookup, status, posts):
+    bundle_dir = "tests/test_files/bundles/api/etcd_valid_nested_bundle"
+    digest = PushCmd().get_digest(bundle_dir, 'etcd')
+    if lookup == 'same digest':
+        lookup = _ScriptedResponse(200, json_data={'content': {'digest': digest}})
+    session = _ScriptedSession([_ScriptedResponse(200)], [lookup])
+
+    with TemporaryDirectory() as scratch:
+        copy_tree(bundle_dir, scratch)
+        result = PushCmd(session=session, skip_unchanged=True).push(
+            scratch, 'ns', 'etcd', '1.0.0', 'token')
+
+    assert session.gets == ['https://quay.io/cnr/api/v1/packages/ns/etcd/1.0.0/helm']
+    assert result.status == status
+    assert result.digest == digest
+    assert session.posts == result.attempts == posts
+
+
+def test_push_excludes_black_list_without_deleting(monkeypatch):
+    posted = {}
+
+    def push_to_registry(namespace, repository, release, tarball, auth_token,
+                         result):
+        with tarfile.open(fileobj=tarball) as tar:
+            posted['names'] = tar.getnames()
+        return result
+
+    push_cmd = PushCmd()
+    monkeypatch.setattr(push_cmd, '_push_to_registry', push_to_registry)
+    with TemporaryDirectory() as scratch:
+        copy_tree("tests/test_files/bundles/api/valid_flat_bundle", scratch)
+        os.mkdir(os.path.join(scratch, 'sub'))
+        for path in ['art.yaml', os.path.join('sub', 'image-references')]:
+            with open(os.path.join(scratch, path), 'w') as black_listed_file:
+                black_listed_file.write('black listed')
+
+        push_cmd.push(scratch, 'ns', 'repo', '1.0.0', 'token')
+
+        assert os.path.exists(os.path.join(scratch, 'art.yaml'))
+        assert os.path.exists(os.path.join(scratch, 'sub', 'image-references'))
+
+    assert posted['names'] == ['repo', 'repo/crd.yml', 'repo/csv.yaml',
+                               'repo/packages.yaml']
@@ -0,0 +1,116 @@
+import json
+from distutils.dir_util import copy_tree
+from tempfile import TemporaryDirectory
+
+import pytest
+import requests
+from operatorcourier import api, push
+from operatorcourier.errors import OpCourierQuayErrorResponse
+from operatorcourier.push import PushCmd, create_session
+from operatorcourier.registry_server import RegistryServer
+
+BUNDLE_DIR = 'tests/test_files/bundles/api/etcd_valid_nested_bundle'
+
+
+def _push(push_cmd, release='1.0.0'):
+    with TemporaryDirectory() as scratch:
+        copy_tree(BUNDLE_DIR, scratch)
+        return push_cmd.push(scratch, 'ns', 'etcd', release, 'token')
+
+
+def test_push_and_lookup():
+    with RegistryServer() as server:
+        push_cmd = PushCmd(session=create_session(), registry_url=server.url,
+                           skip_unchanged=True)
+        result = _push(push_cmd)
+        unchanged_result = _push(push_cmd)
+
+        manifest = requests.get(
+            server.url + '/api/v1/packages/ns/etcd/1.0.0/helm').json()
+
+    assert result.status == 'pushed'
+    assert unchanged_result.status == 'unchanged'
+    assert manifest['content']['digest'] == result.digest
+    assert manifest['release'] == '1.0.0'
+    assert server.requests == {'GET': 3, 'POST': 1}
+
+
+def test_push_existing_release():
+    with RegistryServer() as server:
+        _push(PushCmd(registry_url=server.url))
+        with pytest.raises(OpCourierQuayErrorResponse) as error:
+            _push(PushCmd(registry_url=server.url))
+
+    assert error.value.code == 409
+
+
+def test_push_unchanged_with_other_compression(caplog):
+    with RegistryServer() as server:
+        _push(PushCmd(registry_url=server.url))
+        with pytest.raises(OpCourierQuayErrorResponse) as error:
+            _push(PushCmd(compresslevel=1, registry_url=server.url,
+                          skip_unchanged=True))
+
+    # the archive, and so its digest, depends on the compression settings
+    assert error.value.code == 409
+    assert 'depends on the compression level and threads' in caplog.text
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(push.time, 'sleep', lambda delay: None)
+
+
+def test_push_retries_injected_errors(no_backoff):
+    with RegistryServer(error_rate=0.5, seed=1) as server:
+        result = _push(PushCmd(registry_url=server.url, retries=20))
+
+    assert result.status_codes[-1] == 200
+    assert set(result.status_codes[:-1]) <= {503}
+    assert server.requests['POST'] == result.attempts
+
+
+def test_push_fails_on_injected_errors(no_backoff):
+    with RegistryServer(error_rate=1.0) as server:
+        with pytest.raises(OpCourierQuayErrorResponse) as error:
+            _push(PushCmd(registry_url=server.url, retries=2))
+
+    assert error.value.code == 503
+    assert error.value.push_result.attempts == 3
+
+
+def test_latency():
+    with RegistryServer(latency=0.2) as server:
+        result = _push(PushCmd(registry_url=server.url))
+
+    assert result.duration >= 0.2
+
+
+def test_registry_url_from_environment(monkeypatch):
+    monkeypatch.setenv(push.REGISTRY_URL_ENV, 'http://localhost:8080/')
+    assert PushCmd()._get_push_uri('ns', 'repo') == \
+        'http://localhost:8080/api/v1/packages/ns/repo'
+    assert PushCmd(registry_url='http://other')._get_push_uri('ns', 'repo') == \
+        'http://other/api/v1/packages/ns/repo'
+
+    monkeypatch.delenv(push.REGISTRY_URL_ENV)
+    assert PushCmd()._get_push_uri('ns', 'repo') == \
+        'https://quay.io/cnr/api/v1/packages/ns/repo'
+
+
+def test_push_phase_stats():
+    with RegistryServer() as server:
+        result = api.build_verify_and_push(
+            'ns', 'etcd', '1.0.0', 'token', source_dir=BUNDLE_DIR,
+            push_cmd=PushCmd(registry_url=server.url))
+
+    assert list(result.phase_durations) == ['validate', 'tar', 'gzip', 'digest',
+                                            'base64', 'upload']
+    assert all(duration >= 0 for duration in result.phase_durations.values())
+    assert result.tar_bytes > result.archive_bytes > 0
+    assert result.compression_ratio == result.tar_bytes / result.archive_bytes
+    # the base64 blob and the JSON around it
+    assert result.body_bytes > result.archive_bytes * 4 / 3
+    assert result.upload_throughput > 0
+    assert 'validate' in result.format_stats()
+    assert json.loads(json.dumps(result.to_dict()))['tar_bytes'] == result.tar_bytes
@@ -0,0 +1,193 @@
+import json
+import os
+import socket
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from operatorcourier import identify
+from operatorcourier.client import CourierClient, get_server_socket, \
+    _UnixHTTPConnection
+from operatorcourier.commands import run_command
+from operatorcourier.server import CourierServer
+
+FLAT_BUNDLE_DIR = 'tests/test_files/bundles/api/valid_flat_bundle'
+NESTED_BUNDLE_DIR = 'tests/test_files/bundles/api/etcd_valid_nested_bundle'
+INVALID_BUNDLE_DIR = 'tests/test_files/bundles/api/etcd_invalid_nested_bundle'
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / 'courier.sock')
+
+
+def test_run_command_nest(tmp_path):
+    output_dir = str(tmp_path / 'nested')
+    report = run_command(dict(id=7, command='nest', source_dir=FLAT_BUNDLE_DIR,
+                              output_dir=output_dir, dry_run=True))
+
+    assert report['id'] == 7
+    assert report['command'] == 'nest'
+    assert report['status'] == 'success'
+    assert report['errors'] == []
+    assert report['duration'] >= 0
+    assert sorted(operation['path'] for operation in report['result']) == [
+        '0.0.1/catalogsourceconfigs.marketplace.redhat.com.crd.yaml',
+        '0.0.1/marketplace-operator.v0.0.1.clusterserviceversion.yaml',
+        'marketplace.package.yaml',
+    ]
+    assert not os.path.exists(output_dir)
+
+
+@pytest.mark.parametrize('request_data,error', [
+    ([], 'A request must be a JSON object.'),
+    (dict(command='push'), "Unknown command 'push', expected one of: "
+                           "verify, nest, flatten."),
+    (dict(command='verify', source_dir=FLAT_BUNDLE_DIR, output_dir='out'),
+     "build_and_verify() got an unexpected keyword argument 'output_dir'"),
+    (dict(command='nest', source_dir='missing', output_dir='out'),
+     'The source directory missing does not exist.'),
+])
+def test_run_command_invalid_request(request_data, error):
+    report = run_command(request_data)
+
+    assert report['status'] == 'error'
+    assert report['errors'] == [error]
+
+
+def test_run_command_error_without_message(monkeypatch):
+    from operatorcourier import api
+
+    def raise_stop_iteration(**kwargs):
+        raise StopIteration
+
+    monkeypatch.setattr(api, 'flatten', raise_stop_iteration)
+    report = run_command(dict(command='flatten', source_dir=NESTED_BUNDLE_DIR,
+                              dest_dir='out'))
+
+    assert report['errors'] == ['StopIteration()']
+
+
+def test_run_command_verify_invalid_bundle():
+    report = run_command(dict(command='verify', source_dir=INVALID_BUNDLE_DIR))
+
+    assert report['status'] == 'error'
+    assert report['errors'][-1] == ('Resulting bundle is invalid, '
+                                    'input yaml is improperly defined.')
+    assert report['result']['validation']['errors'] == [
+        'csv apiVersion not defined.', 'csv spec.installModes not defined']
+
+
+def test_serve_concurrent_requests(socket_path, tmp_path):
+    with CourierServer(socket_path):
+        client = CourierClient(socket_path)
+        requests = [dict(command='verify', source_dir=NESTED_BUNDLE_DIR),
+                    dict(command='verify', source_dir=INVALID_BUNDLE_DIR)] * 3 + \
+            [dict(command='nest', source_dir=FLAT_BUNDLE_DIR,
+                  output_dir=str(tmp_path / 'nested'), sync=True)]
+        with ThreadPoolExecutor(4) as executor:
+            reports = list(executor.map(client.run, requests))
+        health = client.get_health()
+
+    assert [report['status'] for report in reports] == \
+        ['success', 'error'] * 3 + ['success']
+    # errors are collected per request, even when requests run concurrently
+    for report in reports[1:6:2]:
+        assert report['errors'] == reports[1]['errors']
+    assert reports[0]['result']['nested'] is True
+    assert reports[-1]['result']['added'] == [
+        '0.0.1/catalogsourceconfigs.marketplace.redhat.com.crd.yaml',
+        '0.0.1/marketplace-operator.v0.0.1.clusterserviceversion.yaml',
+        'marketplace.package.yaml',
+    ]
+    assert health['requests'] == 7
+    assert health['parse_cache']['hits'] > health['parse_cache']['misses']
+    # the parse cache is only used while serving
+    assert identify._parse_cache is None
+    assert not os.path.exists(socket_path)
+
+
+def test_client_resolves_relative_paths(monkeypatch):
+    client = CourierClient('courier.sock')
+    monkeypatch.setattr(client, '_request',
+                        lambda method, path, data=None: data)
+
+    request = client.run(dict(command='nest', source_dir=FLAT_BUNDLE_DIR,
+                              output_dir='nested', sync=True))
+
+    assert request == dict(command='nest', sync=True,
+                           source_dir=os.path.abspath(FLAT_BUNDLE_DIR),
+                           output_dir=os.path.abspath('nested'))
+
+
+def test_stale_socket(socket_path):
+    stale_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale_socket.bind(socket_path)
+    stale_socket.close()
+
+    with CourierServer(socket_path) as server:
+        assert CourierClient(socket_path).get_health()['status'] == 'ok'
+        with pytest.raises(OSError):
+            CourierServer(socket_path)
+    assert server.get_health()['requests'] == 0
+
+
+def test_socket_path_is_not_a_socket(socket_path):
+    with open(socket_path, 'w') as f:
+        f.write('precious')
+
+    with pytest.raises(OSError, match='is not a socket'):
+        CourierServer(socket_path)
+
+    with open(socket_path) as f:
+        assert f.read() == 'precious'
+
+
+def test_get_server_socket(socket_path, monkeypatch):
+    monkeypatch.setenv('OPERATOR_COURIER_SOCKET', socket_path)
+    assert get_server_socket() is None
+    with CourierServer(socket_path):
+        assert get_server_socket() == socket_path
+
+
+def _post(socket_path, body, headers):
+    connection = _UnixHTTPConnection(socket_path)
+    try:
+        connection.request('POST', '/', body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize('headers,status', [
+    ({'Content-Type': 'text/plain'}, 415),
+    ({'Content-Type': 'application/json', 'Origin': 'http://evil.example'}, 403),
+    ({'Content-Type': 'application/json', 'Host': 'evil.example'}, 403),
+    ({'Content-Type': 'application/json', 'Host': 'localhost:8080'}, 200),
+])
+def test_serve_rejects_cross_origin_requests(socket_path, headers, status):
+    body = json.dumps(dict(command='verify',
+                           source_dir=os.path.abspath(FLAT_BUNDLE_DIR)))
+    with CourierServer(socket_path) as server:
+        response_status, data = _post(socket_path, body, headers)
+
+    assert response_status == status
+    assert server.requests == (1 if status == 200 else 0)
+    if status == 200:
+        assert data['result']['nested'] is False
+
+
+def test_serve_rejects_delete(socket_path, tmp_path):
+    dest_dir = tmp_path / 'flat'
+    dest_dir.mkdir()
+    (dest_dir / 'precious.txt').write_text('precious')
+
+    with CourierServer(socket_path):
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        with pytest.raises(OSError, match='delete'):
+            CourierClient(socket_path).run(dict(
+                command='flatten', source_dir=NESTED_BUNDLE_DIR,
+                dest_dir=str(dest_dir), sync=True, delete=True))
+
+    assert os.listdir(str(dest_dir)) == ['precious.txt']